@@ -38,11 +38,12 @@ const App = () => {
   }, [chathistory]);
 
   const generateBotResponse = async (history) => {
-    const updateHistory = (text, images = [], prices = []) => {
+    // `streaming` marks a partial reply that the next update replaces in place
+    const updateHistory = (text, images = [], prices = [], streaming = false) => {
       setChathistory((prev) => {
         const newHistory = [
-          ...prev.filter((msg) => msg.text !== 'Thinking...'),
-          { from: 'model', text, image: images, price: prices, sessionId },
+          ...prev.filter((msg) => msg.text !== 'Thinking...' && !msg.streaming),
+          { from: 'model', text, image: images, price: prices, sessionId, streaming },
         ].slice(-maxHistoryLength);
         return newHistory;
       });
@@ -51,19 +52,14 @@ const App = () => {
     try {
       const userMessage = history[history.length - 1].text;
 
-      const formattedHistory = history.slice(0, -1).map((msg) => ({
-        role: msg.from === 'user' ? 'user' : 'assistant',
-        content: msg.text,
-      }));
-
-      const response = await fetch('http://127.0.0.1:8000/generate-response', {
+      const response = await fetch('http://127.0.0.1:8000/generate-response/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
+        // The server keeps the conversation for this session_id
         body: JSON.stringify({
           prompt: userMessage,
-          chat_history: formattedHistory,
           session_id: sessionId,
         }),
       });
@@ -75,13 +71,40 @@ const App = () => {
         return;
       }
 
-      const data = await response.json();
-
-      // Extract arrays of images and prices from all products
-      const images = data.products?.map((p) => p.image) || [];
-      const prices = data.products?.map((p) => p.price) || [];
-
-      updateHistory(data.response, images, prices);
+      // The backend streams newline-delimited JSON events: text tokens arrive
+      // as the model writes them and product cards as soon as each ID is known.
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let text = '';
+      const images = [];
+      const prices = [];
+
+      const handleEvent = (event) => {
+        if (event.type === 'token') {
+          text += event.text;
+          updateHistory(text, [...images], [...prices], true);
+        } else if (event.type === 'product') {
+          images.push(event.product.image);
+          prices.push(event.product.price);
+          updateHistory(text, [...images], [...prices], true);
+        } else if (event.type === 'done') {
+          updateHistory(event.response, images, prices);
+        } else if (event.type === 'error') {
+          console.error('Error from backend:', event.detail);
+          updateHistory('Error: ' + (event.detail || 'Unknown error occurred.'));
+        }
+      };
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter((line) => line.trim()).forEach((line) => handleEvent(JSON.parse(line)));
+      }
+      if (buffer.trim()) handleEvent(JSON.parse(buffer));
     } catch (error) {
       console.error('Fetch/network error:', error);
       updateHistory('Sorry, the chatbot is unavailable due to a network error.');
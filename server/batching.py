@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Coalesces concurrent single-item calls into one batched call. The first item
+# for a key opens a window of `max_wait` seconds; the batch is flushed when the
+# window closes or `max_batch_size` items are waiting, whichever comes first.
+# `handler(key, items)` is a coroutine returning one result per item, in order.
+class MicroBatcher:
+    def __init__(self, handler, max_batch_size=32, max_wait=0.002, name="batch"):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._pending = {}
+        self._timers = {}
+        self._tasks = set()  # batches in flight; the loop only keeps weak references
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item, key=None):
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((item, future))
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            task = asyncio.ensure_future(self._run(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, batch):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.handler(key, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name} handler returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            # A waiter may have been cancelled (client disconnected) in the meantime
+            if not future.done():
+                future.set_result(result)
+
+    # Flush whatever is still waiting for its window and wait for every batch in
+    # flight, so no caller is left with a future that never resolves
+    async def close(self):
+        for key in list(self._pending):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,152 @@
+# Throughput vs micro-batch window for the embed + vector query path.
+#
+# Usage (from server/):
+#   python bench/bench_batching.py --windows 0,1,2,5,10 --concurrency 64 --requests 2000
+#
+# Runs in process against an in-memory Chroma collection of random vectors.
+# The embedding API is simulated with a per-call latency (--embed-ms) plus a
+# per-text cost (--embed-item-ms) on a bounded thread pool, like the server's
+# vector-store executor. Upstream calls per request show the rate-limit
+# pressure; window 0 calls the backends directly, once per request.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb
+
+from batching import MicroBatcher
+
+COLORS = ["red", "blue", "black", "green", "white"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def random_vector(rng, dim):
+    return [rng.uniform(-1.0, 1.0) for _ in range(dim)]
+
+
+def build_collection(size, dim):
+    rng = random.Random(0)
+    client = chromadb.EphemeralClient()
+    collection = client.get_or_create_collection("bench_batching")
+    for start in range(0, size, 1000):
+        ids = [str(i) for i in range(start, min(size, start + 1000))]
+        collection.add(
+            ids=ids,
+            embeddings=[random_vector(rng, dim) for _ in ids],
+            metadatas=[{"color": COLORS[int(pid) % len(COLORS)]} for pid in ids],
+        )
+    return collection
+
+
+class Backend:
+    def __init__(self, collection, dim, embed_ms, embed_item_ms, workers):
+        self.collection = collection
+        self.dim = dim
+        self.embed_ms = embed_ms
+        self.embed_item_ms = embed_item_ms
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.embed_calls = 0
+        self.query_calls = 0
+
+    def embed(self, texts):
+        self.embed_calls += 1
+        time.sleep((self.embed_ms + self.embed_item_ms * len(texts)) / 1000)
+        rng = random.Random(hash(tuple(texts)))
+        return [random_vector(rng, self.dim) for _ in texts]
+
+    def query(self, embeddings, where, n_results):
+        self.query_calls += 1
+        query = {"query_embeddings": embeddings, "n_results": n_results}
+        if where:
+            query["where"] = json.loads(where)
+        return self.collection.query(**query)["ids"]
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+
+async def run_window(backend, window_ms, max_batch_size, concurrency, total, n_results):
+    backend.embed_calls = backend.query_calls = 0
+
+    async def embed_handler(key, texts):
+        return await backend.run(backend.embed, texts)
+
+    async def query_handler(key, embeddings):
+        return await backend.run(backend.query, embeddings, key, n_results)
+
+    embed_batcher = MicroBatcher(embed_handler, max_batch_size, window_ms / 1000, "embedding")
+    query_batcher = MicroBatcher(query_handler, max_batch_size, window_ms / 1000, "vector query")
+
+    async def embed(text):
+        if window_ms <= 0:
+            return (await backend.run(backend.embed, [text]))[0]
+        return await embed_batcher.submit(text)
+
+    async def query(embedding, where):
+        if window_ms <= 0:
+            return (await backend.run(backend.query, [embedding], where, n_results))[0]
+        return await query_batcher.submit(embedding, key=where)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            embedding = await embed(f"prompt {i}")
+            # A few distinct filters, as constraint parsing would produce
+            where = json.dumps({"color": COLORS[i % 3]}) if i % 2 else None
+            await query(embedding, where)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    return total / elapsed, latencies, embed_batcher.stats(), backend.embed_calls, backend.query_calls
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--windows", default="0,1,2,5,10", help="batch windows in ms")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--n-results", type=int, default=20)
+    parser.add_argument("--embed-ms", type=float, default=40.0)
+    parser.add_argument("--embed-item-ms", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    collection = build_collection(args.products, args.dim)
+    backend = Backend(collection, args.dim, args.embed_ms, args.embed_item_ms, args.workers)
+    print(f"{args.products} products, concurrency {args.concurrency}, {args.requests} requests, "
+          f"{args.workers} workers, embed {args.embed_ms}ms + {args.embed_item_ms}ms/text")
+    for window in [float(value) for value in args.windows.split(",")]:
+        throughput, latencies, stats, embed_calls, query_calls = await run_window(
+            backend, window, args.max_batch_size, args.concurrency, args.requests, args.n_results
+        )
+        print(
+            f"window {window:5.1f}ms: {throughput:8.1f} req/s  "
+            f"p50 {percentile(latencies, 50):7.1f}ms  p99 {percentile(latencies, 99):7.1f}ms  "
+            f"embed calls/req {embed_calls / args.requests:.3f}  query calls/req {query_calls / args.requests:.3f}  "
+            f"mean embed batch {stats['mean_batch_size'] or 1.0}"
+        )
+    backend.executor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
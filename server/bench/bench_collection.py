@@ -0,0 +1,72 @@
+# Compare per-request collection construction against the pooled CollectionHolder.
+#
+# Usage (from server/):
+#   python bench/bench_collection.py --iterations 200
+#
+# The embedding function is never invoked, so no OpenAI key or network is needed.
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb
+from chromadb.utils import embedding_functions
+
+from chroma_pool import CollectionHolder
+from collection_alias import CollectionAlias
+
+
+def make_embedding_function():
+    return embedding_functions.OpenAIEmbeddingFunction(
+        api_key=os.getenv("OPENAI_API_KEY", "sk-bench"),
+        model_name="text-embedding-ada-002"
+    )
+
+
+def per_request(path, name):
+    # Mirrors the old get_chroma_collection dependency
+    client = chromadb.PersistentClient(path=path)
+    client.heartbeat()
+    return client.get_or_create_collection(
+        CollectionAlias(path, name).active(), embedding_function=make_embedding_function()
+    )
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(label, fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        collection = fn()
+        collection.count()
+        samples.append((time.perf_counter() - start) * 1000)
+    print(
+        f"{label:<12} p50={percentile(samples, 50):8.3f} ms  "
+        f"p99={percentile(samples, 99):8.3f} ms  mean={statistics.mean(samples):8.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="./chroma_db")
+    parser.add_argument("--collection", default="Clothes_products")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    run("before", lambda: per_request(args.path, args.collection), args.iterations)
+
+    holder = CollectionHolder(args.path, CollectionAlias(args.path, args.collection), make_embedding_function)
+    holder.get()
+    run("after", holder.get, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
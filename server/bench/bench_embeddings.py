@@ -0,0 +1,84 @@
+# Compare an embedding backend's retrieval against the ada collection.
+#
+# Usage (from server/), after building a collection with reembed.py:
+#   python bench/bench_embeddings.py --candidate Clothes_products_v2 --k 5
+#
+# Queries are the user turns of client/src/test.jsonl. For each query the ada
+# collection's top-k is the reference; recall@k is the share of it that the
+# candidate collection also returns. Query-embedding latency is reported for
+# both backends.
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+from collection_alias import CollectionAlias
+from db_store import COLLECTION_NAME, connect
+from embeddings import backend_of, make_embedding_function
+
+DEFAULT_QUERIES = os.path.join(os.path.dirname(__file__), "..", "..", "client", "src", "test.jsonl")
+
+
+def load_queries(path, limit):
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            conversation = json.loads(line)
+            for message in conversation.get("messages", []):
+                if message.get("role") == "user" and message.get("content", "").strip():
+                    queries.append(message["content"].strip())
+            if len(queries) >= limit:
+                break
+    return queries[:limit]
+
+
+def timed_embed(function, query):
+    start = time.perf_counter()
+    embedding = function([query])[0]
+    return embedding, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chroma-path", default="./chroma_db")
+    parser.add_argument("--reference", help="ada collection (default: the legacy/active one)")
+    parser.add_argument("--candidate", required=True)
+    parser.add_argument("--queries", default=DEFAULT_QUERIES)
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = connect(args.chroma_path)
+    reference = client.get_collection(args.reference or CollectionAlias(args.chroma_path, COLLECTION_NAME).active())
+    candidate = client.get_collection(args.candidate)
+    reference_fn = make_embedding_function(backend_of(reference), api_key=os.getenv("OPENAI_API_KEY"))
+    candidate_fn = make_embedding_function(backend_of(candidate), api_key=os.getenv("OPENAI_API_KEY"))
+
+    recalls, reference_ms, candidate_ms = [], [], []
+    for query in load_queries(args.queries, args.limit):
+        reference_embedding, elapsed = timed_embed(reference_fn, query)
+        reference_ms.append(elapsed)
+        candidate_embedding, elapsed = timed_embed(candidate_fn, query)
+        candidate_ms.append(elapsed)
+
+        expected = set(reference.query(query_embeddings=[reference_embedding], n_results=args.k)["ids"][0])
+        found = set(candidate.query(query_embeddings=[candidate_embedding], n_results=args.k)["ids"][0])
+        if expected:
+            recalls.append(len(expected & found) / len(expected))
+
+    print(f"queries={len(recalls)}  k={args.k}")
+    print(f"recall@{args.k} of {candidate.name} ({backend_of(candidate)}) vs {reference.name}: "
+          f"{statistics.mean(recalls):.3f}")
+    print(f"query embedding p50: {backend_of(reference)}={statistics.median(reference_ms):.2f} ms  "
+          f"{backend_of(candidate)}={statistics.median(candidate_ms):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
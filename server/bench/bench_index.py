@@ -0,0 +1,170 @@
+# Memory / latency / recall report for the vector index options.
+#
+# Usage (from server/):
+#   python bench/bench_index.py                       # vectors of the active collection
+#   python bench/bench_index.py --scale 10            # ... replicated with noise to 10x the catalogue
+#   python bench/bench_index.py --synthetic 100000 --dim 1536
+#
+# Compares, against exact float32 search as ground truth:
+#   - Chroma HNSW for each --hnsw-m and --search-ef combination
+#   - the int8 QuantizedIndex without re-ranking and with each --rerank depth
+# Queries are catalogue vectors plus Gaussian noise, so no embedding API is
+# needed. Memory is the resident index size (HNSW: vectors plus level-0
+# links, an estimate; int8: codes plus scales, the float32 copy being mmapped).
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from vector_index import QuantizedIndex
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def load_vectors(args, rng):
+    if args.synthetic:
+        return normalize(rng.standard_normal((args.synthetic, args.dim)).astype(np.float32))
+    from collection_alias import CollectionAlias
+    from db_store import COLLECTION_NAME, connect
+
+    client = connect(args.chroma_path)
+    collection = client.get_collection(args.collection or CollectionAlias(args.chroma_path, COLLECTION_NAME).active())
+    pages, offset = [], 0
+    while True:
+        page = collection.get(limit=1000, offset=offset, include=["embeddings"])
+        if not len(page["ids"]):
+            break
+        pages.append(np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+    print(f"Loaded {offset} vectors from {collection.name}")
+    return normalize(np.concatenate(pages))
+
+
+# Stand-in collection for QuantizedIndex.build
+class ArrayCollection:
+    name = "bench_index"
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def get(self, limit, offset, include):
+        rows = self.vectors[offset:offset + limit]
+        return {"ids": [str(i) for i in range(offset, offset + len(rows))], "embeddings": rows}
+
+
+def recall(found, truth):
+    return statistics.mean(len(set(f) & set(t)) / len(t) for f, t in zip(found, truth))
+
+
+def timed_queries(search, queries):
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found.append(search(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return found, latencies
+
+
+def report(name, memory, build_seconds, latencies, found, truth):
+    print(
+        f"{name:<28} {memory / 2 ** 20:9.1f} MB  build {build_seconds:7.1f}s  "
+        f"p50 {percentile(latencies, 50):7.2f}ms  p99 {percentile(latencies, 99):7.2f}ms  "
+        f"recall {recall(found, truth):.3f}"
+    )
+
+
+def bench_hnsw(vectors, queries, truth, k, m_values, ef_values, construction_ef):
+    try:
+        import chromadb
+    except ImportError:
+        print("chromadb not installed; skipping HNSW")
+        return
+    client = chromadb.EphemeralClient()
+    ids = [str(i) for i in range(len(vectors))]
+    for m in m_values:
+        name = f"bench_hnsw_m{m}"
+        start = time.perf_counter()
+        collection = client.create_collection(
+            name, metadata={"hnsw:M": m, "hnsw:construction_ef": construction_ef, "hnsw:space": "l2"}
+        )
+        for offset in range(0, len(vectors), 5000):
+            collection.add(ids=ids[offset:offset + 5000], embeddings=vectors[offset:offset + 5000].tolist())
+        build_seconds = time.perf_counter() - start
+        memory = vectors.shape[0] * (vectors.shape[1] * 4 + m * 2 * 4)
+        for ef in ef_values:
+            collection.modify(metadata={"hnsw:M": m, "hnsw:construction_ef": construction_ef, "hnsw:search_ef": ef})
+            found, latencies = timed_queries(
+                lambda query: [int(pid) for pid in collection.query(query_embeddings=[query.tolist()], n_results=k)["ids"][0]],
+                queries,
+            )
+            report(f"hnsw M={m} ef_search={ef}", memory, build_seconds, latencies, found, truth)
+        client.delete_collection(name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chroma-path", default="./chroma_db")
+    parser.add_argument("--collection", help="default: the active collection")
+    parser.add_argument("--synthetic", type=int, help="use N random vectors instead of the catalogue")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--scale", type=int, default=1, help="replicate the catalogue with noise N times")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--hnsw-m", default="16,32")
+    parser.add_argument("--search-ef", default="10,50,100")
+    parser.add_argument("--construction-ef", type=int, default=100)
+    parser.add_argument("--rerank", default="32,64,128")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = load_vectors(args, rng)
+    if args.scale > 1:
+        copies = [vectors] + [
+            normalize(vectors + args.noise * rng.standard_normal(vectors.shape).astype(np.float32))
+            for _ in range(args.scale - 1)
+        ]
+        vectors = np.concatenate(copies)
+    rows = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    queries = normalize(vectors[rows] + args.noise * rng.standard_normal((len(rows), vectors.shape[1])).astype(np.float32))
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, recall@{args.k}")
+
+    found, latencies = timed_queries(lambda query: list(np.argsort(-(vectors @ query))[:args.k]), queries)
+    truth = found
+    report("exact float32", vectors.nbytes, 0.0, latencies, found, truth)
+
+    bench_hnsw(
+        vectors, queries, truth, args.k,
+        [int(m) for m in args.hnsw_m.split(",")], [int(ef) for ef in args.search_ef.split(",")], args.construction_ef,
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        index = QuantizedIndex.build(ArrayCollection(vectors), os.path.join(directory, "index"))
+        build_seconds = time.perf_counter() - start
+        for rerank in [0] + [int(depth) for depth in args.rerank.split(",")]:
+            index.rerank = rerank
+            found, latencies = timed_queries(
+                lambda query: [int(pid) for pid in index.query([query], args.k)["ids"][0]], queries
+            )
+            label = f"int8 rerank={rerank}" if rerank else "int8 no rerank"
+            report(label, index.memory_bytes(), build_seconds, latencies, found, truth)
+
+
+if __name__ == "__main__":
+    main()
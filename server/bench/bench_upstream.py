@@ -0,0 +1,167 @@
+# Exercises the upstream gateway (upstream.py) against the fault-injecting stub.
+#
+# Usage (from server/):
+#   uvicorn bench.stub_openai:app --port 9000
+#   python bench/bench_upstream.py --base-url http://127.0.0.1:9000/v1
+#
+# Scenarios, each reconfiguring the stub through POST /stub/faults:
+#   overload  a burst of --burst chat calls into a gateway with --concurrency
+#             slots and --queue waiting room: accepted calls complete, the rest
+#             are shed immediately with a Retry-After instead of piling up
+#   outage    every call fails with a 500 until the circuit opens and calls fail
+#             fast; after the stub recovers and the cooldown passes, a trial
+#             call closes the circuit again
+#   deadline  the stub stalls every call past the gateway deadline
+#   tail      --stall-rate of calls stall for --stall-ms; p99 with and without
+#             hedging after --hedge-ms
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import openai
+
+from upstream import UpstreamGateway, UpstreamUnavailable
+
+MESSAGES = [{"role": "user", "content": "black saree for a wedding"}]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def is_failure(error):
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
+
+async def set_faults(args, **faults):
+    base = args.base_url.rsplit("/v1", 1)[0]
+    async with httpx.AsyncClient() as http:
+        (await http.post(f"{base}/stub/faults", json=faults)).raise_for_status()
+
+
+async def timed_call(gateway, client, hedge=False):
+    start = time.perf_counter()
+    try:
+        await gateway.call(
+            lambda: client.chat.completions.create(model="gpt-3.5-turbo", messages=MESSAGES, max_tokens=50),
+            hedge=hedge,
+        )
+        outcome = "ok"
+    except UpstreamUnavailable as e:
+        outcome = f"{type(e).__name__}(retry_after={e.retry_after:g})"
+    except openai.OpenAIError as e:
+        outcome = type(e).__name__
+    return outcome, (time.perf_counter() - start) * 1000
+
+
+def report(label, results):
+    by_outcome = {}
+    for outcome, latency in results:
+        by_outcome.setdefault(outcome, []).append(latency)
+    print(label)
+    for outcome, latencies in sorted(by_outcome.items()):
+        print(
+            f"  {outcome:<40} {len(latencies):5d} calls  p50 {percentile(latencies, 50):8.1f}ms  "
+            f"p99 {percentile(latencies, 99):8.1f}ms  max {max(latencies):8.1f}ms"
+        )
+
+
+def make_gateway(args, events, **overrides):
+    settings = {
+        "max_concurrency": args.concurrency,
+        "max_queue": args.queue,
+        "deadline": args.deadline,
+        "failure_threshold": 5,
+        "cooldown": args.cooldown,
+        "is_failure": is_failure,
+        "on_event": lambda name, event: events.update([event]),
+    }
+    settings.update(overrides)
+    return UpstreamGateway("chat", **settings)
+
+
+async def overload(args, client):
+    await set_faults(args, error_rate=0, rate_limit_rate=0, stall_rate=0, latency_ms=args.latency_ms)
+    events = Counter()
+    gateway = make_gateway(args, events)
+    results = await asyncio.gather(*(timed_call(gateway, client) for _ in range(args.burst)))
+    report(f"overload: {args.burst} concurrent calls, {args.concurrency} slots + {args.queue} queued", results)
+    print(f"  events {dict(events)}")
+
+
+async def outage(args, client):
+    events = Counter()
+    gateway = make_gateway(args, events)
+    await set_faults(args, error_rate=1.0, stall_rate=0, latency_ms=args.latency_ms)
+    results = [await timed_call(gateway, client) for _ in range(10)]
+    report("outage: stub answers 500 to everything", results)
+    print(f"  circuit {gateway.breaker.state}")
+    await set_faults(args, error_rate=0)
+    await asyncio.sleep(args.cooldown)
+    results = [await timed_call(gateway, client) for _ in range(3)]
+    report(f"recovery: stub healthy, {args.cooldown:g}s cooldown passed", results)
+    print(f"  circuit {gateway.breaker.state}  events {dict(events)}")
+
+
+async def deadline(args, client):
+    events = Counter()
+    gateway = make_gateway(args, events, deadline=args.latency_ms / 1000 * 2)
+    await set_faults(args, error_rate=0, stall_rate=1.0, stall_ms=args.stall_ms)
+    results = await asyncio.gather(*(timed_call(gateway, client) for _ in range(args.concurrency)))
+    report(f"deadline: every call stalls {args.stall_ms:g}ms, deadline {gateway.deadline:g}s", results)
+    print(f"  events {dict(events)}")
+
+
+async def tail(args, client):
+    await set_faults(args, error_rate=0, stall_rate=args.stall_rate, stall_ms=args.stall_ms, latency_ms=args.latency_ms)
+    for hedge_ms in (0, args.hedge_ms):
+        events = Counter()
+        gateway = make_gateway(args, events, hedge_after=hedge_ms / 1000, deadline=args.stall_ms / 1000 * 2)
+        results = []
+        for _ in range(args.requests // args.concurrency):
+            results.extend(await asyncio.gather(*(timed_call(gateway, client, hedge=True) for _ in range(args.concurrency))))
+        label = f"hedge after {hedge_ms:g}ms" if hedge_ms else "no hedging"
+        report(f"tail: {args.stall_rate:.0%} of calls stall {args.stall_ms:g}ms, {label}", results)
+        latencies = [latency for outcome, latency in results if outcome == "ok"]
+        print(f"  mean {statistics.mean(latencies):.1f}ms  events {dict(events)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:9000/v1")
+    parser.add_argument("--scenarios", default="overload,outage,deadline,tail")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--queue", type=int, default=8)
+    parser.add_argument("--burst", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=400, help="calls per tail run")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--deadline", type=float, default=10.0)
+    parser.add_argument("--cooldown", type=float, default=2.0)
+    parser.add_argument("--stall-rate", type=float, default=0.05)
+    parser.add_argument("--stall-ms", type=float, default=3000)
+    parser.add_argument("--hedge-ms", type=float, default=500)
+    args = parser.parse_args()
+
+    client = openai.AsyncOpenAI(api_key="sk-stub", base_url=args.base_url, max_retries=0)
+    scenarios = {"overload": overload, "outage": outage, "deadline": deadline, "tail": tail}
+    try:
+        for name in args.scenarios.split(","):
+            await scenarios[name](args, client)
+    finally:
+        await set_faults(args, error_rate=0, rate_limit_rate=0, stall_rate=0, latency_ms=None)
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+# Concurrency scaling check for /generate-response.
+#
+# Start bench/stub_openai.py and the server pointed at it (see the stub's header),
+# then run from server/:
+#   python bench/load_test.py --concurrency 1,4,16,64 --requests 64
+#
+# With a non-blocking request path, throughput should grow roughly with the
+# number of in-flight requests while the stub's chat latency dominates; a
+# blocking path stays near 1 / latency regardless of concurrency.
+#
+# --stream targets /generate-response/stream and also reports time to first byte.
+#
+# Every request gets its own prompt and history, drawn from --seed, so repeats
+# are rare; still, to measure the full request path start the server with
+#   RESPONSE_CACHE_SIZE=0 INTENT_FAST_PATH=0
+# Each level reports its cache hit rate from /metrics: requests answered from
+# the response cache or the popular-query table rather than by the model.
+import argparse
+import asyncio
+import random
+import re
+import time
+
+import httpx
+
+COLORS = ["red", "black", "blue", "green", "white", "pink", "yellow", "maroon", "navy", "beige"]
+ITEMS = ["kurti", "saree", "dress", "jacket", "top", "lehenga", "jeans", "shirt", "skirt", "dupatta"]
+OCCASIONS = ["a party", "office", "a wedding", "college", "a festival", "travel", "a date", "everyday wear"]
+CEILINGS = [None, 500, 1000, 2000, 5000]
+
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+
+def make_prompt(rng):
+    prompt = f"{rng.choice(COLORS)} {rng.choice(ITEMS)} for {rng.choice(OCCASIONS)}"
+    ceiling = rng.choice(CEILINGS)
+    return prompt if ceiling is None else f"{prompt} under {ceiling}"
+
+
+def make_history(rng):
+    history = []
+    for _ in range(rng.randint(0, 2)):
+        history.append({"role": "user", "content": make_prompt(rng)})
+        history.append({"role": "assistant", "content": f"Here are some {rng.choice(ITEMS)}s you might like."})
+    return history
+
+
+# Sample values from the server's /metrics for the given metric names, keyed by (name, labels)
+async def scrape(client, url, names):
+    response = await client.get(url)
+    response.raise_for_status()
+    totals = {}
+    for line in response.text.splitlines():
+        match = SAMPLE.match(line)
+        if match is None or match.group(1) not in names:
+            continue
+        key = (match.group(1), match.group(2) or "")
+        totals[key] = totals.get(key, 0.0) + float(match.group(3))
+    return totals
+
+
+CACHE_HITS = [
+    ("chatbot_response_cache_lookups_total", 'result="hit"'),
+    ("chatbot_popular_query_hits_total", 'kind="response"'),
+]
+
+
+def cache_hits(before, after):
+    return sum(after.get(key, 0.0) - before.get(key, 0.0) for key in CACHE_HITS)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_level(client, url, concurrency, total, rng):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    first_bytes = []
+    errors = 0
+    payloads = [
+        {"prompt": make_prompt(rng), "chat_history": make_history(rng), "session_id": f"load-{rng.getrandbits(48):x}"}
+        for _ in range(total)
+    ]
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            first_byte = None
+            async with client.stream("POST", url, json=payloads[i]) as response:
+                async for _ in response.aiter_bytes():
+                    if first_byte is None:
+                        first_byte = (time.perf_counter() - start) * 1000
+            first_bytes.append(first_byte if first_byte is not None else 0.0)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    return total / elapsed, latencies, first_bytes, errors
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000/generate-response")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--metrics-url", default=None, help="defaults to /metrics on the --url host")
+    args = parser.parse_args()
+    url = args.url + "/stream" if args.stream else args.url
+    metrics_url = args.metrics_url or str(httpx.URL(args.url).copy_with(path="/metrics"))
+    rng = random.Random(args.seed)
+    names = {name for name, _ in CACHE_HITS}
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        baseline = None
+        for concurrency in levels:
+            before = await scrape(client, metrics_url, names)
+            throughput, latencies, first_bytes, errors = await run_level(client, url, concurrency, args.requests, rng)
+            hit_rate = cache_hits(before, await scrape(client, metrics_url, names)) / args.requests
+            baseline = baseline or throughput
+            print(
+                f"concurrency={concurrency:<4} throughput={throughput:7.2f} req/s  "
+                f"scaling={throughput / baseline:5.2f}x  p50={percentile(latencies, 50):8.1f} ms  "
+                f"p99={percentile(latencies, 99):8.1f} ms  ttfb_p50={percentile(first_bytes, 50):8.1f} ms  "
+                f"cache_hit={hit_rate:6.1%}  errors={errors}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,303 @@
+# Replay benchmark for /generate-response.
+#
+# Start the stub and the server against it (see bench/stub_openai.py), with
+# Server-Timing enabled so per-stage durations come back on every response and
+# the response cache off, since every level replays the same conversations:
+#   STUB_LATENCY_DIST=lognormal STUB_CHAT_LATENCY_MS=800 uvicorn bench.stub_openai:app --port 9000
+#   SERVER_TIMING=1 RESPONSE_CACHE_SIZE=0 OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=sk-stub \
+#     uvicorn main:app --port 8000
+# then, from server/:
+#   python bench/replay.py --concurrency 1,8,32 --limit 300 --report before.json
+#   ... change something, restart the server ...
+#   python bench/replay.py --concurrency 1,8,32 --limit 300 --compare before.json
+#
+# Conversations come from client/src/test.jsonl, or from a file recorded with
+# RECORD_REQUESTS_PATH (one line per request, grouped back into sessions).
+# Each conversation runs its turns in order under its own session_id; up to
+# --concurrency conversations run at once.
+#
+# recall@k is the share of turns with a reference answer where one of the first
+# k products returned is named in that turn's prompt or reference answer. The
+# stub recommends the first candidates in retrieval order, so against the stub
+# this measures retrieval; use a local embedding backend (EMBEDDING_BACKEND=
+# hashing or sentence-transformers), since stub embeddings are random.
+#
+# Each level also reports, from /metrics, how many turns skipped the model:
+# response cache hits, precomputed popular-query answers and follow-ups
+# answered by the intent fast path. Query embeddings cached by an earlier level
+# still make later ones faster; for fully cold levels, restart the server and
+# run one level at a time (--concurrency 8).
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+
+import httpx
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(__file__), "..", "..", "client", "src", "test.jsonl")
+
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+CACHE_COUNTERS = {
+    "chatbot_response_cache_lookups_total",
+    "chatbot_popular_query_hits_total",
+    "chatbot_fast_path_answers_total",
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def normalize(text):
+    return " " + " ".join(re.findall(r"[a-z0-9]+", str(text).lower())) + " "
+
+
+# A conversation is a list of turns: {"prompt", "reference", "chat_history"}
+def load_conversations(path, limit):
+    conversations = []
+    sessions = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "messages" in record:
+                turns, history = [], []
+                messages = record["messages"]
+                for i, message in enumerate(messages):
+                    if message.get("role") == "user" and message.get("content", "").strip():
+                        reply = messages[i + 1] if i + 1 < len(messages) else None
+                        reference = reply["content"] if reply and reply.get("role") == "assistant" else None
+                        turns.append({
+                            "prompt": message["content"],
+                            "reference": reference,
+                            "chat_history": list(history),
+                        })
+                    history.append({"role": message["role"], "content": message.get("content", "")})
+                if turns:
+                    conversations.append(turns)
+            elif "prompt" in record:
+                # Recorded traffic: regroup by session, keeping arrival order
+                key = record.get("session_id") or f"anonymous-{len(sessions)}"
+                if key not in sessions:
+                    sessions[key] = []
+                    conversations.append(sessions[key])
+                sessions[key].append({
+                    "prompt": record["prompt"],
+                    "reference": None,
+                    "chat_history": record.get("chat_history") or [],
+                })
+            if len(conversations) >= limit:
+                break
+    return conversations[:limit]
+
+
+# Counter values from the server's /metrics, keyed by (name, labels)
+async def scrape(client, url):
+    response = await client.get(url)
+    response.raise_for_status()
+    totals = {}
+    for line in response.text.splitlines():
+        match = SAMPLE.match(line)
+        if match is not None and match.group(1) in CACHE_COUNTERS:
+            key = (match.group(1), match.group(2) or "")
+            totals[key] = totals.get(key, 0.0) + float(match.group(3))
+    return totals
+
+
+# What the level's turns were served from, from the counter deltas
+def cache_usage(before, after):
+    def delta(name, labels=None):
+        return sum(
+            value - before.get(key, 0.0) for key, value in after.items()
+            if key[0] == name and (labels is None or key[1] == labels)
+        )
+
+    hits = delta("chatbot_response_cache_lookups_total", 'result="hit"')
+    lookups = delta("chatbot_response_cache_lookups_total")
+    return {
+        "response_cache_hit_rate": hits / lookups if lookups else 0.0,
+        "response_cache_hits": int(hits),
+        "popular_answers": int(delta("chatbot_popular_query_hits_total", 'kind="response"')),
+        "fast_path_answers": int(delta("chatbot_fast_path_answers_total")),
+    }
+
+
+def parse_server_timing(header):
+    stages = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        match = re.search(r"dur=([\d.]+)", params)
+        if name and match:
+            stages[name] = float(match.group(1))
+    return stages
+
+
+class Results:
+    def __init__(self, ks):
+        self.ks = ks
+        self.latencies = []
+        self.first_bytes = []
+        self.stages = {}
+        self.errors = 0
+        self.judged = 0
+        self.hits = {k: 0 for k in ks}
+
+    def add(self, latency, first_byte, timing, status, products, turn):
+        self.latencies.append(latency)
+        if first_byte is not None:
+            self.first_bytes.append(first_byte)
+        for stage, duration in parse_server_timing(timing).items():
+            self.stages.setdefault(stage, []).append(duration)
+        if status != 200:
+            self.errors += 1
+            return
+        if turn["reference"]:
+            self.judged += 1
+            text = normalize(turn["prompt"] + " " + turn["reference"])
+            names = [normalize(product.get("name") or product.get("Title") or "") for product in products]
+            for k in self.ks:
+                if any(name.strip() and name in text for name in names[:k]):
+                    self.hits[k] += 1
+
+
+async def replay(client, url, conversations, concurrency, history_mode, stream, ks, run_id):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = Results(ks)
+
+    async def turn_request(session_id, turn):
+        payload = {"prompt": turn["prompt"], "session_id": session_id}
+        if history_mode == "client":
+            payload["chat_history"] = turn["chat_history"]
+        start = time.perf_counter()
+        first_byte = None
+        products = []
+        async with client.stream("POST", url, json=payload) as response:
+            body = []
+            async for chunk in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = (time.perf_counter() - start) * 1000
+                body.append(chunk)
+        latency = (time.perf_counter() - start) * 1000
+        if response.status_code == 200:
+            text = b"".join(body).decode("utf-8")
+            if stream:
+                events = [json.loads(line) for line in text.splitlines() if line.strip()]
+                done = next((event for event in events if event.get("type") == "done"), {})
+                products = done.get("products", [])
+            else:
+                products = json.loads(text).get("products", [])
+        results.add(latency, first_byte if stream else None, response.headers.get("server-timing"),
+                    response.status_code, products, turn)
+
+    async def conversation(index, turns):
+        async with semaphore:
+            session_id = f"replay-{run_id}-{index}"
+            for turn in turns:
+                try:
+                    await turn_request(session_id, turn)
+                except httpx.HTTPError as e:
+                    results.errors += 1
+                    results.latencies.append(0.0)
+                    print(f"  request failed: {e!r}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation(i, turns) for i, turns in enumerate(conversations)))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed, cache):
+    summary = {
+        "requests": len(results.latencies),
+        "errors": results.errors,
+        "throughput": len(results.latencies) / elapsed if elapsed else 0.0,
+        "stages": {},
+        "recall": {str(k): (results.hits[k] / results.judged if results.judged else None) for k in results.ks},
+        "judged": results.judged,
+        "cache": cache,
+    }
+    series = {"total": results.latencies, **results.stages}
+    if results.first_bytes:
+        series["first_byte"] = results.first_bytes
+    for stage, samples in series.items():
+        if samples:
+            summary["stages"][stage] = {
+                "p50": percentile(samples, 50), "p95": percentile(samples, 95), "p99": percentile(samples, 99),
+            }
+    return summary
+
+
+def print_summary(concurrency, summary, baseline=None):
+    print(f"concurrency {concurrency}: {summary['throughput']:.1f} req/s, "
+          f"{summary['requests']} requests, {summary['errors']} errors")
+    for stage, values in summary["stages"].items():
+        line = f"  {stage:<18} p50 {values['p50']:8.1f}ms  p95 {values['p95']:8.1f}ms  p99 {values['p99']:8.1f}ms"
+        previous = (baseline or {}).get("stages", {}).get(stage)
+        if previous:
+            line += "  (" + "  ".join(
+                f"{pct} {values[pct] - previous[pct]:+.1f}ms" for pct in ("p50", "p95", "p99")
+            ) + ")"
+        print(line)
+    recall = "  ".join(
+        f"@{k} {value:.3f}" if value is not None else f"@{k} n/a" for k, value in summary["recall"].items()
+    )
+    print(f"  recall {recall}  over {summary['judged']} judged turns")
+    cache = summary["cache"]
+    print(f"  response cache hit rate {cache['response_cache_hit_rate']:.1%} ({cache['response_cache_hits']} hits), "
+          f"{cache['popular_answers']} popular-query answers, {cache['fast_path_answers']} fast-path answers")
+    if baseline:
+        print(f"  throughput vs baseline: {summary['throughput'] - baseline['throughput']:+.1f} req/s")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000/generate-response")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="test.jsonl or a recorded requests file")
+    parser.add_argument("--limit", type=int, default=200, help="conversations to replay")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--history", choices=["session", "client"], default="session",
+                        help="server-side session history, or send chat_history like older clients")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--k", default="1,2,4")
+    parser.add_argument("--report", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON report of an earlier run to print deltas against")
+    parser.add_argument("--metrics-url", default=None, help="defaults to /metrics on the --url host")
+    args = parser.parse_args()
+
+    url = args.url + "/stream" if args.stream else args.url
+    metrics_url = args.metrics_url or str(httpx.URL(args.url).copy_with(path="/metrics"))
+    conversations = load_conversations(args.source, args.limit)
+    ks = [int(k) for k in args.k.split(",")]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(f"Replaying {len(conversations)} conversations, "
+          f"{sum(len(turns) for turns in conversations)} turns, against {url}")
+
+    report = {"url": url, "source": args.source, "levels": {}}
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        for concurrency in levels:
+            before = await scrape(client, metrics_url)
+            results, elapsed = await replay(
+                client, url, conversations, concurrency, args.history, args.stream, ks,
+                run_id=f"{int(time.time())}-{concurrency}",
+            )
+            summary = summarize(results, elapsed, cache_usage(before, await scrape(client, metrics_url)))
+            report["levels"][str(concurrency)] = summary
+            print_summary(concurrency, summary, (baseline or {}).get("levels", {}).get(str(concurrency)))
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.report}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,214 @@
+# Minimal local stand-in for the OpenAI chat and embeddings APIs.
+#
+# Usage (from server/):
+#   STUB_CHAT_LATENCY_MS=800 uvicorn bench.stub_openai:app --port 9000
+#   OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=sk-stub uvicorn main:app --port 8000
+#
+# Chat completions sleep for the configured latency (asyncio, so the stub itself
+# never serialises requests) and answer with the first products listed in the
+# system prompt: as a forced function call when the request has `tools`, as
+# JSON content for a json_schema `response_format`, otherwise as text in the
+# "Product ID: <id>" format.
+#
+# Latencies are drawn per call from STUB_LATENCY_DIST: "fixed" (default),
+# "uniform" (mean +/- spread), "exponential" (mean) or "lognormal" (median,
+# with STUB_LATENCY_SPREAD as sigma, giving a long tail like the real APIs).
+#
+# Faults for exercising upstream.py: STUB_ERROR_RATE answers that share of
+# calls with a 500, STUB_RATE_LIMIT_RATE with a 429, and STUB_STALL_RATE adds
+# STUB_STALL_MS to that share of calls (tail-latency outliers for hedging).
+# POST /stub/faults with any of {"error_rate", "rate_limit_rate", "stall_rate",
+# "stall_ms", "latency_ms"} changes them while the stub runs, e.g. to simulate
+# an outage and its recovery.
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import struct
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CHAT_LATENCY_MS = float(os.getenv("STUB_CHAT_LATENCY_MS", "500"))
+# Share of the chat latency spent before the first streamed token
+FIRST_TOKEN_FRACTION = float(os.getenv("STUB_FIRST_TOKEN_FRACTION", "0.2"))
+EMBEDDING_LATENCY_MS = float(os.getenv("STUB_EMBEDDING_LATENCY_MS", "50"))
+EMBEDDING_DIM = int(os.getenv("STUB_EMBEDDING_DIM", "1536"))
+LATENCY_DIST = os.getenv("STUB_LATENCY_DIST", "fixed")
+LATENCY_SPREAD = float(os.getenv("STUB_LATENCY_SPREAD", "0.5"))
+FAULTS = {
+    "error_rate": float(os.getenv("STUB_ERROR_RATE", "0")),
+    "rate_limit_rate": float(os.getenv("STUB_RATE_LIMIT_RATE", "0")),
+    "stall_rate": float(os.getenv("STUB_STALL_RATE", "0")),
+    "stall_ms": float(os.getenv("STUB_STALL_MS", "5000")),
+    "latency_ms": None,  # overrides STUB_CHAT_LATENCY_MS when set
+}
+
+app = FastAPI()
+
+
+def sample_latency(mean_ms):
+    if LATENCY_DIST == "uniform":
+        value = random.uniform(mean_ms * (1 - LATENCY_SPREAD), mean_ms * (1 + LATENCY_SPREAD))
+    elif LATENCY_DIST == "exponential":
+        value = random.expovariate(1 / mean_ms) if mean_ms > 0 else 0.0
+    elif LATENCY_DIST == "lognormal":
+        value = mean_ms * random.lognormvariate(0.0, LATENCY_SPREAD)
+    else:
+        value = mean_ms
+    return max(value, 0.0) / 1000
+
+
+def chat_latency_ms():
+    return FAULTS["latency_ms"] if FAULTS["latency_ms"] is not None else CHAT_LATENCY_MS
+
+
+# An error response for this call, or None; stalls are slept off here
+async def inject_fault():
+    roll = random.random()
+    if roll < FAULTS["error_rate"]:
+        return JSONResponse({"error": {"message": "stub: injected server error", "type": "server_error"}}, status_code=500)
+    if roll < FAULTS["error_rate"] + FAULTS["rate_limit_rate"]:
+        return JSONResponse(
+            {"error": {"message": "stub: injected rate limit", "type": "rate_limit_error"}},
+            status_code=429,
+            headers={"retry-after": "1"},
+        )
+    if random.random() < FAULTS["stall_rate"]:
+        await asyncio.sleep(FAULTS["stall_ms"] / 1000)
+    return None
+
+
+@app.post("/stub/faults")
+async def set_faults(request: Request):
+    FAULTS.update(await request.json())
+    return FAULTS
+
+
+def fake_embedding(text):
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    return [rng.uniform(-1.0, 1.0) for _ in range(EMBEDDING_DIM)]
+
+
+def fake_answer(messages, structured=False):
+    system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    products = re.findall(r"^(\d{1,6})\. (.+)$", system, flags=re.MULTILINE)[:4]
+    if not products:
+        message = "Could you tell me a little more about what you are looking for?"
+        return json.dumps({"message": message, "product_ids": []}) if structured else message
+    lines = ["Thank you for your query!", "Here are some options for you:"]
+    for number, (pid, name) in enumerate(products, start=1):
+        lines.append(f"{number}. {name}." if structured else f"{number}. {name}. Product ID: {pid}")
+    if structured:
+        return json.dumps({"message": "\n".join(lines), "product_ids": [pid for pid, _ in products]})
+    return "\n".join(lines)
+
+
+# Name of the function the request forces, if any
+def forced_function(body):
+    tools = body.get("tools") or []
+    return tools[0]["function"]["name"] if tools else None
+
+
+def stream_chunk(model, delta, finish_reason=None):
+    chunk = {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+async def stream_answer(model, content, function=None):
+    tokens = re.findall(r"\S+\s*|\s+", content)
+    latency = sample_latency(chat_latency_ms())
+    await asyncio.sleep(latency * FIRST_TOKEN_FRACTION)
+    if function:
+        call = {"index": 0, "id": "call_stub", "type": "function", "function": {"name": function, "arguments": ""}}
+        yield stream_chunk(model, {"role": "assistant", "content": None, "tool_calls": [call]})
+    else:
+        yield stream_chunk(model, {"role": "assistant", "content": ""})
+    per_token = latency * (1 - FIRST_TOKEN_FRACTION) / max(len(tokens), 1)
+    for token in tokens:
+        if function:
+            yield stream_chunk(model, {"tool_calls": [{"index": 0, "function": {"arguments": token}}]})
+        else:
+            yield stream_chunk(model, {"content": token})
+        await asyncio.sleep(per_token)
+    yield stream_chunk(model, {}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    fault = await inject_fault()
+    if fault is not None:
+        return fault
+    function = forced_function(body)
+    structured = function is not None or (body.get("response_format") or {}).get("type") == "json_schema"
+    content = fake_answer(body.get("messages", []), structured=structured)
+    if body.get("stream"):
+        return StreamingResponse(
+            stream_answer(body.get("model", "gpt-3.5-turbo"), content, function),
+            media_type="text/event-stream",
+        )
+
+    message = {"role": "assistant", "content": content}
+    if function:
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {"id": "call_stub", "type": "function", "function": {"name": function, "arguments": content}}
+            ],
+        }
+
+    await asyncio.sleep(sample_latency(chat_latency_ms()))
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-3.5-turbo"),
+        "choices": [
+            {
+                "index": 0,
+                "message": message,
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(content.split()), "total_tokens": len(content.split())},
+    }
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    fault = await inject_fault()
+    if fault is not None:
+        return fault
+    inputs = body.get("input", [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    await asyncio.sleep(sample_latency(EMBEDDING_LATENCY_MS))
+
+    data = []
+    for index, text in enumerate(inputs):
+        vector = fake_embedding(str(text))
+        if body.get("encoding_format") == "base64":
+            vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+        data.append({"object": "embedding", "index": index, "embedding": vector})
+
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "text-embedding-ada-002"),
+        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+    }
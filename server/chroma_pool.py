@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import threading
+import time
+
+import chromadb
+
+logger = logging.getLogger(__name__)
+
+
+# Process-wide holder for the product collection.
+# The PersistentClient and collection handle are shared by every request; the
+# connection is health-checked at most every `health_check_interval` seconds
+# and rebuilt lazily if the heartbeat fails. The served collection follows a
+# CollectionAlias: when the alias file changes (checked at most every
+# `alias_check_interval` seconds) the holder switches to the newly active
+# version without a restart. The new version and whatever the listeners derive
+# from it are built without holding the lock, while requests keep getting the
+# current version, and swapped in together only once all of it succeeded.
+class CollectionHolder:
+    def __init__(
+        self,
+        path,
+        alias,
+        embedding_function_factory=None,
+        health_check_interval=30.0,
+        alias_check_interval=1.0,
+        max_retries=3,
+        retry_delay=10.0,
+    ):
+        self.path = path
+        self.alias = alias
+        self.embedding_function_factory = embedding_function_factory
+        self.health_check_interval = health_check_interval
+        self.alias_check_interval = alias_check_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.collection_name = None
+
+        self._lock = threading.Lock()
+        self._client = None
+        self._collection = None
+        self._last_check = 0.0
+        self._alias_mtime = None
+        self._alias_checked = 0.0
+        self._alias_dirty = False
+        self._switching = False
+        self._listeners = []
+
+        self._async_lock = asyncio.Lock()
+
+    # `listener(collection)` runs whenever a different collection is about to be
+    # served or the alias is rewritten after a reindex. It does the slow work
+    # up front and returns a cheap `commit()` (or None), called under the lock
+    # when the switch goes ahead; if any listener raises, nothing is swapped.
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    # Blocking: opens the alias's active version and builds the listeners'
+    # state for it, for _install to swap in
+    def _open_collection(self, client):
+        mtime = self.alias.mtime()
+        name = self.alias.active()
+        # Without a factory the collection keeps its persisted embedding function;
+        # callers that query with precomputed embeddings don't need one.
+        kwargs = {}
+        if self.embedding_function_factory is not None:
+            kwargs["embedding_function"] = self.embedding_function_factory()
+        if name == self.alias.base_name:
+            collection = client.get_or_create_collection(name, **kwargs)
+        else:
+            collection = client.get_collection(name, **kwargs)
+
+        # A rewritten alias also signals an in-place reindex of the same version
+        commits = []
+        if name != self.collection_name or mtime != self._alias_mtime:
+            for listener in self._listeners:
+                commit = listener(collection)
+                if commit is not None:
+                    commits.append(commit)
+        return name, mtime, collection, commits
+
+    def _install(self, name, mtime, collection, commits):
+        # Called with the lock held
+        if name != self.collection_name or mtime != self._alias_mtime:
+            logger.info(f"Serving collection {name}")
+        for commit in commits:
+            commit()
+        self._collection = collection
+        self._alias_mtime = mtime
+        self._alias_dirty = False
+        self.collection_name = name
+
+    def _connect_once(self):
+        client = chromadb.PersistentClient(path=self.path)
+        client.heartbeat()
+        self._client = client
+        self._install(*self._open_collection(client))
+        self._last_check = time.monotonic()
+        logger.info(f"Connected to ChromaDB at {self.path} (collection: {self.collection_name})")
+
+    def _check_alias(self):
+        now = time.monotonic()
+        if now - self._alias_checked >= self.alias_check_interval:
+            self._alias_checked = now
+            if self.alias.mtime() != self._alias_mtime:
+                self._alias_dirty = True
+
+    def _healthy(self):
+        try:
+            self._client.heartbeat()
+            return True
+        except Exception as e:
+            logger.warning(f"ChromaDB heartbeat failed, reconnecting: {e}")
+            return False
+
+    def _fresh(self):
+        # A connected collection whose last health check is recent and whose alias is unchanged
+        if self._collection is None:
+            return False
+        if self._switching:
+            # The current version is served while the next one is being built
+            return True
+        self._check_alias()
+        return not self._alias_dirty and time.monotonic() - self._last_check < self.health_check_interval
+
+    def _refresh_once(self):
+        # Single heartbeat/reconnect attempt; raises if ChromaDB is unreachable
+        with self._lock:
+            if self._fresh():
+                return self._collection
+            if self._collection is None or not self._healthy():
+                self._client = None
+                self._collection = None
+                self._connect_once()
+                return self._collection
+            self._last_check = time.monotonic()
+            if not self._alias_dirty:
+                return self._collection
+            self._switching = True
+            client = self._client
+
+        try:
+            opened = self._open_collection(client)
+        except Exception as e:
+            # Keep serving the current version and its state rather than failing requests
+            logger.error(f"Could not switch collection, still serving {self.collection_name}: {e}")
+            opened = None
+        with self._lock:
+            self._switching = False
+            if opened is None:
+                self._alias_mtime = self.alias.mtime()
+                self._alias_dirty = False
+            elif self._client is client:
+                # Not closed or reconnected in the meantime
+                self._install(*opened)
+            return self._collection
+
+    def get(self):
+        if self._fresh():
+            return self._collection
+
+        for attempt in range(self.max_retries):
+            try:
+                return self._refresh_once()
+            except Exception as e:
+                logger.warning(f"ChromaDB connection attempt {attempt + 1} failed: {e}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(self.retry_delay)
+                else:
+                    raise
+
+    # Event-loop friendly variant: blocking ChromaDB work runs on `executor`
+    # and the retry backoff uses asyncio.sleep so other requests keep flowing.
+    async def aget(self, executor=None):
+        if self._fresh():
+            return self._collection
+
+        loop = asyncio.get_running_loop()
+        async with self._async_lock:
+            for attempt in range(self.max_retries):
+                try:
+                    return await loop.run_in_executor(executor, self._refresh_once)
+                except Exception as e:
+                    logger.warning(f"ChromaDB connection attempt {attempt + 1} failed: {e}")
+                    if attempt < self.max_retries - 1:
+                        await asyncio.sleep(self.retry_delay)
+                    else:
+                        raise
+
+    def close(self):
+        with self._lock:
+            self._client = None
+            self._collection = None
+            self.collection_name = None
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+ALIAS_FILENAME = "active_collection.json"
+
+
+def collection_names(client):
+    # list_collections returns names on newer chromadb and Collection objects on older ones
+    return [getattr(collection, "name", collection) for collection in client.list_collections()]
+
+
+def version_of(name, base):
+    match = re.fullmatch(rf"{re.escape(base)}_v(\d+)", name)
+    return int(match.group(1)) if match else None
+
+
+# Pointer from the logical collection name to the versioned collection that is
+# currently served (e.g. Clothes_products -> Clothes_products_v3). It lives in a
+# small JSON file next to the Chroma data and is replaced atomically, so
+# readers always see either the old or the new version, never an empty one.
+class CollectionAlias:
+    def __init__(self, chroma_path, base_name):
+        self.base_name = base_name
+        self.path = os.path.join(chroma_path, ALIAS_FILENAME)
+
+    def read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # No pointer yet: serve the legacy unversioned collection
+            return {"active": self.base_name, "previous": None}
+
+    def active(self):
+        return self.read()["active"]
+
+    def mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _write(self, data):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".alias-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def activate(self, name):
+        current = self.read()
+        previous = current["active"] if current["active"] != name else current.get("previous")
+        self._write({"active": name, "previous": previous, "updated": time.time()})
+        logger.info(f"Collection alias {self.base_name} -> {name} (previous: {previous})")
+
+    def rollback(self):
+        current = self.read()
+        if not current.get("previous"):
+            raise RuntimeError("No previous collection version to roll back to")
+        self._write({"active": current["previous"], "previous": current["active"], "updated": time.time()})
+        logger.info(f"Rolled back collection alias {self.base_name} -> {current['previous']}")
+        return current["previous"]
+
+    def next_version(self, client):
+        versions = [version_of(name, self.base_name) for name in collection_names(client)]
+        return f"{self.base_name}_v{max([v for v in versions if v is not None], default=0) + 1}"
+
+    # Drop old versions, keeping the active one and the previous one for rollback
+    def prune(self, client):
+        current = self.read()
+        keep = {current["active"], current.get("previous")}
+        removed = []
+        for name in collection_names(client):
+            if version_of(name, self.base_name) is not None and name not in keep:
+                client.delete_collection(name)
+                removed.append(name)
+        if removed:
+            logger.info(f"Deleted old collection versions: {removed}")
+        return removed
@@ -1,41 +1,32 @@
+import argparse
+import hashlib
 import json
+import random
+import sqlite3
 import chromadb
-from chromadb.utils import embedding_functions
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import openai
 import os
 from dotenv import load_dotenv
 import time
 import logging
 
+from collection_alias import CollectionAlias, collection_names
+from vector_index import HNSW_M, hnsw_metadata
+from embeddings import (
+    DEFAULT_BACKEND,
+    HashingEmbeddingFunction,
+    backend_of,
+    collection_metadata,
+    hashing_idf_path,
+    make_embedding_function,
+)
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load OpenAI API key from environment variable
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    logger.error("Error: OPENAI_API_KEY environment variable not set.")
-    exit(1)
-
-# Load products from Fashion_Dataset.json file
-try:
-    with open('Fashion_Dataset.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        if isinstance(data, dict):
-            products = data.get("Sheet1", [])
-            logger.info("Loaded products from key 'Sheet1' in JSON.")
-        elif isinstance(data, list):
-            products = data
-            logger.info("Loaded products as a list from JSON.")
-        else:
-            logger.error("Unexpected JSON format in Fashion_Dataset.json.")
-            exit(1)
-except FileNotFoundError:
-    logger.error("Error: 'Fashion_Dataset.json' file not found.")
-    exit(1)
-except json.JSONDecodeError:
-    logger.error("Error: 'Fashion_Dataset.json' contains invalid JSON.")
-    exit(1)
+COLLECTION_NAME = "Clothes_products"
 
 # Format each product into a searchable string
 def format_product(product):
@@ -76,96 +67,493 @@ def sanitize_metadata(data, parent_key='', sep='_'):
 
     return sanitized
 
-# Initialize OpenAI embedding function
-try:
-    embedding_func = embedding_functions.OpenAIEmbeddingFunction(
-        api_key=api_key,
-        model_name="text-embedding-ada-002"
-    )
-except Exception as e:
-    logger.error(f"Error initializing OpenAI embedding function: {e}")
-    exit(1)
-
-# Initialize ChromaDB client
-hostname = os.getenv("CHROMADB_HOST", "http://13.233.244.30")
-port = int(os.getenv("CHROMADB_PORT", "80"))
-
-if hostname.startswith("http://"):
-    hostname = hostname[7:]
-elif hostname.startswith("https://"):
-    hostname = hostname[8:]
-
-# Retry connection to handle startup delays
-max_retries = 5
-for attempt in range(max_retries):
+# Fashion_Dataset.json is not valid JSON or not a product list
+class DatasetError(Exception):
+    pass
+
+# Stream products out of Fashion_Dataset.json without loading the whole file.
+# Accepts either a top-level list or an object holding the list under "Sheet1".
+def iter_products(path, chunk_size=1 << 16):
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ""
+        eof = False
+
+        # Reads the next chunk and returns where `pos` points afterwards. Text
+        # before `pos` is consumed, so it is dropped here, once per chunk, which
+        # keeps memory bounded by one chunk plus one product.
+        def fill(pos):
+            nonlocal buffer, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return pos
+            buffer = buffer[pos:] + chunk
+            return 0
+
+        def skip(pos, chars):
+            while True:
+                while pos < len(buffer) and buffer[pos] in chars:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return pos
+                pos = fill(pos)
+
+        pos = skip(0, " \t\r\n")
+        if pos >= len(buffer):
+            raise DatasetError("Fashion_Dataset.json is empty.")
+
+        if buffer[pos] == "{":
+            # Find the "Sheet1" array inside the top-level object
+            while True:
+                index = buffer.find('"Sheet1"', pos)
+                if index != -1:
+                    pos = skip(index + len('"Sheet1"'), " \t\r\n:")
+                    break
+                if eof:
+                    logger.warning("No 'Sheet1' key found in JSON.")
+                    return
+                # Keep a tail that could hold the start of the key
+                pos = fill(max(pos, len(buffer) - len('"Sheet1"') + 1))
+            logger.info("Streaming products from key 'Sheet1' in JSON.")
+        else:
+            logger.info("Streaming products as a list from JSON.")
+
+        if pos >= len(buffer) or buffer[pos] != "[":
+            raise DatasetError("Unexpected JSON format in Fashion_Dataset.json.")
+        pos += 1
+
+        while True:
+            pos = skip(pos, " \t\r\n,")
+            if pos >= len(buffer):
+                raise DatasetError("Fashion_Dataset.json ended before the product list was closed.")
+            if buffer[pos] == "]":
+                return
+            try:
+                product, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise DatasetError(f"Invalid JSON: {e}") from e
+                pos = fill(pos)
+                continue
+            yield product
+            pos = end
+
+# Stable identity for a product across catalogue refreshes
+def product_key(product):
+    for field in ("id", "product_id", "sku", "url", "URL", "link"):
+        value = product.get(field)
+        if value not in (None, ""):
+            return f"{field}:{value}"
+    identity = "|".join(str(product.get(field, "")) for field in ("name", "Title", "brand", "color", "image"))
+    return "hash:" + hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+# Ingestion checkpoint: maps each product key to its numeric seq_id (the
+# Chroma ID the chatbot shows as "Product ID") and, per collection version,
+# the hash of the text that was last embedded for it. Hashes are only written
+# after a batch has been upserted, so a crashed run resumes by skipping what
+# already landed. seq_ids are shared by all versions so Product IDs stay stable.
+# It also records the version a --rebuild is filling until it is activated, so
+# an interrupted rebuild resumes into it instead of starting a new version.
+class IngestState:
+    def __init__(self, path, collection_name=None):
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS products (key TEXT PRIMARY KEY, seq_id INTEGER UNIQUE NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embedded ("
+            "collection TEXT NOT NULL, key TEXT NOT NULL, text_hash TEXT NOT NULL, "
+            "PRIMARY KEY (collection, key))"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS rebuilds (base TEXT PRIMARY KEY, collection TEXT NOT NULL)")
+        self.db.commit()
+        self._seq_ids = dict(self.db.execute("SELECT key, seq_id FROM products"))
+        self._next_seq_id = max(self._seq_ids.values(), default=0) + 1
+        self.use(collection_name)
+
+    # Switch the per-version hashes to another collection version
+    def use(self, collection_name):
+        self.collection_name = collection_name
+        self._hashes = dict(self.db.execute(
+            "SELECT key, text_hash FROM embedded WHERE collection = ?", (collection_name,)
+        ))
+
+    # The unactivated version a rebuild of `base` is filling, if any
+    def pending_rebuild(self, base):
+        row = self.db.execute("SELECT collection FROM rebuilds WHERE base = ?", (base,)).fetchone()
+        return row[0] if row else None
+
+    def start_rebuild(self, base, collection_name):
+        self.db.execute("INSERT OR REPLACE INTO rebuilds (base, collection) VALUES (?, ?)", (base, collection_name))
+        self.db.commit()
+
+    def finish_rebuild(self, base):
+        self.db.execute("DELETE FROM rebuilds WHERE base = ?", (base,))
+        self.db.commit()
+
+    def seq_id(self, key):
+        seq_id = self._seq_ids.get(key)
+        if seq_id is None:
+            seq_id = self._next_seq_id
+            self._next_seq_id += 1
+            self._seq_ids[key] = seq_id
+            self.db.execute("INSERT INTO products (key, seq_id) VALUES (?, ?)", (key, seq_id))
+        return seq_id
+
+    def unchanged(self, key, hashed):
+        return self._hashes.get(key) == hashed
+
+    def mark_done(self, keys, hashes):
+        for key, hashed in zip(keys, hashes):
+            self._hashes[key] = hashed
+        self.db.executemany(
+            "INSERT OR REPLACE INTO embedded (collection, key, text_hash) VALUES (?, ?, ?)",
+            [(self.collection_name, key, hashed) for key, hashed in zip(keys, hashes)],
+        )
+        self.db.commit()
+
+    # Products that disappear from the catalogue keep their seq_id reserved
+    def forget(self, keys):
+        for key in keys:
+            self._hashes.pop(key, None)
+        self.db.executemany(
+            "DELETE FROM embedded WHERE collection = ? AND key = ?",
+            [(self.collection_name, key) for key in keys],
+        )
+        self.db.commit()
+
+    def keys(self):
+        return set(self._hashes)
+
+    def reset_hashes(self):
+        self._hashes = {}
+        self.db.execute("DELETE FROM embedded WHERE collection = ?", (self.collection_name,))
+        self.db.commit()
+
+    # A collection re-embedded from another one holds the same product texts
+    def copy_from(self, source_collection):
+        self.db.execute(
+            "INSERT OR REPLACE INTO embedded (collection, key, text_hash) "
+            "SELECT ?, key, text_hash FROM embedded WHERE collection = ?",
+            (self.collection_name, source_collection),
+        )
+        self.db.commit()
+        self._hashes = dict(self.db.execute(
+            "SELECT key, text_hash FROM embedded WHERE collection = ?", (self.collection_name,)
+        ))
+
+    # Drop checkpoints of collection versions that no longer exist
+    def drop_collections(self, names):
+        self.db.executemany("DELETE FROM embedded WHERE collection = ?", [(name,) for name in names])
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    return None
+
+# Embed one batch, backing off on rate limits and transient API errors
+def embed_batch(embedding_func, documents, max_retries=6, base_delay=1.0):
+    for attempt in range(max_retries):
+        try:
+            return embedding_func(documents)
+        except (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError) as e:
+            if attempt == max_retries - 1:
+                raise
+            delay = _retry_after(e) or base_delay * (2 ** attempt)
+            delay += random.uniform(0, delay / 2)
+            logger.warning(f"Embedding batch failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def connect(path, max_retries=5):
+    # Retry connection to handle startup delays
+    for attempt in range(max_retries):
+        try:
+            client = chromadb.PersistentClient(path=path)
+            client.heartbeat()
+            logger.info(f"Successfully connected to ChromaDB at {path}")
+            return client
+        except Exception as e:
+            logger.warning(f"ChromaDB connection attempt {attempt + 1} failed: {e}")
+            if attempt < max_retries - 1:
+                time.sleep(5)
+            else:
+                raise
+
+def ingest(products, collection, embedding_func, state, batch_size=100, workers=4):
+    seen = set()
+    skipped = 0
+    added = 0
+
+    def batches():
+        nonlocal skipped
+        batch = []
+        for i, product in enumerate(products):
+            try:
+                key = product_key(product)
+                if key in seen:
+                    logger.warning(f"Duplicate product key {key} at position {i}, skipping.")
+                    continue
+                seen.add(key)
+
+                doc = format_product(product)
+                hashed = text_hash(doc)
+                if state.unchanged(key, hashed):
+                    skipped += 1
+                    continue
+
+                seq_id = state.seq_id(key)
+                sanitized_metadata = sanitize_metadata(product)
+                sanitized_metadata["seq_id"] = seq_id
+                sanitized_metadata["product_key"] = key
+
+                batch.append((key, hashed, str(seq_id), doc, sanitized_metadata))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            except Exception as e:
+                logger.error(f"Error processing product {i}: {e}")
+                continue
+        if batch:
+            yield batch
+
+    def embed(batch):
+        return batch, embed_batch(embedding_func, [item[3] for item in batch])
+
+    def store(future):
+        nonlocal added
+        batch, embeddings = future.result()
+        collection.upsert(
+            ids=[item[2] for item in batch],
+            embeddings=embeddings,
+            documents=[item[3] for item in batch],
+            metadatas=[item[4] for item in batch],
+        )
+        state.mark_done([item[0] for item in batch], [item[1] for item in batch])
+        added += len(batch)
+        logger.info(f"Upserted batch of {len(batch)} products ({added} so far)")
+
+    # Keep a bounded number of batches in flight so memory stays flat
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for batch in batches():
+            pending.add(executor.submit(embed, batch))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(future)
+        for future in pending:
+            store(future)
+
+    return seen, added, skipped
+
+def prune(collection, state, seen, known=()):
+    # Remove products that disappeared from the catalogue; `known` adds keys the
+    # state held before a --full run reset it
+    removed = (state.keys() | set(known)) - seen
+    if not removed:
+        return 0
+    ids = [str(state.seq_id(key)) for key in removed]
+    collection.delete(ids=ids)
+    state.forget(removed)
+    logger.info(f"Removed {len(removed)} products no longer in the catalogue")
+    return len(removed)
+
+def refresh_popular_queries(args):
+    if not args.popular_queries:
+        return
+    from popular_queries import refresh
+
     try:
-        client = chromadb.PersistentClient(path="./chroma_db")
-        client.heartbeat()
-        logger.info(f"Successfully connected to ChromaDB at {hostname}:{port}")
-        break
+        refresh(
+            args.chroma_path, args.popular_queries, os.getenv("POPULAR_QUERIES_PATH", "./popular_queries.db"),
+            responses=args.popular_responses,
+        )
     except Exception as e:
-        logger.warning(f"ChromaDB connection attempt {attempt + 1} failed: {e}")
-        if attempt < max_retries - 1:
-            time.sleep(5)
-        else:
-            logger.error("Failed to connect to ChromaDB after retries.")
-            exit(1)
+        # The catalogue is already live; servers fall back to live retrieval until a rerun succeeds
+        logger.error(f"Failed to refresh popular queries: {e}")
 
-# Create a new collection
-collection_name = "Clothes_products"
-try:
-    existing_collections = client.list_collections()
-    if any(col.name == collection_name for col in existing_collections):
-        client.delete_collection(collection_name)
-        logger.info(f"Deleted existing collection: {collection_name}")
-
-    collection = client.create_collection(collection_name, embedding_function=embedding_func)
-    logger.info(f"Created new collection: {collection_name}")
-
-except Exception as e:
-    logger.error(f"Error managing collection {collection_name}: {e}")
-    exit(1)
-
-# Add products to the collection in batches
-batch_size = 100
-documents = []
-metadatas = []
-ids = []
-
-try:
-    for i, product in enumerate(products):
+def main():
+    parser = argparse.ArgumentParser(description="Index Fashion_Dataset.json into ChromaDB.")
+    parser.add_argument("--input", default="Fashion_Dataset.json")
+    parser.add_argument("--chroma-path", default=os.getenv("CHROMA_PATH", "./chroma_db"))
+    parser.add_argument("--state", default=os.getenv("INGEST_STATE_PATH", "./ingest_state.db"))
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("INGEST_WORKERS", "4")))
+    parser.add_argument("--full", action="store_true", help="re-embed every product, ignoring unchanged hashes")
+    parser.add_argument(
+        "--rebuild", action="store_true",
+        help="build a new collection version and switch the alias to it once complete",
+    )
+    parser.add_argument("--rollback", action="store_true", help="switch the alias back to the previous version")
+    parser.add_argument(
+        "--embedding-backend", choices=["openai", "hashing", "sentence-transformers"],
+        help="backend for a --rebuild (default: EMBEDDING_BACKEND or openai)",
+    )
+    # HNSW build parameters only take effect when a collection is created (--rebuild or first run)
+    parser.add_argument("--hnsw-m", type=int, help="HNSW graph degree (default: HNSW_M or Chroma's 16)")
+    parser.add_argument(
+        "--hnsw-construction-ef", type=int,
+        help="HNSW build breadth (default: HNSW_CONSTRUCTION_EF or Chroma's 100)",
+    )
+    parser.add_argument(
+        "--hnsw-search-ef", type=int, help="HNSW query breadth (default: HNSW_SEARCH_EF or Chroma's 10)"
+    )
+    # Servers ignore a popular-query table built for an earlier collection version
+    parser.add_argument(
+        "--popular-queries", action="append", metavar="QUERIES",
+        help="refresh popular_queries.db from this request log once the alias is switched (repeatable)",
+    )
+    parser.add_argument(
+        "--popular-responses", action="store_true", help="with --popular-queries, also precompute chat answers"
+    )
+    args = parser.parse_args()
+    hnsw = hnsw_metadata(args.hnsw_m, args.hnsw_construction_ef, args.hnsw_search_ef)
+
+    try:
+        client = connect(args.chroma_path)
+    except Exception:
+        logger.error("Failed to connect to ChromaDB after retries.")
+        exit(1)
+
+    alias = CollectionAlias(args.chroma_path, COLLECTION_NAME)
+    if args.rollback:
         try:
-            seq_id = i + 1  # Numeric ID starting from 1
-            doc = format_product(product)
+            alias.rollback()
+        except RuntimeError as e:
+            logger.error(f"Error: {e}")
+            exit(1)
+        refresh_popular_queries(args)
+        return
 
-            sanitized_metadata = sanitize_metadata(product)
-            sanitized_metadata["seq_id"] = seq_id
+    if not os.path.exists(args.input):
+        logger.error(f"Error: '{args.input}' file not found.")
+        exit(1)
 
-            documents.append(doc)
-            metadatas.append(sanitized_metadata)
-            ids.append(str(seq_id))
+    # Incremental runs upsert into the served collection, which never empties it.
+    # A rebuild fills a fresh version off to the side and only then swaps the alias;
+    # a rebuild that was interrupted before the swap is resumed, not restarted.
+    state = IngestState(args.state)
+    collection = None
+    try:
+        if args.rebuild:
+            backend = args.embedding_backend or os.getenv("EMBEDDING_BACKEND", DEFAULT_BACKEND)
+            collection_name = state.pending_rebuild(COLLECTION_NAME)
+            current = alias.read()
+            if collection_name in (current["active"], current.get("previous")):
+                collection_name = None
+            if collection_name in collection_names(client):
+                collection = client.get_collection(collection_name)
+                metadata = collection.metadata or {}
+                if backend_of(collection) != backend or any(metadata.get(key) != value for key, value in hnsw.items()):
+                    logger.info(f"Discarding unfinished {collection_name}: built with other settings")
+                    client.delete_collection(collection_name)
+                    state.drop_collections([collection_name])
+                    collection, collection_name = None, None
+            if collection is None:
+                collection_name = alias.next_version(client)
+                state.start_rebuild(COLLECTION_NAME, collection_name)
+        else:
+            collection_name = alias.active()
+            if collection_name in collection_names(client):
+                collection = client.get_collection(collection_name)
+                if hnsw.get(HNSW_M) and (collection.metadata or {}).get(HNSW_M) != hnsw[HNSW_M]:
+                    logger.warning(f"{collection_name} already exists; use --rebuild to change its HNSW build parameters.")
+            else:
+                collection = client.create_collection(collection_name, metadata=hnsw or None)
+            backend = backend_of(collection)
+            if args.embedding_backend and args.embedding_backend != backend:
+                logger.error(
+                    f"Error: {collection_name} was embedded with '{backend}'; "
+                    f"use --rebuild to switch to '{args.embedding_backend}'."
+                )
+                exit(1)
+    except Exception as e:
+        logger.error(f"Error managing collection {COLLECTION_NAME}: {e}")
+        exit(1)
 
-            if len(documents) >= batch_size:
-                collection.add(documents=documents, metadatas=metadatas, ids=ids)
-                logger.info(f"Added batch of {len(documents)} products")
-                documents, metadatas, ids = [], [], []
+    # Load OpenAI API key from environment variable
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if backend == "openai" and not api_key:
+        logger.error("Error: OPENAI_API_KEY environment variable not set.")
+        exit(1)
 
+    # Initialize the embedding function
+    try:
+        embedding_func = make_embedding_function(backend, api_key=api_key)
+        if isinstance(embedding_func, HashingEmbeddingFunction) and embedding_func.idf is None:
+            embedding_func.fit_idf(
+                (format_product(product) for product in iter_products(args.input)),
+                hashing_idf_path(),
+            )
+    except DatasetError as e:
+        logger.error(f"Error: '{args.input}' is not a valid product list: {e}")
+        exit(1)
+    except Exception as e:
+        logger.error(f"Error initializing {backend} embedding function: {e}")
+        exit(1)
+
+    if args.rebuild and collection is not None:
+        logger.info(f"Resuming unfinished collection version: {collection_name} ({backend})")
+    elif args.rebuild:
+        try:
+            collection = client.create_collection(
+                collection_name, metadata={**collection_metadata(backend, embedding_func), **hnsw}
+            )
+            logger.info(f"Created new collection version: {collection_name} ({backend})")
         except Exception as e:
-            logger.error(f"Error processing product {i}: {e}")
-            continue
+            logger.error(f"Error managing collection {COLLECTION_NAME}: {e}")
+            exit(1)
+
+    state.use(collection_name)
+    known = set()
+    if args.full:
+        known = state.keys()
+        state.reset_hashes()
 
-    if documents:
-        collection.add(documents=documents, metadatas=metadatas, ids=ids)
-        logger.info(f"Added final batch of {len(documents)} products")
+    try:
+        seen, added, skipped = ingest(
+            iter_products(args.input), collection, embedding_func, state,
+            batch_size=args.batch_size, workers=args.workers,
+        )
+        removed = prune(collection, state, seen, known)
+        logger.info(
+            f"Products successfully indexed into {collection_name}: "
+            f"{added} upserted, {skipped} unchanged, {removed} removed."
+        )
+        # Rewriting the alias (even to the same version) tells servers to reload
+        alias.activate(collection_name)
+        if args.rebuild:
+            state.finish_rebuild(COLLECTION_NAME)
+            state.drop_collections(alias.prune(client))
+    except DatasetError as e:
+        logger.error(f"Error: '{args.input}' is not a valid product list: {e}")
+        exit(1)
+    except Exception as e:
+        logger.error(f"Error adding products to ChromaDB: {e}")
+        exit(1)
+    finally:
+        state.close()
 
-    logger.info("Products successfully added to ChromaDB!")
+    refresh_popular_queries(args)
 
-except Exception as e:
-    logger.error(f"Error adding products to ChromaDB: {e}")
-    exit(1)
+    # List all collections
+    logger.info(f"Available collections (active: {alias.active()}):")
+    for name in collection_names(client):
+        logger.info(name)
 
-# List all collections
-collections = client.list_collections()
-logger.info("Available collections:")
-for collection in collections:
-    logger.info(collection.name)
+if __name__ == "__main__":
+    main()
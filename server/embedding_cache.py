@@ -0,0 +1,151 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Prompts that differ only in case, spacing or trailing punctuation share an entry
+def normalize_prompt(text):
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.strip(" .,!?;:")
+
+
+# Bounded LRU + TTL cache of embedding vectors, optionally persisted to SQLite
+# so it survives restarts and is shared by worker processes using the same
+# file (misses in memory are read through from it). Entries are keyed by (namespace, normalized text),
+# where the namespace is the embedding model name.
+class EmbeddingCache:
+    def __init__(self, max_entries=10000, ttl=7 * 24 * 3600, persist_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist_path = persist_path
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if persist_path:
+            self._open(persist_path)
+
+    def _open(self, path):
+        # WAL + busy timeout: several worker processes may share the file
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        cutoff = time.time() - self.ttl
+        self._db.execute("DELETE FROM embeddings WHERE created < ?", (cutoff,))
+        self._db.commit()
+
+        rows = self._db.execute(
+            "SELECT key, vector, created FROM embeddings ORDER BY created DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        for key, blob, created in reversed(rows):
+            self._entries[key] = (array("f", blob).tolist(), created)
+        logger.info(f"Loaded {len(rows)} cached embeddings from {path}")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # Another process sharing the file may have embedded it since we loaded
+                entry = self._read_through(key)
+                if entry is None:
+                    self.misses += 1
+                    return None
+            vector, created = entry
+            if time.time() - created > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    # Called with the lock held
+    def _read_through(self, key):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT vector, created FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        entry = self._entries[key] = (array("f", row[0]).tolist(), row[1])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def put(self, key, vector):
+        created = time.time()
+        with self._lock:
+            self._entries[key] = (list(vector), created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                if self._db is not None:
+                    self._db.execute("DELETE FROM embeddings WHERE key = ?", (evicted,))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)",
+                    (key, array("f", vector).tobytes(), created),
+                )
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# Wraps a Chroma-style embedding function (callable on a list of texts) and
+# only sends cache misses to the underlying model, in a single batch.
+class CachedEmbeddingFunction:
+    def __init__(self, embedding_function, cache, namespace):
+        self.embedding_function = embedding_function
+        self.cache = cache
+        self.namespace = namespace
+
+    def _key(self, text):
+        return f"{self.namespace}:{normalize_prompt(text)}"
+
+    def __call__(self, input):
+        keys = [self._key(text) for text in input]
+        embeddings = [self.cache.get(key) for key in keys]
+
+        # Texts that normalise to the same key (common in a micro-batch) are embedded once
+        missing = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(keys[i], []).append(i)
+        if missing:
+            computed = self.embedding_function([input[positions[0]] for positions in missing.values()])
+            for (key, positions), embedding in zip(missing.items(), computed):
+                embedding = [float(value) for value in embedding]
+                self.cache.put(key, embedding)
+                for i in positions:
+                    embeddings[i] = embedding
+        return embeddings
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "openai"
+OPENAI_MODEL = "text-embedding-ada-002"
+SENTENCE_TRANSFORMER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+# IDF weights for the hashing backend live next to this module unless
+# HASHING_IDF_PATH says otherwise, so every tool finds the same file whatever
+# directory it is started from
+def hashing_idf_path():
+    return os.getenv("HASHING_IDF_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "hashing_idf.json")
+
+
+# Hashed character n-gram vectoriser with sublinear TF and optional IDF weights.
+# Needs no model download and no network; IDF weights fitted on the catalogue
+# (see fit_idf) turn it into a hashed TF-IDF model. The weights change the
+# vectors, so their hash is part of model_name (and with it the embedding
+# cache namespace and the collection metadata).
+class HashingEmbeddingFunction:
+    def __init__(self, dim=1024, ngram_range=(3, 5), idf_path=None):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.idf = None
+        self.idf_hash = None
+        if idf_path and os.path.exists(idf_path):
+            with open(idf_path, "r", encoding="utf-8") as f:
+                idf = json.load(f)
+            if len(idf) != dim:
+                raise ValueError(f"IDF file {idf_path} has {len(idf)} weights, expected {dim}")
+            self._set_idf(idf)
+            logger.info(f"Loaded IDF weights {self.idf_hash} from {idf_path}")
+
+    @property
+    def model_name(self):
+        name = f"hashing-{self.dim}-{self.ngram_range[0]}-{self.ngram_range[1]}"
+        return f"{name}-idf-{self.idf_hash}" if self.idf_hash else name
+
+    def _set_idf(self, idf):
+        self.idf = idf
+        self.idf_hash = hashlib.sha1(json.dumps(idf).encode("utf-8")).hexdigest()[:12]
+
+    def _ngrams(self, text):
+        text = " " + re.sub(r"\s+", " ", text.lower()).strip() + " "
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                yield text[i:i + n]
+
+    def _counts(self, text):
+        counts = {}
+        for gram in self._ngrams(text):
+            hashed = zlib.crc32(gram.encode("utf-8"))
+            bucket = hashed % self.dim
+            # The top bit picks a sign so colliding n-grams tend to cancel out
+            sign = 1.0 if hashed & 0x80000000 else -1.0
+            counts[bucket] = counts.get(bucket, 0.0) + sign
+        return counts
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for bucket, count in self._counts(text).items():
+            weight = math.copysign(1.0 + math.log(abs(count)), count) if count else 0.0
+            if self.idf is not None:
+                weight *= self.idf[bucket]
+            vector[bucket] = weight
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def __call__(self, input):
+        return [self._embed(text) for text in input]
+
+    def fit_idf(self, documents, path):
+        document_frequency = [0] * self.dim
+        total = 0
+        for text in documents:
+            total += 1
+            for bucket in self._counts(text):
+                document_frequency[bucket] += 1
+        self._set_idf([math.log((1 + total) / (1 + df)) + 1.0 for df in document_frequency])
+        # Written aside and renamed, so servers loading it never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".idf-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.idf, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        logger.info(f"Fitted IDF weights {self.idf_hash} on {total} documents -> {path}")
+
+
+# CPU sentence-transformers model, loaded once and kept warm for the process
+class SentenceTransformerEmbeddingFunction:
+    def __init__(self, model_name=SENTENCE_TRANSFORMER_MODEL, batch_size=64, device="cpu"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError(
+                "The sentence-transformers embedding backend requires `pip install sentence-transformers`"
+            )
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model_name, device=device)
+        self._lock = threading.Lock()
+        logger.info(f"Loaded local embedding model {model_name} on {device}")
+
+    def __call__(self, input):
+        with self._lock:
+            vectors = self._model.encode(
+                list(input), batch_size=self.batch_size, normalize_embeddings=True, show_progress_bar=False
+            )
+        return [vector.tolist() for vector in vectors]
+
+
+def make_embedding_function(backend=None, api_key=None, api_base=None):
+    backend = backend or os.getenv("EMBEDDING_BACKEND", DEFAULT_BACKEND)
+    if backend == "openai":
+        from chromadb.utils import embedding_functions
+
+        kwargs = {"api_base": api_base} if api_base else {}
+        function = embedding_functions.OpenAIEmbeddingFunction(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            model_name=OPENAI_MODEL,
+            **kwargs
+        )
+        function.model_name = OPENAI_MODEL
+        return function
+    if backend == "hashing":
+        return HashingEmbeddingFunction(
+            dim=int(os.getenv("HASHING_EMBEDDING_DIM", "1024")),
+            idf_path=hashing_idf_path(),
+        )
+    if backend == "sentence-transformers":
+        return SentenceTransformerEmbeddingFunction(
+            model_name=os.getenv("LOCAL_EMBEDDING_MODEL", SENTENCE_TRANSFORMER_MODEL),
+            batch_size=int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64")),
+        )
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+# Collections record the backend they were embedded with; legacy ones are ada
+def backend_of(collection):
+    metadata = getattr(collection, "metadata", None) or {}
+    return metadata.get("embedding_backend", DEFAULT_BACKEND)
+
+
+def collection_metadata(backend, function):
+    metadata = {"embedding_backend": backend, "embedding_model": function.model_name}
+    if getattr(function, "idf_hash", None):
+        metadata["embedding_idf"] = function.idf_hash
+    return metadata
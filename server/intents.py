@@ -0,0 +1,119 @@
+import logging
+import re
+
+from retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Follow-up intents that can be answered from the session's previous search
+MORE = "more"
+CHEAPER = "cheaper"
+OTHER_COLOR = "other_color"
+
+MORE_PATTERN = re.compile(
+    r"^\s*(?:(?:can you |could you |please )?show (?:me )?(?:some )?more|more|any ?(?:thing|one)? ?(?:other|else|more)|"
+    r"(?:show me )?(?:some )?(?:other|different) (?:ones|options)|next)"
+    r"(?:\s+(?:please|options|ones|items|products|like (?:this|these|that|those)|of (?:these|them|those)))*\s*[.!?]*\s*$",
+    re.IGNORECASE,
+)
+CHEAPER_PATTERN = re.compile(
+    r"\b(?:cheaper|less (?:expensive|pricey|costly)|lower (?:price|cost)|more affordable|"
+    r"(?:on|within) (?:a |my )?(?:tight(?:er)? |small(?:er)? |low(?:er)? )?budget|too (?:expensive|costly|pricey))\b",
+    re.IGNORECASE,
+)
+COLOR_WORD = re.compile(r"\b(?:colou?rs?|shades?)\b", re.IGNORECASE)
+# Explicit references back to the products just shown
+REFERENCE_WORD = re.compile(r"\b(?:same|this|these|that|those|it|them|one|ones)\b", re.IGNORECASE)
+OTHER_WORD = re.compile(r"\b(?:other|another|different|else)\b", re.IGNORECASE)
+
+# Example phrasings for the optional nearest-prototype model, which catches
+# follow-ups the rules miss ("got anything similar?", "what else is there")
+PROTOTYPES = {
+    MORE: [
+        "show me more", "more options", "any other options", "what else do you have", "show more like these",
+        "anything similar", "got anything else", "next ones please", "more please", "other suggestions",
+    ],
+    CHEAPER: [
+        "something cheaper", "these are too expensive", "any cheaper options", "less expensive ones",
+        "lower price please", "more affordable options", "on a budget", "show me cheaper ones",
+    ],
+    OTHER_COLOR: [
+        "same in another colour", "do you have this in a different color", "other colours please",
+        "any other shades", "different colour options", "same one in other colors",
+    ],
+}
+
+
+class Intent:
+    __slots__ = ("kind", "colors", "max_price")
+
+    def __init__(self, kind, colors=None, max_price=None):
+        self.kind = kind
+        self.colors = set(colors or ())
+        self.max_price = max_price
+
+    def __repr__(self):
+        return f"Intent({self.kind}, colors={sorted(self.colors)}, max_price={self.max_price})"
+
+
+# Rule-based classifier for short follow-up turns, with an optional
+# nearest-prototype fallback over a local embedding function (e.g. the hashing
+# backend, which needs no model or network). `parser` is the catalogue's
+# ConstraintParser, used to tell "in blue" from "blue kurtis" (a new search).
+# Apart from an exact "show me more", a turn only counts as a follow-up when
+# it is at most `short_words` long or refers back to the shown products
+# ("these", "the same"); longer prompts are new requests for the LLM.
+class IntentClassifier:
+    def __init__(self, parser=None, embedding_function=None, threshold=0.55, max_words=10, short_words=4):
+        self.parser = parser
+        self.embedding_function = embedding_function
+        self.threshold = threshold
+        self.max_words = max_words
+        self.short_words = short_words
+        self._prototypes = []
+        if embedding_function is not None:
+            for kind, phrases in PROTOTYPES.items():
+                for vector in embedding_function(phrases):
+                    self._prototypes.append((kind, self._sparse(vector)))
+
+    def classify(self, prompt):
+        words = tokenize(prompt)
+        if not words or len(words) > self.max_words:
+            return None
+        constraints = self.parser.parse(prompt) if self.parser is not None else None
+        # Naming a brand or a kind of garment starts a new search
+        if constraints is not None and (constraints.brands or constraints.categories):
+            return None
+        colors = constraints.colors if constraints is not None else set()
+
+        if MORE_PATTERN.match(prompt):
+            return Intent(MORE)
+        if len(words) > self.short_words and not REFERENCE_WORD.search(prompt):
+            return None
+        if CHEAPER_PATTERN.search(prompt):
+            return Intent(CHEAPER)
+        if constraints is not None and constraints.max_price is not None and not colors:
+            return Intent(CHEAPER, max_price=constraints.max_price)
+        if colors and (REFERENCE_WORD.search(prompt) or COLOR_WORD.search(prompt) or len(words) <= 3):
+            return Intent(OTHER_COLOR, colors=colors)
+        if COLOR_WORD.search(prompt) and OTHER_WORD.search(prompt):
+            return Intent(OTHER_COLOR)
+        return self._nearest(prompt, colors)
+
+    @staticmethod
+    def _sparse(vector):
+        return {i: value for i, value in enumerate(vector) if value}
+
+    def _nearest(self, prompt, colors):
+        if not self._prototypes:
+            return None
+        query = self._sparse(self.embedding_function([prompt])[0])
+        best_kind, best_score = None, 0.0
+        for kind, vector in self._prototypes:
+            score = sum(value * vector.get(i, 0.0) for i, value in query.items())
+            if score > best_score:
+                best_kind, best_score = kind, score
+        if best_score < self.threshold:
+            return None
+        logger.debug(f"Intent model matched {best_kind} ({best_score:.2f}) for {prompt!r}")
+        return Intent(best_kind, colors=colors if best_kind == OTHER_COLOR else None)
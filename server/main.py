@@ -1,16 +1,41 @@
 import os
+import asyncio
+import json
 import logging
+import math
 import time
-import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
 from typing import List, Dict
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
-import chromadb
-from chromadb.utils import embedding_functions
+import httpx
 import openai
 
+from batching import MicroBatcher
+from chroma_pool import CollectionHolder
+from collection_alias import CollectionAlias
+from embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+from embeddings import DEFAULT_BACKEND, HashingEmbeddingFunction, backend_of, make_embedding_function
+from intents import CHEAPER, MORE, MORE_PATTERN, IntentClassifier
+import metrics
+from metrics import span
+from response_cache import CachedResponse, ResponseCache
+from product_table import ProductTable
+from popular_queries import PopularQueries
+from prompt_builder import STRUCTURED_SYSTEM_PROMPT, SYSTEM_PROMPT, PromptBuilder, response_format_args
+from retrieval import ConstraintParser, HybridRetriever, parse_price
+from session_store import SessionState, make_session_store
+from streaming import ResponseStreamParser, completion_text, parse_reply
+from traffic_recorder import TrafficRecorderMiddleware
+from upstream import CLOSED, GatedEmbeddingFunction, UpstreamGateway, UpstreamTimeout, UpstreamUnavailable
+from vector_index import QuantizedIndex, apply_search_ef, search_ef_of
+from warmup import load_warmup_queries, warm_up
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,8 +47,439 @@ if not OPENAI_API_KEY:
     logger.error("OPENAI_API_KEY environment variable not set.")
     raise RuntimeError("OPENAI_API_KEY not set")
 
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # e.g. a local stub server for load tests
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+# Client-side limits on calls to the OpenAI APIs (see upstream.py). RPM should
+# match the account quota (0 = no limit); callers beyond CONCURRENCY + QUEUE get
+# an immediate 503 with Retry-After; HEDGE_MS > 0 sends a duplicate request
+# when the first is still running after that long.
+UPSTREAM_CHAT_RPM = int(os.getenv("UPSTREAM_CHAT_RPM", "0"))
+UPSTREAM_CHAT_CONCURRENCY = int(os.getenv("UPSTREAM_CHAT_CONCURRENCY", "32"))
+UPSTREAM_CHAT_QUEUE = int(os.getenv("UPSTREAM_CHAT_QUEUE", "64"))
+UPSTREAM_CHAT_DEADLINE = float(os.getenv("UPSTREAM_CHAT_DEADLINE", "30"))
+UPSTREAM_CHAT_HEDGE_MS = float(os.getenv("UPSTREAM_CHAT_HEDGE_MS", "0"))
+UPSTREAM_EMBEDDING_RPM = int(os.getenv("UPSTREAM_EMBEDDING_RPM", "0"))
+UPSTREAM_EMBEDDING_CONCURRENCY = int(os.getenv("UPSTREAM_EMBEDDING_CONCURRENCY", "16"))
+UPSTREAM_EMBEDDING_QUEUE = int(os.getenv("UPSTREAM_EMBEDDING_QUEUE", "64"))
+UPSTREAM_EMBEDDING_DEADLINE = float(os.getenv("UPSTREAM_EMBEDDING_DEADLINE", "10"))
+UPSTREAM_EMBEDDING_HEDGE_MS = float(os.getenv("UPSTREAM_EMBEDDING_HEDGE_MS", "0"))
+# Consecutive upstream failures that open the circuit, and how long it stays open
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_COOLDOWN = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "30"))
+VECTOR_STORE_WORKERS = int(os.getenv("VECTOR_STORE_WORKERS", "8"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")  # SQLite file; unset keeps the cache in memory only
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_HISTORY_TURNS = int(os.getenv("RESPONSE_CACHE_HISTORY_TURNS", "4"))
+# Cosine similarity above which a near-duplicate prompt reuses a cached answer; unset = exact matches only
+RESPONSE_CACHE_SIMILARITY = os.getenv("RESPONSE_CACHE_SIMILARITY")
+# GET /response-cache/top lists the most reused cached answers with their
+# prompts; off by default because prompts are user text
+RESPONSE_CACHE_ADMIN = os.getenv("RESPONSE_CACHE_ADMIN", "0") == "1"
+
+# Hybrid retrieval: catalogue-derived colour/brand/category/price filters plus BM25 fused with vector search
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+RETRIEVAL_TOP_N = int(os.getenv("RETRIEVAL_TOP_N", "4"))
+RETRIEVAL_VECTOR_K = int(os.getenv("RETRIEVAL_VECTOR_K", "20"))
+
+# Concurrent prompt embeddings and vector queries are coalesced into one call per window; 0 disables
+MICRO_BATCH_WINDOW_MS = float(os.getenv("MICRO_BATCH_WINDOW_MS", "2"))
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "32"))
+
+# HNSW search breadth for the served collection (M/construction_ef are set by db_store.py)
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "0")) or None
+# Set by serve.py once it has applied HNSW_SEARCH_EF before starting workers
+HNSW_SEARCH_EF_APPLIED = os.getenv("HNSW_SEARCH_EF_APPLIED") == "1"
+# Directory where each worker process shares its metrics (set by serve.py for
+# several workers), so any worker's /metrics reports all of them
+METRICS_DIR = os.getenv("METRICS_DIR")
+# In-process int8 index with exact re-ranking, used instead of Chroma's HNSW for vector search
+QUANTIZED_INDEX = os.getenv("QUANTIZED_INDEX", "0") == "1"
+QUANTIZED_INDEX_PATH = os.getenv("QUANTIZED_INDEX_PATH", os.path.join(os.getenv("CHROMA_PATH", "./chroma_db"), "quantized"))
+QUANTIZED_RERANK = int(os.getenv("QUANTIZED_RERANK", "64"))
+
+CHAT_MODEL = "gpt-3.5-turbo"
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+PROMPT_MAX_HISTORY = int(os.getenv("PROMPT_MAX_HISTORY", "10"))
+# How the model returns product IDs: "tools" (forced function call), "json_schema"
+# (structured outputs, newer models) or "off" ("Product ID: <id>" lines in the text)
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "tools")
+RESPONSE_FORMAT_ARGS = response_format_args(STRUCTURED_OUTPUT)
+
+# Server-side conversation state: memory:// (default), sqlite:///sessions.db or redis://host:port/0
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "memory://")
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+# Ranked candidates kept per session so "show me more" pages through them without a new query
+SESSION_CANDIDATES = int(os.getenv("SESSION_CANDIDATES", "20"))
+# Answer "show me more" / "cheaper" / "in blue" follow-ups from the session's last search without the LLM
+INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "1") == "1"
+# Nearest-prototype fallback over hashing embeddings for follow-ups the rules miss
+INTENT_MODEL = os.getenv("INTENT_MODEL", "0") == "1"
+
+# Adds a Server-Timing header with per-stage durations (visible in browser dev tools)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+# Append every chat request to this JSON-lines file for replay with bench/replay.py
+RECORD_REQUESTS_PATH = os.getenv("RECORD_REQUESTS_PATH")
+
+# Precomputed embeddings, candidates and first-turn answers for frequent prompts (popular_queries.py)
+POPULAR_QUERIES_PATH = os.getenv("POPULAR_QUERIES_PATH", "./popular_queries.db")
+POPULAR_QUERIES_CHECK_INTERVAL = float(os.getenv("POPULAR_QUERIES_CHECK_INTERVAL", "1"))
+
+# Common queries embedded at startup, before the worker reports ready (see warmup.py for formats)
+WARMUP_QUERIES_PATH = os.getenv("WARMUP_QUERIES_PATH")
+WARMUP_QUERIES = int(os.getenv("WARMUP_QUERIES", "500"))
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+COLLECTION_NAME = "Clothes_products"
+
+# Query embedders, one warm instance per backend, all sharing the embedding cache
+def get_embedder(app, backend):
+    embedder = app.state.embedders.get(backend)
+    if embedder is None:
+        function = make_embedding_function(backend, api_key=OPENAI_API_KEY, api_base=OPENAI_BASE_URL)
+        if backend == "openai":
+            function = GatedEmbeddingFunction(function, app.state.embedding_gateway, app.state.loop)
+        embedder = CachedEmbeddingFunction(
+            function, app.state.embedding_cache, namespace=f"{backend}:{function.model_name}"
+        )
+        app.state.embedders[backend] = embedder
+    return embedder
+
+# Runs (off the event loop) whenever a different collection version is about to
+# be served: builds everything derived from it and returns the commit that swaps
+# it into app.state. If this raises, the previous version stays in service.
+def on_collection_switch(app, collection):
+    # Queries must be embedded with the backend the collection was built with
+    embedder = get_embedder(app, backend_of(collection))
+    built_idf = (collection.metadata or {}).get("embedding_idf")
+    served_idf = getattr(embedder.embedding_function, "idf_hash", None)
+    if built_idf and built_idf != served_idf:
+        logger.error(f"{collection.name} was embedded with IDF weights {built_idf}, queries use {served_idf}")
+    # Static catalogue data for post-LLM product lookup, reloaded on every reindex
+    table = ProductTable.from_collection(collection)
+    retriever = HybridRetriever(table, vector_k=RETRIEVAL_VECTOR_K) if HYBRID_RETRIEVAL else None
+    parser = None
+    if app.state.intent_classifier is not None:
+        parser = retriever.parser if retriever is not None else ConstraintParser(table)
+    popular_version, popular = read_popular_queries(app, collection)
+    if not HNSW_SEARCH_EF_APPLIED:
+        apply_search_ef(collection, HNSW_SEARCH_EF)
+    elif HNSW_SEARCH_EF and search_ef_of(collection) != HNSW_SEARCH_EF:
+        # Workers don't modify the collection; versions built by db_store.py get it at creation
+        logger.warning(f"{collection.name} is served with search_ef={search_ef_of(collection)}, not {HNSW_SEARCH_EF}")
+    vector_index = None
+    if QUANTIZED_INDEX:
+        # Rebuilt whenever the alias is rewritten, i.e. after every db_store.py run
+        vector_index = QuantizedIndex.open(
+            collection,
+            os.path.join(QUANTIZED_INDEX_PATH, collection.name),
+            source_version=app.state.collection_holder.alias.mtime(),
+            rerank=QUANTIZED_RERANK,
+        )
+
+    def commit():
+        # Cached answers carry product metadata from the previous collection version
+        app.state.response_cache.clear()
+        app.state.embedder = embedder
+        app.state.product_table = table
+        app.state.retriever = retriever
+        if parser is not None:
+            app.state.intent_classifier.parser = parser
+        app.state.popular_queries_version, app.state.popular_queries = popular_version, popular
+        app.state.vector_index = vector_index
+    return commit
+
+# Blocking: collection settings applied once per deployment by serve.py,
+# before any worker opens the collection
+def apply_collection_settings():
+    if not HNSW_SEARCH_EF:
+        return
+    import chromadb
+
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    apply_search_ef(client.get_collection(CollectionAlias(CHROMA_PATH, COLLECTION_NAME).active()), HNSW_SEARCH_EF)
+
+# Blocking: read the popular-query table and its file version; only one built
+# against the served collection version is used
+def read_popular_queries(app, collection):
+    version = PopularQueries.version(POPULAR_QUERIES_PATH)
+    popular = PopularQueries.load(POPULAR_QUERIES_PATH, collection.name, app.state.collection_holder.alias.mtime())
+    if popular is not None and popular.manifest.get("hybrid") != HYBRID_RETRIEVAL:
+        logger.warning(f"Ignoring {POPULAR_QUERIES_PATH}: built with HYBRID_RETRIEVAL={int(not HYBRID_RETRIEVAL)}")
+        popular = None
+    return version, popular
+
+def load_popular_queries(app, collection):
+    app.state.popular_queries_version, app.state.popular_queries = read_popular_queries(app, collection)
+
+# The table is usually rewritten after the alias switch (db_store.py
+# --popular-queries), so its file is polled alongside the alias
+async def refresh_popular_queries(app, collection):
+    now = time.monotonic()
+    if now - app.state.popular_queries_checked < POPULAR_QUERIES_CHECK_INTERVAL:
+        return
+    app.state.popular_queries_checked = now
+    version = PopularQueries.version(POPULAR_QUERIES_PATH)
+    if version != app.state.popular_queries_version:
+        # Claimed before loading so concurrent requests don't reload it too
+        app.state.popular_queries_version = version
+        await run_blocking(app, load_popular_queries, app, collection)
+
+# Bad requests are our own fault; only availability problems count towards the circuit breaker
+def is_upstream_failure(error):
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
+def make_gateway(name, rpm, concurrency, queue, deadline, hedge_ms):
+    return UpstreamGateway(
+        name,
+        rate_per_minute=rpm,
+        max_concurrency=concurrency,
+        max_queue=queue,
+        deadline=deadline,
+        hedge_after=hedge_ms / 1000,
+        failure_threshold=UPSTREAM_BREAKER_FAILURES,
+        cooldown=UPSTREAM_BREAKER_COOLDOWN,
+        is_failure=is_upstream_failure,
+        on_event=metrics.UPSTREAM_EVENTS.inc,
+    )
+
+# 503 (shed, rate limited, circuit open) or 504 (deadline) with a Retry-After hint
+def upstream_http_error(error):
+    logger.warning(f"Upstream unavailable: {error}")
+    return HTTPException(
+        status_code=504 if isinstance(error, UpstreamTimeout) else 503,
+        detail="The AI model is busy, please retry shortly",
+        headers={"Retry-After": str(int(math.ceil(error.retry_after)))},
+    )
+
+def make_openai_client():
+    # One pooled async client per process instead of a new client per request
+    return openai.AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        base_url=OPENAI_BASE_URL,
+        timeout=OPENAI_TIMEOUT,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+            ),
+            timeout=OPENAI_TIMEOUT,
+        ),
+    )
+
+# Run a blocking vector-store call on the bounded executor, off the event loop
+async def run_blocking(app, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app.state.vector_executor, partial(fn, *args, **kwargs))
+
+# Micro-batch handlers. Embedding batches are keyed by embedder, so a backend
+# switch never mixes models; query batches by collection, `where` and n_results,
+# since Chroma applies one filter to every query embedding in a call.
+async def embed_batch(app, embedder, texts):
+    return await run_blocking(app, embedder, texts)
+
+# Blocking: nearest products for a list of query embeddings, from the int8
+# index when it serves this collection, otherwise from Chroma's HNSW index
+def search_vectors(app, collection, embeddings, n_results, where=None):
+    index = app.state.vector_index
+    table = app.state.product_table
+    if index is None or index.collection_name != collection.name or table is None:
+        query = {"query_embeddings": embeddings, "n_results": n_results}
+        if where:
+            query["where"] = where
+        return collection.query(**query)
+    results = index.query(embeddings, n_results, where=where, table=table)
+    results["metadatas"] = [[table.get(pid) for pid in ids] for ids in results["ids"]]
+    results["documents"] = [[table.documents[table.row(pid)] for pid in ids] for ids in results["ids"]]
+    return results
+
+async def query_batch(app, key, items):
+    _, where, n_results = key
+    collection = items[0][0]
+    embeddings = [embedding for _, embedding in items]
+    results = await run_blocking(
+        app, search_vectors, app, collection, embeddings, n_results, json.loads(where) if where else None
+    )
+    return [
+        {field: [results[field][i]] for field in ("ids", "documents", "metadatas") if results.get(field)}
+        for i in range(len(items))
+    ]
+
+async def embed_query(app, prompt):
+    batcher = app.state.embed_batcher
+    if batcher is None:
+        return (await run_blocking(app, app.state.embedder, [prompt]))[0]
+    return await batcher.submit(prompt, key=app.state.embedder)
+
+async def query_vectors(app, collection, embedding, n_results, where=None):
+    batcher = app.state.query_batcher
+    if batcher is None:
+        return await run_blocking(app, search_vectors, app, collection, [embedding], n_results, where)
+    key = (collection.name, json.dumps(where, sort_keys=True) if where else None, n_results)
+    return await batcher.submit((collection, embedding), key=key)
+
+# Scrape-time gauges over the app's caches and batchers
+def register_state_metrics(app):
+    registry = metrics.REGISTRY
+    registry.callback_gauge(
+        "chatbot_embedding_cache_hit_rate", "Query embedding cache hit rate",
+        lambda: app.state.embedding_cache.stats()["hit_rate"],
+    )
+    registry.callback_gauge(
+        "chatbot_embedding_cache_entries", "Query embeddings held in memory",
+        lambda: app.state.embedding_cache.stats()["size"],
+    )
+    registry.callback_gauge(
+        "chatbot_response_cache_hit_rate", "Response cache hit rate, exact and near-duplicate",
+        lambda: app.state.response_cache.stats()["hit_rate"],
+    )
+    registry.callback_gauge(
+        "chatbot_response_cache_entries", "Cached responses",
+        lambda: app.state.response_cache.stats()["size"],
+    )
+    registry.callback_gauge(
+        "chatbot_catalogue_products", "Products in the in-memory product table",
+        lambda: len(app.state.product_table) if app.state.product_table is not None else 0,
+    )
+    registry.callback_gauge(
+        "chatbot_popular_queries", "Prompts with precomputed results for the served collection",
+        lambda: len(app.state.popular_queries) if app.state.popular_queries is not None else 0,
+    )
+    registry.callback_gauge(
+        "chatbot_vector_index_bytes", "Resident memory of the int8 vector index",
+        lambda: app.state.vector_index.memory_bytes() if app.state.vector_index is not None else 0,
+    )
+    gateways = (app.state.chat_gateway, app.state.embedding_gateway)
+    registry.callback_gauge(
+        "chatbot_upstream_in_flight", "Upstream API calls in flight",
+        lambda: {(gateway.name,): gateway.in_flight for gateway in gateways}, ["upstream"],
+    )
+    registry.callback_gauge(
+        "chatbot_upstream_queued", "Calls waiting for an upstream slot or rate-limit token",
+        lambda: {(gateway.name,): gateway.queued for gateway in gateways}, ["upstream"],
+    )
+    registry.callback_gauge(
+        "chatbot_upstream_circuit_open", "1 while the upstream circuit breaker is open",
+        lambda: {(gateway.name,): int(gateway.breaker.state != CLOSED) for gateway in gateways}, ["upstream"],
+    )
+    if app.state.embed_batcher is not None:
+        registry.callback_gauge(
+            "chatbot_mean_batch_size", "Mean micro-batch size since startup",
+            lambda: {
+                ("embedding",): app.state.embed_batcher.stats()["mean_batch_size"],
+                ("vector_query",): app.state.query_batcher.stats()["mean_batch_size"],
+            },
+            ["batcher"],
+        )
+
+# Share one ChromaDB client/collection across all requests for the app's lifetime
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.vector_executor = ThreadPoolExecutor(
+        max_workers=VECTOR_STORE_WORKERS, thread_name_prefix="chroma"
+    )
+    app.state.openai_client = make_openai_client()
+    app.state.loop = asyncio.get_running_loop()
+    if METRICS_DIR:
+        metrics.REGISTRY.share(METRICS_DIR)
+    app.state.chat_gateway = make_gateway(
+        "chat", UPSTREAM_CHAT_RPM, UPSTREAM_CHAT_CONCURRENCY, UPSTREAM_CHAT_QUEUE,
+        UPSTREAM_CHAT_DEADLINE, UPSTREAM_CHAT_HEDGE_MS,
+    )
+    app.state.embedding_gateway = make_gateway(
+        "embedding", UPSTREAM_EMBEDDING_RPM, UPSTREAM_EMBEDDING_CONCURRENCY, UPSTREAM_EMBEDDING_QUEUE,
+        UPSTREAM_EMBEDDING_DEADLINE, UPSTREAM_EMBEDDING_HEDGE_MS,
+    )
+    app.state.embedding_cache = EmbeddingCache(
+        max_entries=EMBEDDING_CACHE_SIZE,
+        ttl=EMBEDDING_CACHE_TTL,
+        persist_path=EMBEDDING_CACHE_PATH,
+    )
+    app.state.embedders = {}
+    app.state.embed_batcher = None
+    app.state.query_batcher = None
+    if MICRO_BATCH_WINDOW_MS > 0:
+        window = MICRO_BATCH_WINDOW_MS / 1000
+        app.state.embed_batcher = MicroBatcher(
+            partial(embed_batch, app), max_batch_size=MICRO_BATCH_MAX_SIZE, max_wait=window, name="embedding"
+        )
+        app.state.query_batcher = MicroBatcher(
+            partial(query_batch, app), max_batch_size=MICRO_BATCH_MAX_SIZE, max_wait=window, name="vector query"
+        )
+    app.state.prompt_builder = PromptBuilder(
+        model=CHAT_MODEL, max_prompt_tokens=PROMPT_TOKEN_BUDGET, max_history_messages=PROMPT_MAX_HISTORY,
+        system_prompt=SYSTEM_PROMPT if STRUCTURED_OUTPUT == "off" else STRUCTURED_SYSTEM_PROMPT,
+    )
+    app.state.retriever = None
+    app.state.product_table = None
+    app.state.vector_index = None
+    app.state.popular_queries = None
+    app.state.popular_queries_version = None
+    app.state.popular_queries_checked = 0.0
+    app.state.ready = False
+    app.state.intent_classifier = None
+    if INTENT_FAST_PATH:
+        app.state.intent_classifier = IntentClassifier(
+            embedding_function=HashingEmbeddingFunction() if INTENT_MODEL else None
+        )
+    app.state.response_cache = ResponseCache(
+        max_entries=RESPONSE_CACHE_SIZE,
+        ttl=RESPONSE_CACHE_TTL,
+        similarity_threshold=float(RESPONSE_CACHE_SIMILARITY) if RESPONSE_CACHE_SIMILARITY else None,
+        history_turns=RESPONSE_CACHE_HISTORY_TURNS,
+    )
+    app.state.session_store = make_session_store(SESSION_STORE_URL, ttl=SESSION_TTL, max_sessions=SESSION_MAX)
+    app.state.collection_holder = CollectionHolder(
+        path=CHROMA_PATH,
+        alias=CollectionAlias(CHROMA_PATH, COLLECTION_NAME),
+        health_check_interval=float(os.getenv("CHROMA_HEALTH_CHECK_INTERVAL", "30")),
+    )
+    app.state.collection_holder.add_listener(partial(on_collection_switch, app))
+    register_state_metrics(app)
+    # Warm the configured backend now so the first request doesn't load a model
+    app.state.embedder = await run_blocking(app, get_embedder, app, os.getenv("EMBEDDING_BACKEND", DEFAULT_BACKEND))
+    try:
+        # Loads the product table, retriever and vector index via on_collection_switch
+        collection = await app.state.collection_holder.aget(app.state.vector_executor)
+    except Exception as e:
+        # Keep serving; the holder reconnects lazily on the next request
+        logger.error(f"Initial ChromaDB connection failed: {e}")
+    else:
+        queries = load_warmup_queries(WARMUP_QUERIES_PATH, WARMUP_QUERIES)
+        if queries:
+            try:
+                await run_blocking(
+                    app, warm_up, app.state.embedder,
+                    partial(search_vectors, app, collection, n_results=RETRIEVAL_VECTOR_K), queries,
+                )
+            except Exception as e:
+                logger.error(f"Warm-up failed: {e}")
+        app.state.ready = True
+    yield
+    app.state.collection_holder.close()
+    if app.state.embed_batcher is not None:
+        await app.state.embed_batcher.close()
+        await app.state.query_batcher.close()
+    logger.info(f"Embedding cache stats: {app.state.embedding_cache.stats()}")
+    logger.info(f"Response cache stats: {app.state.response_cache.stats()}")
+    logger.info(f"Prompt token totals: {app.state.prompt_builder.totals}")
+    if app.state.embed_batcher is not None:
+        logger.info(f"Embedding batches: {app.state.embed_batcher.stats()}")
+        logger.info(f"Vector query batches: {app.state.query_batcher.stats()}")
+    app.state.embedding_cache.close()
+    app.state.session_store.close()
+    await app.state.openai_client.close()
+    app.state.vector_executor.shutdown(wait=False)
+    metrics.REGISTRY.stop_sharing()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -32,35 +488,61 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(metrics.MetricsMiddleware, server_timing=SERVER_TIMING)
+if RECORD_REQUESTS_PATH:
+    app.add_middleware(TrafficRecorderMiddleware, path=RECORD_REQUESTS_PATH)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Most reused cached responses in this worker, to see what the cache is saving
+@app.get("/response-cache/top")
+async def response_cache_top(request: Request, limit: int = 20):
+    if not RESPONSE_CACHE_ADMIN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return {
+        "pid": os.getpid(),
+        "stats": request.app.state.response_cache.stats(),
+        "entries": request.app.state.response_cache.top_entries(max(1, min(limit, 200))),
+    }
+
+# Readiness for load balancers: 503 until the collection, product table and
+# warm-up are done (e.g. while ChromaDB was unreachable at startup)
+@app.get("/ready")
+async def ready(request: Request):
+    state = request.app.state
+    if not state.ready or state.product_table is None:
+        try:
+            await state.collection_holder.aget(state.vector_executor)
+        except Exception:
+            raise HTTPException(status_code=503, detail="Not ready")
+        if state.product_table is None:
+            raise HTTPException(status_code=503, detail="Not ready")
+        state.ready = True
+    return {
+        "status": "ready",
+        "pid": os.getpid(),
+        "collection": state.collection_holder.collection_name,
+        "products": len(state.product_table),
+        "vector_index": state.vector_index is not None,
+    }
 
 # ChromaDB dependency
-def get_chroma_collection():
+async def get_chroma_collection(request: Request):
     try:
-        chromadb_host = os.getenv("CHROMADB_HOST", "http://13.233.244.30")
-        chromadb_port = int(os.getenv("CHROMADB_PORT", "8001"))
-
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                client = chromadb.PersistentClient(path="./chroma_db")
-                client.heartbeat()
-                embedding_func = embedding_functions.OpenAIEmbeddingFunction(
-                    api_key=OPENAI_API_KEY,
-                    model_name="text-embedding-ada-002"
-                )
-                collection = client.get_or_create_collection("Clothes_products", embedding_function=embedding_func)
-                logger.info(f"Connected to ChromaDB at {chromadb_host}:{chromadb_port}")
-                return collection
-            except Exception as e:
-                logger.warning(f"ChromaDB connection attempt {attempt + 1} failed: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(10)
-                else:
-                    raise
+        with span("chroma_connect"):
+            collection = await request.app.state.collection_holder.aget(request.app.state.vector_executor)
     except Exception as e:
         logger.error(f"Error initializing ChromaDB: {e}")
         raise HTTPException(status_code=500, detail="Failed to initialize database")
+    try:
+        await refresh_popular_queries(request.app, collection)
+    except Exception as e:
+        logger.error(f"Failed to reload popular queries: {e}")
+    return collection
 
 # Pydantic model for request
 class PromptRequest(BaseModel):
@@ -68,121 +550,374 @@ class PromptRequest(BaseModel):
     chat_history: List[Dict[str, str]] = []
     session_id: str | None = None
 
-@app.post("/generate-response")
-async def generate_response(request: PromptRequest, collection=Depends(get_chroma_collection)):
-    try:
-        logger.info(f"Processing request for session_id: {request.session_id}")
-
-        # Validate chat_history format
-        valid_roles = {"user", "assistant", "system"}
-        for msg in request.chat_history:
-            if not all(key in msg for key in ["role", "content"]) or msg["role"] not in valid_roles:
-                raise HTTPException(status_code=400, detail="Invalid chat_history format")
-
-        # Limit chat history to last 10 messages
-        max_history_length = 10
-        limited_history = request.chat_history[-max_history_length:]
+def validate_chat_history(chat_history):
+    valid_roles = {"user", "assistant", "system"}
+    for msg in chat_history:
+        if not all(key in msg for key in ["role", "content"]) or msg["role"] not in valid_roles:
+            raise HTTPException(status_code=400, detail="Invalid chat_history format")
 
-        # Query ChromaDB for relevant products
-        try:
-            results = collection.query(
-                query_texts=[request.prompt],
-                n_results=5
-            )
-            if not results["documents"] or not results["documents"][0]:
+# Query ChromaDB for relevant products
+async def retrieve_products(app, collection, prompt, n_results=RETRIEVAL_TOP_N):
+    # Frequent prompts were embedded and retrieved offline for this collection version
+    popular = app.state.popular_queries
+    entry = popular.get(prompt) if popular is not None and n_results <= popular.candidates else None
+    if entry is not None:
+        metrics.POPULAR_QUERY_HITS.inc("candidates")
+        product_ids = entry.candidates[:n_results]
+        logger.info(f"Found {len(product_ids)} precomputed products")
+        return product_ids, product_names_for(app, product_ids), entry.embedding
+    try:
+        # Cached prompts skip the embedding round trip entirely
+        with span("embedding"):
+            query_embedding = await embed_query(app, prompt)
+        retriever = app.state.retriever
+        if retriever is not None:
+            with span("constraint_filter"):
+                constraints, allowed, where = await run_blocking(app, retriever.plan, prompt)
+            with span("vector_search"):
+                results = await query_vectors(app, collection, query_embedding, retriever.vector_k, where)
+            with span("fusion"):
+                product_ids, metadatas = await run_blocking(
+                    app, retriever.fuse, prompt, results["ids"][0], constraints, allowed, n_results
+                )
+            if not product_ids:
                 logger.info("No products found for query")
-                product_ids = []
-                product_names = []
             else:
-                product_ids = results["ids"][0]
-                product_names = [metadata.get("name", "") for metadata in results["metadatas"][0]]
                 logger.info(f"Found {len(product_ids)} products")
-        except Exception as e:
-            logger.error(f"ChromaDB query error: {e}")
-            product_ids = []
-            product_names = []
-
-        # Prepare product string to send to GPT (only use product names)
-        product_string = "Available products (suggest only when appropriate):\n"
-        for pid, name in zip(product_ids, product_names):
-            product_string += f"{pid}. {name}\n"
-
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                "You are a polite and empathetic chatbot specializing in CLOTHING and fashion advice."
-                # "⚠️ When a user says more, show me more, any other?, or similar phrases asking for additional options, continue suggesting **up to 4 more products** that match the **SAME COLOR and STYLE** previously discussed." 
-                "Your primary goal is to understand the user's preferences — such as clothing type, preferred colors, occasion, style (e.g., casual, formal, ethnic), and any fabric sensitivities — before offering product suggestions. "
-                "If the user's query is vague or lacks sufficient context, ask polite follow-up questions to clarify. "
-                "You may also recommend products that are relevant based on their description, brand, or color, even if the user doesn't explicitly mention them. "
-                "You can only suggest products for women. If someone asks for men's or kids' products, politely respond that YOU CAN ONLY RECOMMED WOMEN'S clothing. "
-                "You MUST only recommend products that are present in the provided data. Do not recommend any product outside the provided data under any circumstances. "
-                "Do not give any extra information unless the user explicitly asks for it.\n\n"
-                "DO NOT provide any other COLORS OR STYLES  product unless the user explicitly asks for them. "
-                "YOU MUST PROVIDE CORRECT COLOR and BRAND and STYLE of the product. which user is asking for.\n\n"
-
-                "⚠️ When you are ready to recommend products, strictly follow this EXACT format for EACH item:\n"
-                "You are a helpful, friendly, and accurate fashion assistant. Your job is to suggest up to 4 women's fashion products based ONLY on the data provided.\n\n"
-
-                "✅ Response Format:\n"
-                "- Start with a polite line like: 'Thank you for your query!' or 'I'm here to help you!'\n"
-                "- Then say: 'Here are some options for [item]:'\n"
-                "- If only one product is returned, list it without a number.\n"
-                "- List up to 4 products as: \"<number>. <Product Name>.\" Product ID: <numeric_id>(one per line).\n"
-                "- Do not repeat the intro for each product.\n"
-                "- Do not mention images; the frontend will display them from metadata.\n\n"
-
-               
-
-                "⚠️ Important rules:\n"
-                "- Recommend a maximum of 4 products.\n"
-                "- ❌ If you cannot find a matching Product ID from the list, do NOT suggest that product.\n"
-                "- ❌ Do not guess or invent Product IDs.\n"
-
-                "- Do NOT add any extra descriptions, bullet points, or formatting.\n"
-                "- NEVER suggest a product without including its Product ID. If you cannot find an appropriate Product ID, do not suggest that product at all.\n"
-                "- ❌ If you suggest products without a Product ID, your response will be rejected.\n"
-                "- ❌ Do NOT suggest any product that is not present in the provided data.\n"
-                "- ❌ Do NOT suggest any product for men or kids. Only recommend products for women.\n"
-                "- ❌ Do NOT provide any extra information unless the user asks for it explicitly.\n\n"
-
-                f"{product_string}"
-                )
+            return product_ids, [metadata.get("name", "") for metadata in metadatas], query_embedding
+
+        with span("vector_search"):
+            results = await query_vectors(app, collection, query_embedding, n_results)
+        if not results["documents"] or not results["documents"][0]:
+            logger.info("No products found for query")
+            return [], [], query_embedding
+        product_ids = results["ids"][0]
+        product_names = [metadata.get("name", "") for metadata in results["metadatas"][0]]
+        logger.info(f"Found {len(product_ids)} products")
+        return product_ids, product_names, query_embedding
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"ChromaDB query error: {e}")
+        return [], [], None
+
+# Resolve product metadata for the IDs the model emitted. IDs outside this
+# request's candidates are dropped; the in-memory table answers without a
+# database round trip, with ChromaDB as the fallback before it has loaded.
+async def fetch_products(app, collection, product_ids, candidate_ids):
+    if not product_ids:
+        return []
+    table = app.state.product_table
+    if table is not None:
+        return table.resolve(product_ids, allowed=candidate_ids)
+    candidates = {str(pid) for pid in candidate_ids}
+    product_ids = [pid for pid in product_ids if str(pid) in candidates]
+    if not product_ids:
+        return []
+    try:
+        products_data = await run_blocking(
+            app, collection.get, ids=[str(pid) for pid in product_ids]
+        )
+        return list(products_data.get("metadatas", []))
+    except Exception as e:
+        logger.error(f"Failed to fetch matched products from ChromaDB: {e}")
+        return []
+
+def stream_delta_text(delta):
+    if delta.tool_calls:
+        return "".join(call.function.arguments or "" for call in delta.tool_calls if call.function)
+    return delta.content or ""
+
+# Message and product IDs from the model's reply, counted by format
+def parse_completion(raw):
+    message, product_ids, structured = parse_reply(raw)
+    metrics.RESPONSE_FORMATS.inc("structured" if structured else "text")
+    return message, product_ids
+
+# Everything derived from a request before the chat completion is called
+class PreparedRequest:
+    __slots__ = ("prompt", "history", "product_ids", "query_embedding", "messages", "token_stats", "session")
+
+    def __init__(self, prompt, history, product_ids, query_embedding, messages, token_stats, session):
+        self.prompt = prompt
+        self.history = history
+        self.product_ids = product_ids
+        self.query_embedding = query_embedding
+        self.messages = messages
+        self.token_stats = token_stats
+        self.session = session
+
+def product_names_for(app, product_ids):
+    table = app.state.product_table
+    return [(table.get(pid) or {}).get("name", "") for pid in product_ids]
+
+async def load_session(app, request):
+    session = None
+    if request.session_id:
+        with span("session_load"):
+            session = await run_blocking(app, app.state.session_store.get, request.session_id)
+    return session or SessionState()
+
+async def prepare_request(request, app, collection, session):
+    logger.debug(f"Processing request for session_id: {request.session_id}")
+
+    # Clients that still send their own history take precedence over the stored one
+    history = request.chat_history or session.history
+
+    # "Show me more" pages through the last search; the phrase itself is never
+    # stored as the session's query
+    more = MORE_PATTERN.match(request.prompt) is not None
+    paging = more and session.query is not None and app.state.product_table is not None
+
+    if paging:
+        page = await more_page(app, collection, session)
+        # Next unseen candidates from the last search, no embedding or vector query when stored
+        logger.info(f"Paging {len(page)} candidates for session_id: {request.session_id}")
+        product_ids, product_names, query_embedding = page, product_names_for(app, page), None
+        session.shown = session.shown + page
+        metrics.PAGINATED_REQUESTS.inc()
+    else:
+        candidates, candidate_names, query_embedding = await retrieve_products(
+            app, collection, request.prompt, max(SESSION_CANDIDATES, RETRIEVAL_TOP_N)
+        )
+        product_ids, product_names = candidates[:RETRIEVAL_TOP_N], candidate_names[:RETRIEVAL_TOP_N]
+        if not more:
+            session.query, session.candidates, session.shown = request.prompt, list(candidates), list(product_ids)
+    session.last = list(product_ids)
+
+    # Trim history to the token budget (at most the last PROMPT_MAX_HISTORY messages)
+    with span("prompt_build"):
+        messages, token_stats = app.state.prompt_builder.build(
+            history, request.prompt, product_ids, product_names
+        )
+    app.state.prompt_builder.record(token_stats)
+    metrics.record_prompt(token_stats)
+    metrics.CANDIDATES.observe(len(product_ids))
+    logger.debug(f"Prompt tokens: {token_stats}")
+    return PreparedRequest(
+        request.prompt, messages[1:-1], product_ids, query_embedding, messages, token_stats, session
+    )
+
+# Remember the turn, the candidate set and what was shown for the next request in this session
+async def save_session(app, request, session, history, response_text):
+    if not request.session_id:
+        return
+    session.history = (history + [
+        {"role": "user", "content": request.prompt},
+        {"role": "assistant", "content": response_text},
+    ])[-PROMPT_MAX_HISTORY:]
+    try:
+        with span("session_save"):
+            await run_blocking(app, app.state.session_store.put, request.session_id, session)
+    except Exception as e:
+        logger.error(f"Failed to save session {request.session_id}: {e}")
+
+def price_of(table, pid):
+    row = table.row(pid)
+    if row is None:
+        return None
+    return parse_price(table.value(row, "price") or table.value(row, "Price"))
+
+# Re-run the session's last search with follow-up overrides (colour, price
+# ceiling), skipping the IDs in `exclude`: the search goes that much deeper so
+# paging past the stored candidates still finds new products
+async def requery(app, collection, query, n_results, exclude=(), **overrides):
+    retriever = app.state.retriever
+    excluded = set(exclude)
+    query_embedding = await embed_query(app, query)  # an embedding cache hit in practice
+    if retriever is None:
+        results = await query_vectors(app, collection, query_embedding, n_results + len(excluded))
+        product_ids = results["ids"][0]
+    else:
+        depth = retriever.vector_k + len(excluded)
+        constraints, allowed, where = await run_blocking(app, retriever.plan, query, **overrides)
+        results = await query_vectors(app, collection, query_embedding, depth, where)
+        product_ids, _ = await run_blocking(
+            app, retriever.fuse, query, results["ids"][0], constraints, allowed, n_results + len(excluded), depth
+        )
+    return [pid for pid in product_ids if pid not in excluded][:n_results]
+
+# Next page of unseen products for "show me more": the stored candidates, or
+# when they run short, the stored query searched again past everything shown.
+# On a query error the remaining stored candidates are still served.
+async def more_page(app, collection, session):
+    table = app.state.product_table
+    shown = set(session.shown)
+    page = [pid for pid in session.candidates if pid not in shown and pid in table][:RETRIEVAL_TOP_N]
+    if len(page) == RETRIEVAL_TOP_N:
+        return page
+    try:
+        candidates = await requery(
+            app, collection, session.query, max(SESSION_CANDIDATES, RETRIEVAL_TOP_N), exclude=session.shown
+        )
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"ChromaDB query error: {e}")
+        return page
+    session.candidates = candidates
+    return [pid for pid in candidates if pid in table][:RETRIEVAL_TOP_N]
+
+# Deterministic answer for pagination / "cheaper" / "in another colour" follow-ups:
+# products come from the previous candidate set, or a filtered re-query of the
+# previous prompt when it runs short, and the text is templated. Returns None
+# to send the turn down the normal LLM path.
+async def answer_follow_up(app, collection, request, session):
+    classifier = app.state.intent_classifier
+    table = app.state.product_table
+    if classifier is None or table is None or session.query is None:
+        return None
+    with span("intent"):
+        intent = classifier.classify(request.prompt)
+    if intent is None:
+        return None
+
+    def color_of(pid):
+        row = table.row(pid)
+        return None if row is None else table.value(row, "color")
+
+    overrides = {}
+    if intent.kind == MORE:
+        header = "Here are a few more options you might like:"
+        empty = "That's everything I found for this search. Would you like to try something else?"
+    elif intent.kind == CHEAPER:
+        # An explicit ceiling ("under 1000") or below the cheapest product shown last
+        prices = [price for price in (price_of(table, pid) for pid in session.last) if price is not None]
+        ceiling = intent.max_price if intent.max_price is not None else min(prices, default=None)
+        if ceiling is None:
+            return None
+        inclusive = intent.max_price is not None
+
+        def wanted(pid):
+            price = price_of(table, pid)
+            return price is not None and (price <= ceiling if inclusive else price < ceiling)
+        overrides["max_price"] = ceiling
+        header = f"Here are some options under ₹{ceiling:g}:"
+        empty = f"I couldn't find anything under ₹{ceiling:g} for this search. Would you like to try something else?"
+    elif intent.colors:
+        colors = intent.colors
+
+        def wanted(pid):
+            return color_of(pid) in colors
+        overrides["colors"] = colors
+        header = f"Here are some options in {', '.join(sorted(colors))}:"
+        empty = f"I couldn't find this in {', '.join(sorted(colors))}. Would you like to see other colours?"
+    else:
+        previous = {color_of(pid) for pid in session.last} - {None}
+
+        def wanted(pid):
+            return color_of(pid) not in previous
+        overrides["exclude_colors"] = previous
+        header = "Here are some options in other colours:"
+        empty = "I couldn't find this in other colours. Would you like to try something else?"
+
+    shown = set(session.shown)
+    if intent.kind == MORE:
+        page = await more_page(app, collection, session)
+    else:
+        page = [pid for pid in session.candidates if pid not in shown and pid in table and wanted(pid)][:RETRIEVAL_TOP_N]
+    if len(page) < RETRIEVAL_TOP_N and overrides and app.state.retriever is not None:
+        candidates = await requery(
+            app, collection, session.query, max(SESSION_CANDIDATES, RETRIEVAL_TOP_N), **overrides
+        )
+        candidates = [pid for pid in candidates if wanted(pid)]
+        last = set(session.last)
+        page = [pid for pid in candidates if pid not in last][:RETRIEVAL_TOP_N]
+        session.candidates, session.shown = candidates, []
+    if not page:
+        response_text, products = empty, []
+    else:
+        products = table.resolve(page)
+        lines = [header] + [f"{i}. {product.get('name', '')}" for i, product in enumerate(products, start=1)]
+        response_text = "\n".join(lines)
+        session.shown = session.shown + page
+        session.last = page
+
+    metrics.FAST_PATH_ANSWERS.inc(intent.kind)
+    logger.info(f"Answered {intent} without the LLM for session_id: {request.session_id}")
+    await save_session(app, request, session, request.chat_history or session.history, response_text)
+    return response_text, products
+
+def lookup_cached_response(app, prepared):
+    with span("response_cache"):
+        cached = app.state.response_cache.get(
+            prepared.product_ids, prepared.history, prepared.prompt, embedding=prepared.query_embedding
+        )
+    metrics.RESPONSE_CACHE_LOOKUPS.inc("hit" if cached is not None else "miss")
+    if cached is not None:
+        logger.debug("Serving response from response cache")
+        return cached
+    return precomputed_response(app, prepared)
+
+# First-turn answer from the popular-query table, if it was built for the same candidates
+def precomputed_response(app, prepared):
+    popular = app.state.popular_queries
+    if popular is None or prepared.history:
+        return None
+    entry = popular.get(prepared.prompt)
+    if entry is None or entry.response is None or entry.candidates[:popular.top_n] != list(prepared.product_ids):
+        return None
+    metrics.POPULAR_QUERY_HITS.inc("response")
+    products = app.state.product_table.resolve(entry.response_ids, allowed=prepared.product_ids)
+    return CachedResponse(entry.response, products, entry.embedding)
+
+def store_cached_response(app, prepared, response, products):
+    app.state.response_cache.put(
+        prepared.product_ids, prepared.history, prepared.prompt, response, products,
+        embedding=prepared.query_embedding
+    )
+
+@app.post("/generate-response")
+async def generate_response(request: PromptRequest, http_request: Request, collection=Depends(get_chroma_collection)):
+    try:
+        # Validate chat_history format
+        validate_chat_history(request.chat_history)
+        session = await load_session(http_request.app, request)
+        follow_up = await answer_follow_up(http_request.app, collection, request, session)
+        if follow_up is not None:
+            response_text, products = follow_up
+            return {
+                "response": response_text,
+                "products": products
+            }
+        prepared = await prepare_request(request, http_request.app, collection, session)
+
+        cached = lookup_cached_response(http_request.app, prepared)
+        if cached is not None:
+            await save_session(http_request.app, request, prepared.session, prepared.history, cached.response)
+            return {
+                "response": cached.response,
+                "products": cached.products
             }
-        ] + limited_history + [{"role": "user", "content": request.prompt}]
 
         # Generate response with OpenAI
         try:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=500,
-                temperature=0.7
-            )
-            response_text = response.choices[0].message.content
+            with span("llm"):
+                response = await http_request.app.state.chat_gateway.call(
+                    lambda: http_request.app.state.openai_client.chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=prepared.messages,
+                        max_tokens=500,
+                        temperature=0.7,
+                        **RESPONSE_FORMAT_ARGS
+                    )
+                )
+            response_text = completion_text(response.choices[0].message)
+            if response.usage is not None:
+                metrics.COMPLETION_TOKENS.inc(amount=response.usage.completion_tokens)
         except openai.OpenAIError as e:
             logger.error(f"OpenAI API error: {e}")
             raise HTTPException(status_code=500, detail="Error communicating with the AI model")
 
-       # Extract Product IDs in format: Product ID: 123
-        matched_ids = re.findall(r'Product ID:\s*(\d{1,6})', response_text)
-        logger.info(f"Extracted product IDs from GPT response: {matched_ids}")
-
-        # Fetch product metadata from ChromaDB
-        matched_products = []
-        if matched_ids:
-            try:
-                products_data = collection.get(ids=[str(pid) for pid in matched_ids])
-                for metadata in products_data.get("metadatas", []):
-                    matched_products.append(metadata)
-            except Exception as e:
-                logger.error(f"Failed to fetch matched products from ChromaDB: {e}")
+        with span("id_extraction"):
+            cleaned_response, matched_ids = parse_completion(response_text)
+        logger.debug(f"Extracted {len(matched_ids)} product IDs from GPT response")
 
-        # Remove product IDs from GPT response before sending to frontend
-        cleaned_response = re.sub(r'\n?Product ID:\s*\d{1,6}', '', response_text).strip()
-        cleaned_response = re.sub(r'\n?\s*Product ID:.*', '', response_text)
+        with span("metadata_fetch"):
+            matched_products = await fetch_products(http_request.app, collection, matched_ids, prepared.product_ids)
+        metrics.MATCHED_PRODUCTS.observe(len(matched_products))
+        store_cached_response(http_request.app, prepared, cleaned_response, matched_products)
+        await save_session(http_request.app, request, prepared.session, prepared.history, cleaned_response)
 
         # Return GPT response and relevant product metadata
         return {
@@ -192,6 +927,136 @@ async def generate_response(request: PromptRequest, collection=Depends(get_chrom
 
     except HTTPException as e:
         raise e
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+def ndjson_event(event_type, **fields):
+    return json.dumps({"type": event_type, **fields}) + "\n"
+
+# Streaming variant of /generate-response, as newline-delimited JSON events:
+#   {"type": "token", "text": ...}      cleaned text as the model writes it
+#   {"type": "product", "product": ...} metadata as soon as each Product ID completes
+#   {"type": "done", "response": ..., "products": [...]}
+#   {"type": "error", "detail": ...}    plus "retry_after" (seconds) when upstream is overloaded
+@app.post("/generate-response/stream")
+async def generate_response_stream(request: PromptRequest, http_request: Request, collection=Depends(get_chroma_collection)):
+    app = http_request.app
+    try:
+        # Validate chat_history format
+        validate_chat_history(request.chat_history)
+        session = await load_session(app, request)
+        follow_up = await answer_follow_up(app, collection, request, session)
+        prepared = None
+        if follow_up is None:
+            prepared = await prepare_request(request, app, collection, session)
+    except HTTPException as e:
+        raise e
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+    async def follow_up_events():
+        response_text, products = follow_up
+        yield ndjson_event("token", text=response_text)
+        for product in products:
+            yield ndjson_event("product", product=product)
+        yield ndjson_event("done", response=response_text, products=products)
+
+    if follow_up is not None:
+        return StreamingResponse(follow_up_events(), media_type="application/x-ndjson")
+
+    cached = lookup_cached_response(app, prepared)
+
+    async def cached_events():
+        await save_session(app, request, prepared.session, prepared.history, cached.response)
+        yield ndjson_event("token", text=cached.response)
+        for product in cached.products:
+            yield ndjson_event("product", product=product)
+        yield ndjson_event("done", response=cached.response, products=cached.products)
+
+    if cached is not None:
+        return StreamingResponse(cached_events(), media_type="application/x-ndjson")
+
+    # Shed before the response starts, while a 503 can still be sent
+    try:
+        app.state.chat_gateway.check()
+    except UpstreamUnavailable as e:
+        raise upstream_http_error(e)
+
+    async def events():
+        parser = ResponseStreamParser()
+        response_parts = []
+        matched_products = []
+
+        async def emit_products(ids):
+            if not ids:
+                return
+            with span("metadata_fetch"):
+                products = await fetch_products(app, collection, ids, prepared.product_ids)
+            for product in products:
+                matched_products.append(product)
+                yield ndjson_event("product", product=product)
+
+        try:
+            start = time.perf_counter()
+            first_token = True
+            # The slot is held for the whole stream; the deadline covers the wait for it and the first response
+            async with app.state.chat_gateway.slot() as expires:
+                try:
+                    stream = await asyncio.wait_for(
+                        app.state.openai_client.chat.completions.create(
+                            model=CHAT_MODEL,
+                            messages=prepared.messages,
+                            max_tokens=500,
+                            temperature=0.7,
+                            stream=True,
+                            **RESPONSE_FORMAT_ARGS
+                        ),
+                        max(0.0, expires - time.monotonic()),
+                    )
+                except asyncio.TimeoutError:
+                    raise UpstreamTimeout("chat: deadline exceeded before the stream started")
+                async for chunk in stream:
+                    delta = stream_delta_text(chunk.choices[0].delta) if chunk.choices else ""
+                    if not delta:
+                        continue
+                    if first_token:
+                        first_token = False
+                        metrics.STAGE_SECONDS.observe(time.perf_counter() - start, "llm_first_token")
+                    text, ids = parser.feed(delta)
+                    if text:
+                        response_parts.append(text)
+                        yield ndjson_event("token", text=text)
+                    async for event in emit_products(ids):
+                        yield event
+
+            text, ids = parser.close()
+            if text:
+                response_parts.append(text)
+                yield ndjson_event("token", text=text)
+            async for event in emit_products(ids):
+                yield event
+
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - start, "llm")
+            metrics.MATCHED_PRODUCTS.observe(len(matched_products))
+            metrics.RESPONSE_FORMATS.inc("structured" if parser.structured else "text")
+            response_text = "".join(response_parts).strip()
+            store_cached_response(app, prepared, response_text, matched_products)
+            await save_session(app, request, prepared.session, prepared.history, response_text)
+            yield ndjson_event("done", response=response_text, products=matched_products)
+        except UpstreamUnavailable as e:
+            logger.warning(f"Upstream unavailable while streaming: {e}")
+            yield ndjson_event("error", detail="The AI model is busy, please retry shortly", retry_after=e.retry_after)
+        except openai.OpenAIError as e:
+            logger.error(f"OpenAI API error: {e}")
+            yield ndjson_event("error", detail="Error communicating with the AI model")
+        except Exception as e:
+            logger.error(f"Unexpected error while streaming: {e}")
+            yield ndjson_event("error", detail=f"An unexpected error occurred: {e}")
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
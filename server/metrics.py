@@ -0,0 +1,340 @@
+import bisect
+import contextvars
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal in-process metrics with Prometheus text exposition. Recording is a
+# lock, a bisect and two additions, cheap enough to leave on for every request.
+#
+# With several worker processes a scrape reaches only one of them, so each
+# worker can share its samples through a directory (Registry.share): /metrics
+# then sums counters and histograms over every worker that has written there
+# and reports gauges per live worker with a `worker` label.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(labelnames, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, labels), value) for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+# Gauge read at scrape time, e.g. from a cache's stats()
+class CallbackGauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, callback, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, _labels(self.labelnames, labels), value) for labels, value in values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append((
+                    f"{self.name}_bucket",
+                    _labels(self.labelnames + ("le",), labels + (_number(bound),)),
+                    cumulative,
+                ))
+            samples.append((f"{self.name}_sum", _labels(self.labelnames, labels), total))
+            samples.append((f"{self.name}_count", _labels(self.labelnames, labels), count))
+        return samples
+
+
+def _with_worker(labels, worker):
+    pair = f'worker="{worker}"'
+    return "{" + pair + "}" if not labels else labels[:-1] + "," + pair + "}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self.shared_dir = None
+        self.share_interval = 5.0
+        self._worker = None
+        self._stop = threading.Event()
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def callback_gauge(self, name, help, callback, labelnames=()):
+        return self._add(CallbackGauge(name, help, callback, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def _collect(self):
+        return [(metric.name, metric.kind, metric.help, metric.samples()) for metric in self._metrics.values()]
+
+    # Start writing this process's samples to `directory` every `interval`
+    # seconds (and on every scrape). Call in each worker after the fork.
+    def share(self, directory, interval=5.0):
+        os.makedirs(directory, exist_ok=True)
+        self.shared_dir = directory
+        self.share_interval = interval
+        self._worker = str(os.getpid())
+        self._stop.clear()
+        threading.Thread(target=self._share_loop, name="metrics-share", daemon=True).start()
+
+    def stop_sharing(self):
+        if self.shared_dir is None:
+            return
+        self._stop.set()
+        self._dump()
+
+    def _share_loop(self):
+        while not self._stop.wait(self.share_interval):
+            try:
+                self._dump()
+            except OSError:
+                pass
+
+    def _dump(self):
+        snapshot = {"worker": self._worker, "metrics": self._collect()}
+        fd, tmp_path = tempfile.mkstemp(dir=self.shared_dir, prefix=".metrics-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, os.path.join(self.shared_dir, f"worker-{self._worker}.json"))
+
+    # Counters and histograms from every worker that ever wrote (a worker that
+    # exited still served those requests); gauges only from workers that wrote
+    # within the last few intervals
+    def _merged(self):
+        self._dump()
+        merged, order = {}, []
+        cutoff = time.time() - 3 * self.share_interval
+        for path in sorted(glob.glob(os.path.join(self.shared_dir, "worker-*.json"))):
+            try:
+                fresh = os.stat(path).st_mtime >= cutoff
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, kind, help, samples in snapshot["metrics"]:
+                if name not in merged:
+                    merged[name] = (kind, help, {})
+                    order.append(name)
+                values = merged[name][2]
+                for sample, labels, value in samples:
+                    if kind == "gauge":
+                        if fresh:
+                            values[(sample, _with_worker(labels, snapshot["worker"]))] = value
+                    else:
+                        values[(sample, labels)] = values.get((sample, labels), 0) + value
+        result = []
+        for name in order:
+            kind, help, values = merged[name]
+            result.append((name, kind, help, [(sample, labels, value) for (sample, labels), value in values.items()]))
+        return result
+
+    def render(self):
+        lines = []
+        for name, kind, help, samples in (self._collect() if self.shared_dir is None else self._merged()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in samples:
+                lines.append(f"{sample}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "chatbot_request_seconds", "Time until the response body is complete", ["path", "status"]
+)
+STAGE_SECONDS = REGISTRY.histogram("chatbot_stage_seconds", "Time spent in each pipeline stage", ["stage"])
+STAGE_ERRORS = REGISTRY.counter("chatbot_stage_errors_total", "Pipeline stages that raised", ["stage"])
+PROMPT_TOKENS = REGISTRY.histogram(
+    "chatbot_prompt_tokens", "Prompt tokens sent to the chat model", buckets=TOKEN_BUCKETS
+)
+PROMPT_PART_TOKENS = REGISTRY.counter(
+    "chatbot_prompt_part_tokens_total", "Prompt tokens by part of the prompt", ["part"]
+)
+COMPLETION_TOKENS = REGISTRY.counter("chatbot_completion_tokens_total", "Completion tokens reported by the chat model")
+HISTORY_DROPPED = REGISTRY.counter(
+    "chatbot_history_messages_dropped_total", "History messages dropped to fit the token budget"
+)
+CANDIDATES = REGISTRY.histogram(
+    "chatbot_candidates", "Candidate products offered to the model per request", buckets=COUNT_BUCKETS
+)
+MATCHED_PRODUCTS = REGISTRY.histogram(
+    "chatbot_matched_products", "Products the model recommended per request", buckets=COUNT_BUCKETS
+)
+RESPONSE_FORMATS = REGISTRY.counter(
+    "chatbot_response_formats_total", "Model replies by format: structured JSON or Product ID lines", ["format"]
+)
+POPULAR_QUERY_HITS = REGISTRY.counter(
+    "chatbot_popular_query_hits_total", "Requests served from the precomputed popular-query table", ["kind"]
+)
+RESPONSE_CACHE_LOOKUPS = REGISTRY.counter(
+    "chatbot_response_cache_lookups_total", "Response cache lookups", ["result"]
+)
+PAGINATED_REQUESTS = REGISTRY.counter(
+    "chatbot_paginated_requests_total", "Requests served from a session's stored candidates"
+)
+UPSTREAM_EVENTS = REGISTRY.counter(
+    "chatbot_upstream_events_total", "Upstream API call outcomes, rejections and hedges", ["upstream", "event"]
+)
+FAST_PATH_ANSWERS = REGISTRY.counter(
+    "chatbot_fast_path_answers_total", "Follow-up turns answered without the LLM", ["intent"]
+)
+
+# Spans recorded for the current request, for the Server-Timing header
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def record_prompt(token_stats):
+    PROMPT_TOKENS.observe(token_stats["total_tokens"])
+    for part in ("system", "candidate", "history", "prompt"):
+        PROMPT_PART_TOKENS.inc(part, amount=token_stats[f"{part}_tokens"])
+    if token_stats["dropped_messages"]:
+        HISTORY_DROPPED.inc(amount=token_stats["dropped_messages"])
+
+
+def server_timing(spans):
+    totals = {}
+    for stage, elapsed in spans:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in totals.items())
+
+
+# Pure ASGI middleware: times every HTTP request and, when enabled, adds a
+# Server-Timing header with the spans recorded before the headers went out
+# (for streamed responses that covers everything up to the first byte).
+class MetricsMiddleware:
+    def __init__(self, app, server_timing=False, skip_paths=("/metrics",)):
+        self.app = app
+        self.server_timing = server_timing
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing and spans:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(spans).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Label by route template so unknown paths can't blow up cardinality
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - start, path, status)
+            _request_spans.reset(token)
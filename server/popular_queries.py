@@ -0,0 +1,265 @@
+import argparse
+import array
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from embedding_cache import normalize_prompt
+from warmup import count_queries
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Precomputed results for the most frequent prompts, built offline from
+# request logs and served from memory: the prompt embedding, the ranked
+# candidates the live retrieval would return and, optionally, a first-turn
+# answer from the chat model. The table records the collection version it was
+# built against; main.py ignores a table built for another version, so rerun
+# this after every db_store.py ingestion (db_store.py --popular-queries does);
+# servers poll the file and reload it when it is rewritten.
+#
+#   python popular_queries.py --queries recorded_requests.jsonl --top 500 --responses
+
+# Same model main.py answers with
+CHAT_MODEL = "gpt-3.5-turbo"
+
+
+class PopularQuery:
+    __slots__ = ("prompt", "count", "embedding", "candidates", "response", "response_ids")
+
+    def __init__(self, prompt, count, embedding, candidates, response=None, response_ids=None):
+        self.prompt = prompt
+        self.count = count
+        self.embedding = embedding
+        self.candidates = candidates
+        self.response = response
+        self.response_ids = response_ids or []
+
+
+class PopularQueries:
+    def __init__(self, entries, manifest):
+        self.entries = entries
+        self.manifest = manifest
+        self.collection_name = manifest.get("collection")
+        self.candidates = manifest.get("candidates", 0)
+        self.top_n = manifest.get("top_n", 0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, prompt):
+        return self.entries.get(normalize_prompt(prompt))
+
+    # Changes whenever the file is rewritten
+    @staticmethod
+    def version(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except (FileNotFoundError, TypeError):
+            return None
+
+    # The whole table, or None when it is missing or was built for another
+    # collection version
+    @classmethod
+    def load(cls, path, collection_name=None, source_version=None):
+        if not path or not os.path.exists(path):
+            return None
+        conn = sqlite3.connect(path)
+        try:
+            manifest = json.loads(conn.execute("SELECT value FROM meta WHERE key = 'manifest'").fetchone()[0])
+            if collection_name is not None and (
+                manifest.get("collection") != collection_name or manifest.get("source_version") != source_version
+            ):
+                logger.warning(
+                    f"Ignoring {path}: built for {manifest.get('collection')} version "
+                    f"{manifest.get('source_version')}; rerun popular_queries.py"
+                )
+                return None
+            entries = {}
+            for key, prompt, count, embedding, candidates, response, response_ids in conn.execute(
+                "SELECT key, prompt, count, embedding, candidates, response, response_ids FROM queries"
+            ):
+                entries[key] = PopularQuery(
+                    prompt, count, array.array("f", embedding).tolist(), json.loads(candidates),
+                    response, json.loads(response_ids) if response_ids else None,
+                )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Could not load popular queries from {path}: {e}")
+            return None
+        finally:
+            conn.close()
+        logger.info(f"Loaded {len(entries)} popular queries for {manifest.get('collection')} from {path}")
+        return cls(entries, manifest)
+
+    # Written next to the target and swapped in, so servers never read a partial table
+    @staticmethod
+    def write(path, entries, manifest):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".popular-")
+        os.close(fd)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute(
+                "CREATE TABLE queries (key TEXT PRIMARY KEY, prompt TEXT, count INTEGER, embedding BLOB, "
+                "candidates TEXT, response TEXT, response_ids TEXT)"
+            )
+            conn.execute("INSERT INTO meta VALUES ('manifest', ?)", (json.dumps(manifest),))
+            conn.executemany(
+                "INSERT INTO queries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        key, entry.prompt, entry.count, array.array("f", entry.embedding).tobytes(),
+                        json.dumps(entry.candidates), entry.response,
+                        json.dumps(entry.response_ids) if entry.response is not None else None,
+                    )
+                    for key, entry in entries.items()
+                ],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+
+
+# Most frequent normalised prompts across the query files, as (key, prompt, count)
+def mine_queries(paths, top, min_count=2):
+    counts, originals = Counter(), {}
+    for path in paths:
+        count_queries(path, counts, originals)
+    return [(key, originals[key], count) for key, count in counts.most_common(top) if count >= min_count]
+
+
+# Blocking: embed and retrieve for every mined prompt the way main.py does,
+# optionally asking the chat model for a first-turn answer
+def build(collection, queries, embedding_function, retriever=None, candidates=20, top_n=4,
+          answer=None, batch_size=100):
+    table = retriever.table if retriever is not None else None
+    entries = {}
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        embeddings = embedding_function([prompt for _, prompt, _ in batch])
+        for (key, prompt, count), embedding in zip(batch, embeddings):
+            embedding = [float(value) for value in embedding]
+            if retriever is not None:
+                product_ids, metadatas = retriever.retrieve(collection, embedding, prompt, candidates)
+            else:
+                results = collection.query(query_embeddings=[embedding], n_results=candidates)
+                product_ids, metadatas = results["ids"][0], results["metadatas"][0]
+            entry = PopularQuery(prompt, count, embedding, list(product_ids))
+            if answer is not None and product_ids:
+                names = [(metadata or {}).get("name", "") for metadata in metadatas[:top_n]]
+                entry.response, entry.response_ids = answer(prompt, product_ids[:top_n], names)
+                if table is not None:
+                    # Only products that were offered to the model and still exist
+                    shown = set(product_ids[:top_n])
+                    entry.response_ids = [pid for pid in entry.response_ids if pid in shown and pid in table]
+            entries[key] = entry
+        logger.info(f"Precomputed {len(entries)}/{len(queries)} popular queries")
+    return entries
+
+
+# Chat answer for a first turn, built with the same prompt and output format as main.py
+def make_answerer(structured_output, max_prompt_tokens, max_history_messages):
+    import openai
+
+    from prompt_builder import STRUCTURED_SYSTEM_PROMPT, SYSTEM_PROMPT, PromptBuilder, response_format_args
+    from streaming import completion_text, parse_reply
+
+    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
+    builder = PromptBuilder(
+        model=CHAT_MODEL, max_prompt_tokens=max_prompt_tokens, max_history_messages=max_history_messages,
+        system_prompt=SYSTEM_PROMPT if structured_output == "off" else STRUCTURED_SYSTEM_PROMPT,
+    )
+    format_args = response_format_args(structured_output)
+
+    def answer(prompt, product_ids, product_names):
+        messages, _ = builder.build([], prompt, product_ids, product_names)
+        response = client.chat.completions.create(
+            model=CHAT_MODEL, messages=messages, max_tokens=500, temperature=0.7, **format_args
+        )
+        message, ids, _ = parse_reply(completion_text(response.choices[0].message))
+        return message, ids
+
+    return answer
+
+
+# Rebuild the table for the active collection version
+def refresh(chroma_path, query_paths, output, top=500, min_count=2, responses=False):
+    from collection_alias import CollectionAlias
+    from db_store import COLLECTION_NAME, connect
+    from embeddings import backend_of, make_embedding_function
+    from product_table import ProductTable
+    from retrieval import HybridRetriever
+
+    start = time.perf_counter()
+    queries = mine_queries(query_paths, top, min_count)
+    if not queries:
+        logger.warning(f"No prompt occurs {min_count}+ times in {', '.join(query_paths)}; nothing to precompute")
+        return 0
+
+    alias = CollectionAlias(chroma_path, COLLECTION_NAME)
+    source_version = alias.mtime()
+    client = connect(chroma_path)
+    collection = client.get_collection(alias.active())
+    embedding_function = make_embedding_function(backend_of(collection), api_key=os.getenv("OPENAI_API_KEY"))
+    retriever = None
+    if os.getenv("HYBRID_RETRIEVAL", "1") == "1":
+        retriever = HybridRetriever(
+            ProductTable.from_collection(collection), vector_k=int(os.getenv("RETRIEVAL_VECTOR_K", "20"))
+        )
+    candidates = max(int(os.getenv("SESSION_CANDIDATES", "20")), int(os.getenv("RETRIEVAL_TOP_N", "4")))
+    top_n = int(os.getenv("RETRIEVAL_TOP_N", "4"))
+    answer = None
+    if responses:
+        answer = make_answerer(
+            os.getenv("STRUCTURED_OUTPUT", "tools"),
+            int(os.getenv("PROMPT_TOKEN_BUDGET", "2500")),
+            int(os.getenv("PROMPT_MAX_HISTORY", "10")),
+        )
+
+    entries = build(collection, queries, embedding_function, retriever, candidates, top_n, answer)
+    PopularQueries.write(output, entries, {
+        "collection": collection.name,
+        "source_version": source_version,
+        "candidates": candidates,
+        "top_n": top_n,
+        "hybrid": retriever is not None,
+        "built": time.time(),
+    })
+    covered = sum(entry.count for entry in entries.values())
+    logger.info(
+        f"Wrote {len(entries)} popular queries ({covered} logged requests) for {collection.name} to {output} "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute results for the most frequent prompts.")
+    parser.add_argument(
+        "--queries", action="append",
+        help="request log (RECORD_REQUESTS_PATH), conversation JSONL or plain text; repeatable",
+    )
+    parser.add_argument("--output", default=os.getenv("POPULAR_QUERIES_PATH", "./popular_queries.db"))
+    parser.add_argument("--chroma-path", default=os.getenv("CHROMA_PATH", "./chroma_db"))
+    parser.add_argument("--top", type=int, default=500, help="number of prompts to precompute")
+    parser.add_argument("--min-count", type=int, default=2, help="skip prompts seen fewer times")
+    parser.add_argument("--responses", action="store_true", help="also precompute first-turn chat answers")
+    args = parser.parse_args()
+
+    load_dotenv()
+    query_paths = args.queries or [os.getenv("RECORD_REQUESTS_PATH") or "../client/src/test.jsonl"]
+    refresh(args.chroma_path, query_paths, args.output, args.top, args.min_count, args.responses)
+
+
+if __name__ == "__main__":
+    main()
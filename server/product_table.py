@@ -0,0 +1,82 @@
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+# Read-only, column-oriented copy of the catalogue metadata held in process.
+# Rows are addressed by the Chroma ID (the seq_id written by db_store.py), so
+# resolving the Product IDs in a model response is a dict lookup instead of a
+# collection.get round trip. Repeated string values (colours, brands, ...) are
+# interned so each distinct value is stored once.
+class ProductTable:
+    __slots__ = ("ids", "documents", "fields", "columns", "_rows")
+
+    def __init__(self, ids, documents, metadatas):
+        self.ids = [str(pid) for pid in ids]
+        self.documents = list(documents) if documents is not None else [None] * len(self.ids)
+        self.fields = sorted({field for metadata in metadatas for field in (metadata or {})})
+        self.columns = {field: [None] * len(self.ids) for field in self.fields}
+        for row, metadata in enumerate(metadatas):
+            for field, value in (metadata or {}).items():
+                self.columns[field][row] = sys.intern(value) if isinstance(value, str) else value
+        self._rows = {pid: row for row, pid in enumerate(self.ids)}
+
+    @classmethod
+    def from_collection(cls, collection, page_size=1000):
+        ids, documents, metadatas = [], [], []
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            if not page["ids"]:
+                break
+            ids.extend(page["ids"])
+            documents.extend(page["documents"])
+            metadatas.extend(page["metadatas"])
+            offset += len(page["ids"])
+        table = cls(ids, documents, metadatas)
+        logger.info(f"Loaded product table: {len(table)} products, {len(table.fields)} fields")
+        return table
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, pid):
+        return str(pid) in self._rows
+
+    def row(self, pid):
+        return self._rows.get(str(pid))
+
+    def value(self, row, field, default=None):
+        column = self.columns.get(field)
+        if column is None:
+            return default
+        value = column[row]
+        return default if value is None else value
+
+    def metadata(self, row):
+        return {field: column[row] for field, column in self.columns.items() if column[row] is not None}
+
+    def get(self, pid):
+        row = self._rows.get(str(pid))
+        return None if row is None else self.metadata(row)
+
+    # Metadata for the IDs a model emitted, in order and without duplicates.
+    # IDs outside `allowed` (the request's retrieved candidates) or unknown to
+    # the catalogue are treated as hallucinated and dropped.
+    def resolve(self, product_ids, allowed=None):
+        allowed = {str(pid) for pid in allowed} if allowed is not None else None
+        products, seen, dropped = [], set(), []
+        for pid in product_ids:
+            pid = str(pid)
+            if pid in seen:
+                continue
+            seen.add(pid)
+            row = self._rows.get(pid)
+            if row is None or (allowed is not None and pid not in allowed):
+                dropped.append(pid)
+                continue
+            products.append(self.metadata(row))
+        if dropped:
+            logger.warning(f"Dropped product IDs outside the candidate set: {dropped}")
+        return products
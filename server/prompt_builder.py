@@ -0,0 +1,224 @@
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Unless TIKTOKEN_CACHE_DIR is already set, tiktoken reads encodings from the
+# vendored directory, so token counting never downloads anything at startup.
+# Files are named as in tiktoken's own cache (the SHA-1 of the download URL):
+# 9b5ad71b... is cl100k_base.tiktoken, which gpt-3.5-turbo uses. tiktoken
+# verifies its SHA-256 when loading it.
+_VENDORED_ENCODINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiktoken_cache")
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", _VENDORED_ENCODINGS)
+
+# Static instructions, assembled once at import instead of on every request
+SYSTEM_RULES = (
+    "You are a polite and empathetic chatbot specializing in CLOTHING and fashion advice."
+    # "⚠️ When a user says more, show me more, any other?, or similar phrases asking for additional options, continue suggesting **up to 4 more products** that match the **SAME COLOR and STYLE** previously discussed." 
+    "Your primary goal is to understand the user's preferences — such as clothing type, preferred colors, occasion, style (e.g., casual, formal, ethnic), and any fabric sensitivities — before offering product suggestions. "
+    "If the user's query is vague or lacks sufficient context, ask polite follow-up questions to clarify. "
+    "You may also recommend products that are relevant based on their description, brand, or color, even if the user doesn't explicitly mention them. "
+    "You can only suggest products for women. If someone asks for men's or kids' products, politely respond that YOU CAN ONLY RECOMMED WOMEN'S clothing. "
+    "You MUST only recommend products that are present in the provided data. Do not recommend any product outside the provided data under any circumstances. "
+    "Do not give any extra information unless the user explicitly asks for it.\n\n"
+    "DO NOT provide any other COLORS OR STYLES  product unless the user explicitly asks for them. "
+    "YOU MUST PROVIDE CORRECT COLOR and BRAND and STYLE of the product. which user is asking for.\n\n"
+)
+
+# Plain-text replies: products are recovered from "Product ID: <id>" lines
+TEXT_FORMAT_RULES = (
+    "⚠️ When you are ready to recommend products, strictly follow this EXACT format for EACH item:\n"
+    "You are a helpful, friendly, and accurate fashion assistant. Your job is to suggest up to 4 women's fashion products based ONLY on the data provided.\n\n"
+
+    "✅ Response Format:\n"
+    "- Start with a polite line like: 'Thank you for your query!' or 'I'm here to help you!'\n"
+    "- Then say: 'Here are some options for [item]:'\n"
+    "- If only one product is returned, list it without a number.\n"
+    "- List up to 4 products as: \"<number>. <Product Name>.\" Product ID: <numeric_id>(one per line).\n"
+    "- Do not repeat the intro for each product.\n"
+    "- Do not mention images; the frontend will display them from metadata.\n\n"
+
+    "⚠️ Important rules:\n"
+    "- Recommend a maximum of 4 products.\n"
+    "- ❌ If you cannot find a matching Product ID from the list, do NOT suggest that product.\n"
+    "- ❌ Do not guess or invent Product IDs.\n"
+
+    "- Do NOT add any extra descriptions, bullet points, or formatting.\n"
+    "- NEVER suggest a product without including its Product ID. If you cannot find an appropriate Product ID, do not suggest that product at all.\n"
+    "- ❌ If you suggest products without a Product ID, your response will be rejected.\n"
+    "- ❌ Do NOT suggest any product that is not present in the provided data.\n"
+    "- ❌ Do NOT suggest any product for men or kids. Only recommend products for women.\n"
+    "- ❌ Do NOT provide any extra information unless the user asks for it explicitly.\n\n"
+)
+SYSTEM_PROMPT = SYSTEM_RULES + TEXT_FORMAT_RULES
+
+# Structured replies carry the IDs in their own field, so the format rules shrink
+STRUCTURED_FORMAT_RULES = (
+    "Reply with a `message` for the user and the `product_ids` you recommend.\n"
+    "- message: start with a short polite line, then list up to 4 products as \"<number>. <Product Name>.\" "
+    "one per line. Never write Product IDs in the message. Do not mention images.\n"
+    "- product_ids: the IDs of exactly the products listed in the message, in the same order; "
+    "[] when you are only asking a question.\n"
+    "- Only use products and IDs from the list below; never invent one. Only recommend products for women.\n\n"
+)
+STRUCTURED_SYSTEM_PROMPT = SYSTEM_RULES + STRUCTURED_FORMAT_RULES
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "message": {"type": "string", "description": "Reply shown to the user, without product IDs"},
+        "product_ids": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "IDs of the recommended products, from the provided list, in the order mentioned",
+        },
+    },
+    "required": ["message", "product_ids"],
+    "additionalProperties": False,
+}
+RESPONSE_FUNCTION = "recommend_products"
+
+
+# Extra chat.completions.create arguments for an output mode: "tools" forces a
+# function call whose arguments follow RESPONSE_SCHEMA (gpt-3.5-turbo and
+# later), "json_schema" uses structured outputs (gpt-4o-mini and later), "off"
+# keeps plain text. The message fields always start with the message, so it
+# can be streamed before the IDs arrive.
+def response_format_args(mode):
+    if mode == "tools":
+        return {
+            "tools": [{
+                "type": "function",
+                "function": {
+                    "name": RESPONSE_FUNCTION,
+                    "description": "Reply to the user and list the recommended products",
+                    "parameters": RESPONSE_SCHEMA,
+                },
+            }],
+            "tool_choice": {"type": "function", "function": {"name": RESPONSE_FUNCTION}},
+        }
+    if mode == "json_schema":
+        return {
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "fashion_reply", "strict": True, "schema": RESPONSE_SCHEMA},
+            },
+        }
+    if mode == "off":
+        return {}
+    raise ValueError(f"Unknown structured output mode: {mode}")
+
+CANDIDATES_HEADER = "Available products (suggest only when appropriate):\n"
+
+# Per-message overhead of the chat format (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+APPROXIMATE_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def _load_encoding(model):
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable ({e}); using approximate token counts")
+        return None
+
+
+# Fits the static system prompt, the candidate list, as much recent history as
+# the budget allows and the new prompt into `max_prompt_tokens`. Older turns are
+# shortened first, then dropped oldest-first; the new prompt is always kept.
+class PromptBuilder:
+    def __init__(self, model="gpt-3.5-turbo", max_prompt_tokens=2500, max_history_messages=10,
+                 keep_full_messages=2, old_message_tokens=60, max_name_chars=80, system_prompt=SYSTEM_PROMPT):
+        self.model = model
+        self.system_prompt = system_prompt
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_history_messages = max_history_messages
+        self.keep_full_messages = keep_full_messages
+        self.old_message_tokens = old_message_tokens
+        self.max_name_chars = max_name_chars
+        self._encoding = _load_encoding(model)
+        self.system_tokens = self.count(system_prompt)
+        self.totals = {"requests": 0, "total_tokens": 0, "history_tokens": 0,
+                       "dropped_messages": 0, "truncated_messages": 0}
+
+    def count(self, text):
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return len(APPROXIMATE_TOKEN.findall(text))
+
+    def _truncate(self, text, max_tokens):
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text)
+            if len(tokens) <= max_tokens:
+                return text
+            return self._encoding.decode(tokens[:max_tokens]).rstrip() + " …"
+        pieces = list(APPROXIMATE_TOKEN.finditer(text))
+        if len(pieces) <= max_tokens:
+            return text
+        return text[:pieces[max_tokens - 1].end()].rstrip() + " …"
+
+    # One short line per candidate
+    def encode_candidates(self, product_ids, product_names):
+        lines = []
+        for pid, name in zip(product_ids, product_names):
+            name = " ".join(str(name or "").split())
+            if len(name) > self.max_name_chars:
+                name = name[:self.max_name_chars].rstrip() + "…"
+            lines.append(f"{pid}. {name}\n")
+        return CANDIDATES_HEADER + "".join(lines)
+
+    def build(self, history, prompt, product_ids, product_names):
+        candidates = self.encode_candidates(product_ids, product_names)
+        candidate_tokens = self.count(candidates)
+        prompt_tokens = self.count(prompt) + MESSAGE_OVERHEAD_TOKENS
+        budget = self.max_prompt_tokens - self.system_tokens - candidate_tokens - MESSAGE_OVERHEAD_TOKENS - prompt_tokens
+
+        # Walk history newest-first so the most recent turns win the budget
+        kept, history_tokens, truncated = [], 0, 0
+        recent = history[-self.max_history_messages:] if self.max_history_messages else []
+        for age, message in enumerate(reversed(recent)):
+            content = message["content"]
+            if age >= self.keep_full_messages:
+                shortened = self._truncate(content, self.old_message_tokens)
+                if shortened != content:
+                    truncated += 1
+                    content = shortened
+            tokens = self.count(content) + MESSAGE_OVERHEAD_TOKENS
+            if history_tokens + tokens > budget:
+                # Keep the start of the message that crosses the budget if a useful part fits
+                remaining = budget - history_tokens - MESSAGE_OVERHEAD_TOKENS
+                if remaining < self.old_message_tokens // 2:
+                    break
+                content = self._truncate(content, remaining - 1)
+                tokens = self.count(content) + MESSAGE_OVERHEAD_TOKENS
+                truncated += 1
+                kept.append({"role": message["role"], "content": content})
+                history_tokens += tokens
+                break
+            kept.append({"role": message["role"], "content": content})
+            history_tokens += tokens
+        kept.reverse()
+
+        messages = [{"role": "system", "content": self.system_prompt + candidates}] + kept + [
+            {"role": "user", "content": prompt}
+        ]
+        stats = {
+            "system_tokens": self.system_tokens,
+            "candidate_tokens": candidate_tokens,
+            "history_tokens": history_tokens,
+            "prompt_tokens": prompt_tokens,
+            "total_tokens": self.system_tokens + candidate_tokens + MESSAGE_OVERHEAD_TOKENS + history_tokens + prompt_tokens,
+            "history_messages": len(kept),
+            "dropped_messages": len(history) - len(kept),
+            "truncated_messages": truncated,
+        }
+        return messages, stats
+
+    # Running totals across requests, for logs and metrics
+    def record(self, stats):
+        self.totals["requests"] += 1
+        for key in ("total_tokens", "history_tokens", "dropped_messages", "truncated_messages"):
+            self.totals[key] += stats[key]
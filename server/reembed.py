@@ -0,0 +1,107 @@
+import argparse
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from collection_alias import CollectionAlias, collection_names
+from db_store import COLLECTION_NAME, IngestState, connect, embed_batch
+from embeddings import HashingEmbeddingFunction, collection_metadata, hashing_idf_path, make_embedding_function
+from vector_index import hnsw_metadata
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Re-embed the stored catalogue (documents + metadata already in ChromaDB) with
+# another embedding backend into a new collection version, without needing
+# Fashion_Dataset.json. Product IDs are copied unchanged.
+
+def iter_pages(collection, page_size):
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed the product catalogue into a new collection version.")
+    parser.add_argument("--backend", required=True, choices=["openai", "hashing", "sentence-transformers"])
+    parser.add_argument("--chroma-path", default=os.getenv("CHROMA_PATH", "./chroma_db"))
+    parser.add_argument("--state", default=os.getenv("INGEST_STATE_PATH", "./ingest_state.db"))
+    parser.add_argument("--source", help="collection to read from (default: the active one)")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--activate", action="store_true", help="switch the alias to the new version when done")
+    parser.add_argument("--hnsw-m", type=int)
+    parser.add_argument("--hnsw-construction-ef", type=int)
+    parser.add_argument("--hnsw-search-ef", type=int)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = connect(args.chroma_path)
+    alias = CollectionAlias(args.chroma_path, COLLECTION_NAME)
+    source_name = args.source or alias.active()
+    if source_name not in collection_names(client):
+        logger.error(f"Error: collection {source_name} not found.")
+        exit(1)
+    source = client.get_collection(source_name)
+
+    embedding_func = make_embedding_function(args.backend, api_key=os.getenv("OPENAI_API_KEY"))
+    if isinstance(embedding_func, HashingEmbeddingFunction) and embedding_func.idf is None:
+        embedding_func.fit_idf(
+            (doc for page in iter_pages(source, 1000) for doc in page["documents"]),
+            hashing_idf_path(),
+        )
+
+    target_name = alias.next_version(client)
+    # Keep the source's HNSW parameters unless overridden
+    hnsw = {key: value for key, value in (source.metadata or {}).items() if key.startswith("hnsw:")}
+    hnsw.update(hnsw_metadata(args.hnsw_m, args.hnsw_construction_ef, args.hnsw_search_ef))
+    target = client.create_collection(
+        target_name, metadata={**collection_metadata(args.backend, embedding_func), **hnsw}
+    )
+    logger.info(f"Re-embedding {source_name} -> {target_name} with {args.backend}")
+
+    def embed(page):
+        return page, embed_batch(embedding_func, page["documents"])
+
+    total = 0
+
+    def store(future):
+        nonlocal total
+        page, embeddings = future.result()
+        target.upsert(
+            ids=page["ids"],
+            embeddings=embeddings,
+            documents=page["documents"],
+            metadatas=page["metadatas"],
+        )
+        total += len(page["ids"])
+        logger.info(f"Re-embedded {total} products")
+
+    # Keep a bounded number of pages in flight so memory stays flat, as in db_store.ingest
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        pending = set()
+        for page in iter_pages(source, args.batch_size):
+            pending.add(executor.submit(embed, page))
+            if len(pending) >= args.workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(future)
+        for future in pending:
+            store(future)
+
+    state = IngestState(args.state, target_name)
+    state.copy_from(source_name)
+    state.close()
+
+    logger.info(f"Finished {target_name}: {total} products")
+    if args.activate:
+        alias.activate(target_name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from embedding_cache import normalize_prompt
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class CachedResponse:
+    __slots__ = ("response", "products", "embedding", "created", "last_hit", "hits")
+
+    def __init__(self, response, products, embedding):
+        self.response = response
+        self.products = products
+        self.embedding = embedding
+        self.created = time.time()
+        self.last_hit = None
+        self.hits = 0
+
+
+# Cache of full generate_response results.
+# An entry is scoped by its group: the retrieved product IDs plus a hash of the
+# normalised last `history_turns` messages. Within a group the prompt must match
+# exactly after normalisation or, when `similarity_threshold` is set, have a
+# prompt embedding whose cosine similarity reaches the threshold.
+class ResponseCache:
+    def __init__(self, max_entries=2000, ttl=3600, similarity_threshold=None, history_turns=4):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.history_turns = history_turns
+
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def _group_key(self, product_ids, history):
+        recent = [
+            {"role": msg["role"], "content": normalize_prompt(msg["content"])}
+            for msg in history[-self.history_turns:]
+        ] if self.history_turns else []
+        digest = hashlib.sha1(json.dumps(recent, sort_keys=True).encode("utf-8")).hexdigest()
+        return (tuple(sorted(str(pid) for pid in product_ids)), digest)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        group = self._groups.get(key[0])
+        if group is not None:
+            group.discard(key)
+            if not group:
+                del self._groups[key[0]]
+
+    def _expired(self, entry):
+        return time.time() - entry.created > self.ttl
+
+    def _hit(self, key, entry):
+        entry.hits += 1
+        entry.last_hit = time.time()
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, product_ids, history, prompt, embedding=None):
+        group_key = self._group_key(product_ids, history)
+        key = (group_key, normalize_prompt(prompt))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self.hits += 1
+                return self._hit(key, entry)
+
+            if self.similarity_threshold is not None and embedding is not None:
+                best_key, best_score = None, self.similarity_threshold
+                for candidate_key in list(self._groups.get(group_key, ())):
+                    candidate = self._entries[candidate_key]
+                    if self._expired(candidate):
+                        self._remove(candidate_key)
+                        continue
+                    if candidate.embedding is None:
+                        continue
+                    score = _cosine(embedding, candidate.embedding)
+                    if score >= best_score:
+                        best_key, best_score = candidate_key, score
+                if best_key is not None:
+                    self.similar_hits += 1
+                    return self._hit(best_key, self._entries[best_key])
+
+            self.misses += 1
+            return None
+
+    def put(self, product_ids, history, prompt, response, products, embedding=None):
+        group_key = self._group_key(product_ids, history)
+        key = (group_key, normalize_prompt(prompt))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = CachedResponse(response, products, embedding)
+            self._groups.setdefault(group_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.similar_hits + self.misses
+            return {
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "hit_rate": (self.hits + self.similar_hits) / lookups if lookups else 0.0,
+            }
+
+    # Per-entry metrics for the most reused responses
+    def top_entries(self, limit=20):
+        with self._lock:
+            entries = sorted(self._entries.items(), key=lambda item: item[1].hits, reverse=True)
+            return [
+                {
+                    "prompt": key[1],
+                    "product_ids": list(key[0][0]),
+                    "hits": entry.hits,
+                    "age_seconds": round(time.time() - entry.created, 1),
+                    "last_hit": entry.last_hit,
+                }
+                for key, entry in entries[:limit]
+            ]
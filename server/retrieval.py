@@ -0,0 +1,363 @@
+import bisect
+import logging
+import math
+import re
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Metadata fields that may carry a category, in order of preference
+CATEGORY_FIELDS = ("category", "sub_category", "subcategory", "product_type", "article_type", "type")
+
+# Garment words used as categories when the catalogue has no category field;
+# they are matched against product names.
+GARMENT_TERMS = (
+    "saree", "sari", "kurti", "kurta", "kurta set", "lehenga", "salwar", "anarkali", "dupatta",
+    "dress", "gown", "maxi dress", "top", "tunic", "shirt", "t-shirt", "blouse", "crop top",
+    "jeans", "trousers", "pants", "palazzo", "leggings", "skirt", "shorts", "jumpsuit",
+    "jacket", "blazer", "coat", "sweater", "cardigan", "hoodie", "sweatshirt", "shrug",
+    "nightwear", "co-ord set",
+)
+
+# Everyday words that must never be read as a brand or colour (e.g. the brand "Only")
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "for", "with", "me", "my", "show", "more", "any", "other",
+    "only", "new", "look", "some", "want", "need", "like", "please", "i", "in", "of", "to",
+}
+
+PRICE_NUMBER = r"(?:rs\.?|inr|₹)?\s*(\d[\d,]*(?:\.\d+)?)\s*(?:rs\.?|inr|₹|rupees)?"
+PRICE_RANGE = re.compile(
+    rf"between\s*{PRICE_NUMBER}\s*(?:and|to|-)\s*{PRICE_NUMBER}|{PRICE_NUMBER}\s*(?:-|to)\s*{PRICE_NUMBER}"
+)
+PRICE_MAX = re.compile(rf"(?:under|below|less than|within|upto|up to|max(?:imum)?|cheaper than|<)\s*{PRICE_NUMBER}")
+PRICE_MIN = re.compile(rf"(?:above|over|more than|min(?:imum)?|at least|>)\s*{PRICE_NUMBER}")
+# Sizes and ages ("8 to 10", "above 5 years") look like prices; without a
+# currency marker a number only counts as a price from MIN_BARE_PRICE up and
+# when no unit follows it
+CURRENCY = re.compile(r"rs\.?|inr|₹|rupees")
+NOT_PRICE_UNIT = re.compile(r"\s*(?:years?|yrs?|months?|cm|inch(?:es)?|kg|size|xl|xxl)\b")
+MIN_BARE_PRICE = 100
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def parse_price(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"\d[\d,]*(?:\.\d+)?", str(value or ""))
+    return float(match.group(0).replace(",", "")) if match else None
+
+
+def _number(text):
+    return float(text.replace(",", ""))
+
+
+# Numbers of the first match of `pattern` in `text` that reads as a price
+def _price_numbers(pattern, text):
+    for match in pattern.finditer(text):
+        numbers = [_number(group) for group in match.groups() if group]
+        if CURRENCY.search(match.group(0)):
+            return numbers
+        if NOT_PRICE_UNIT.match(text, match.end()) or min(numbers) < MIN_BARE_PRICE:
+            continue
+        return numbers
+    return None
+
+
+def _singular(word):
+    if word.endswith(("sses", "shes", "ches", "xes")):
+        return word[:-2]
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+class Constraints:
+    __slots__ = ("colors", "exclude_colors", "brands", "categories", "min_price", "max_price")
+
+    def __init__(self):
+        self.colors = set()
+        self.exclude_colors = set()
+        self.brands = set()
+        self.categories = set()
+        self.min_price = None
+        self.max_price = None
+
+    def __bool__(self):
+        return bool(self.colors or self.exclude_colors or self.brands or self.categories
+                    or self.min_price is not None or self.max_price is not None)
+
+    def __repr__(self):
+        return (f"Constraints(colors={sorted(self.colors)}, exclude_colors={sorted(self.exclude_colors)}, "
+                f"brands={sorted(self.brands)}, categories={sorted(self.categories)}, "
+                f"price=[{self.min_price}, {self.max_price}])")
+
+
+# Rule-based extractor for colour/brand/category/price constraints. Its
+# vocabularies come from the catalogue's own metadata values (a ProductTable),
+# so a match can be used directly as an exact Chroma `where` filter.
+class ConstraintParser:
+    def __init__(self, table):
+        self.colors = {}
+        self.brands = {}
+        self.categories = {}
+        self.category_field = next(
+            (field for field in CATEGORY_FIELDS if any(table.columns.get(field) or ())), None
+        )
+
+        for color in set(table.columns.get("color") or ()):
+            color = str(color or "")
+            for part in re.split(r"[,/&]| and ", color):
+                if part.strip():
+                    self.colors.setdefault(self._phrase(part), set()).add(color)
+        for brand in set(table.columns.get("brand") or ()):
+            brand = str(brand or "")
+            if brand.strip():
+                self.brands.setdefault(self._phrase(brand), set()).add(brand)
+        if self.category_field:
+            for category in set(table.columns[self.category_field]):
+                category = str(category or "")
+                if category.strip():
+                    self.categories.setdefault(self._phrase(category), set()).add(category)
+
+        if not self.category_field:
+            for term in GARMENT_TERMS:
+                self.categories[self._phrase(term)] = {term}
+
+        for vocab in (self.colors, self.brands):
+            for phrase in [phrase for phrase in vocab if phrase in STOPWORDS]:
+                del vocab[phrase]
+
+        self.max_phrase_words = max(
+            (len(phrase.split()) for vocab in (self.colors, self.brands, self.categories) for phrase in vocab),
+            default=1,
+        )
+
+    @staticmethod
+    def _phrase(text):
+        return " ".join(_singular(token) for token in tokenize(text))
+
+    def parse(self, prompt):
+        constraints = Constraints()
+        text = prompt.lower()
+
+        numbers = _price_numbers(PRICE_RANGE, text)
+        if numbers:
+            constraints.min_price, constraints.max_price = min(numbers), max(numbers)
+        else:
+            numbers = _price_numbers(PRICE_MAX, text)
+            if numbers:
+                constraints.max_price = numbers[0]
+            numbers = _price_numbers(PRICE_MIN, text)
+            if numbers:
+                constraints.min_price = numbers[0]
+
+        # Greedy longest-phrase match over the prompt's tokens
+        tokens = [_singular(token) for token in tokenize(prompt)]
+        i = 0
+        while i < len(tokens):
+            for size in range(min(self.max_phrase_words, len(tokens) - i), 0, -1):
+                phrase = " ".join(tokens[i:i + size])
+                matched = False
+                for vocab, target in (
+                    (self.brands, constraints.brands),
+                    (self.colors, constraints.colors),
+                    (self.categories, constraints.categories),
+                ):
+                    if phrase in vocab:
+                        target.update(vocab[phrase])
+                        matched = True
+                if matched:
+                    i += size
+                    break
+            else:
+                i += 1
+        return constraints
+
+    def where_filter(self, constraints):
+        clauses = []
+        if constraints.colors:
+            clauses.append({"color": {"$in": sorted(constraints.colors)}})
+        if constraints.exclude_colors:
+            clauses.append({"color": {"$nin": sorted(constraints.exclude_colors)}})
+        if constraints.brands:
+            clauses.append({"brand": {"$in": sorted(constraints.brands)}})
+        if constraints.categories and self.category_field:
+            clauses.append({self.category_field: {"$in": sorted(constraints.categories)}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+# In-process Okapi BM25 over the format_product text of every product
+class BM25Index:
+    def __init__(self, ids, documents, k1=1.5, b=0.75):
+        self.ids = list(ids)
+        self.k1 = k1
+        self.b = b
+        self.lengths = []
+        self.postings = {}
+        for row, document in enumerate(documents):
+            counts = Counter(tokenize(document or ""))
+            self.lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                self.postings.setdefault(term, []).append((row, count))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        total = len(self.ids)
+        self.idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, limit, allowed_rows=None):
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for row, count in self.postings[term]:
+                if allowed_rows is not None and row not in allowed_rows:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[row] / (self.average_length or 1.0))
+                scores[row] = scores.get(row, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [self.ids[row] for row, _ in ranked]
+
+
+# Constraint-filtered vector search fused with BM25 by reciprocal rank fusion.
+# Rows per colour/brand/category value, per name-matched garment term and by
+# price are indexed once at build time, so a request's allowed rows are set
+# unions and intersections instead of a scan over the catalogue.
+class HybridRetriever:
+    def __init__(self, table, vector_k=20, rrf_k=60):
+        self.table = table
+        self.vector_k = vector_k
+        self.rrf_k = rrf_k
+        self.parser = ConstraintParser(table)
+        self.bm25 = BM25Index(table.ids, table.documents)
+        self.prices = [
+            parse_price(table.value(row, "price") or table.value(row, "Price")) for row in range(len(table))
+        ]
+        self.all_rows = frozenset(range(len(table)))
+        self.rows_by_value = {
+            field: self._rows_by_value(field)
+            for field in ("color", "brand", self.parser.category_field)
+            if field is not None
+        }
+        self._name_phrases = None
+        self.rows_by_term = {}
+        if not self.parser.category_field:
+            self._name_phrases = [
+                f' {self.parser._phrase(str(table.value(row, "name") or table.value(row, "Title", "")))} '
+                for row in range(len(table))
+            ]
+            for terms in self.parser.categories.values():
+                for term in terms:
+                    self._term_rows(term)
+        self.price_rows = sorted((price, row) for row, price in enumerate(self.prices) if price is not None)
+        self.price_values = [price for price, _ in self.price_rows]
+        logger.info(
+            f"Hybrid retriever ready: {len(table)} products, {len(self.parser.colors)} colours, "
+            f"{len(self.parser.brands)} brands, {len(self.parser.categories)} categories"
+        )
+
+    def _rows_by_value(self, field):
+        rows = {}
+        for row, value in enumerate(self.table.columns.get(field) or ()):
+            if value is not None:
+                rows.setdefault(value, set()).add(row)
+        return rows
+
+    # Rows whose name contains a garment term as whole words ("coat" is not in
+    # "petticoat"), for catalogues without a category field
+    def _term_rows(self, term):
+        rows = self.rows_by_term.get(term)
+        if rows is None:
+            phrase = f" {self.parser._phrase(term)} "
+            rows = self.rows_by_term[term] = {
+                row for row, name in enumerate(self._name_phrases) if phrase in name
+            }
+        return rows
+
+    def _value_rows(self, field, values):
+        index = self.rows_by_value.get(field, {})
+        return set().union(*(index.get(value, ()) for value in values))
+
+    def _price_rows(self, min_price, max_price):
+        start = 0 if min_price is None else bisect.bisect_left(self.price_values, min_price)
+        end = len(self.price_rows) if max_price is None else bisect.bisect_right(self.price_values, max_price)
+        return {row for _, row in self.price_rows[start:end]}
+
+    def allowed_rows(self, constraints):
+        candidates = []
+        if constraints.colors:
+            candidates.append(self._value_rows("color", constraints.colors))
+        if constraints.brands:
+            candidates.append(self._value_rows("brand", constraints.brands))
+        if constraints.categories:
+            if self.parser.category_field:
+                candidates.append(self._value_rows(self.parser.category_field, constraints.categories))
+            else:
+                candidates.append(set().union(*(self._term_rows(term) for term in constraints.categories)))
+        if constraints.min_price is not None or constraints.max_price is not None:
+            candidates.append(self._price_rows(constraints.min_price, constraints.max_price))
+        if candidates:
+            candidates.sort(key=len)
+            allowed = candidates[0].intersection(*candidates[1:])
+        else:
+            allowed = set(self.all_rows)
+        if constraints.exclude_colors:
+            allowed -= self._value_rows("color", constraints.exclude_colors)
+        return allowed
+
+    # Constraints, allowed rows and Chroma `where` filter for a prompt. Follow-ups
+    # ("cheaper", "in blue") re-plan the previous prompt with overrides.
+    def plan(self, prompt, colors=None, exclude_colors=None, max_price=None):
+        constraints = self.parser.parse(prompt)
+        if colors:
+            constraints.colors = set(colors)
+        if exclude_colors:
+            constraints.colors -= set(exclude_colors)
+            constraints.exclude_colors = set(exclude_colors)
+        if max_price is not None:
+            constraints.max_price = min(max_price, constraints.max_price or max_price)
+            if constraints.min_price is not None and constraints.min_price > constraints.max_price:
+                constraints.min_price = None
+        allowed = self.allowed_rows(constraints) if constraints else None
+        if allowed is not None and not allowed:
+            logger.info(f"No products satisfy {constraints}; relaxing constraints")
+            constraints, allowed = None, None
+        where = self.parser.where_filter(constraints) if constraints else None
+        return constraints, allowed, where
+
+    # Fuse the vector hits for a planned prompt with BM25; `depth` (default
+    # vector_k) is how many BM25 hits take part
+    def fuse(self, prompt, vector_ids, constraints, allowed, n_results, depth=None):
+        if allowed is not None:
+            vector_ids = [pid for pid in vector_ids if self.table.row(pid) in allowed]
+
+        bm25_ids = self.bm25.search(prompt, depth or self.vector_k, allowed_rows=allowed)
+
+        fused = {}
+        for ranking in (vector_ids, bm25_ids):
+            for rank, pid in enumerate(ranking):
+                fused[pid] = fused.get(pid, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        ranked = [pid for pid in sorted(fused, key=fused.get, reverse=True) if pid in self.table][:n_results]
+        if constraints:
+            logger.info(f"Applied {constraints}")
+        return ranked, [self.table.get(pid) for pid in ranked]
+
+    # Blocking: call from the vector-store executor
+    def retrieve(self, collection, query_embedding, prompt, n_results):
+        constraints, allowed, where = self.plan(prompt)
+        query = {"query_embeddings": [query_embedding], "n_results": self.vector_k}
+        if where:
+            query["where"] = where
+        vector_ids = collection.query(**query)["ids"][0]
+        return self.fuse(prompt, vector_ids, constraints, allowed, n_results)
@@ -0,0 +1,116 @@
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import tempfile
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Multi-process serving for main:app.
+#
+#   python serve.py --workers 4 --port 8000
+#
+# With gunicorn installed, the app module (chromadb, openai, tiktoken, ...) is
+# imported once in the master and forked into uvicorn workers, so workers start
+# warm and share those pages copy-on-write. Each worker then runs the app's
+# startup (Chroma connection, product table, vector index, warm-up queries)
+# before it accepts traffic; /ready reports when a worker is serving.
+# Collection settings (HNSW_SEARCH_EF) are applied once, before any worker
+# starts, in a separate process so no Chroma client is inherited across fork.
+#
+# Without gunicorn this falls back to uvicorn's own process manager, where each
+# worker imports the app itself.
+#
+# With more than one worker the defaults change so workers share state:
+#   QUANTIZED_INDEX=1      vectors served from the int8 index, memory-mapped
+#                          read-only and shared through the page cache, instead
+#                          of every worker loading Chroma's HNSW segment
+#   SESSION_STORE_URL      sqlite:///sessions.db, so a conversation can move
+#                          between workers
+#   EMBEDDING_CACHE_PATH   embedding_cache.db, one cache for all workers (each
+#                          keeps its hot entries in memory and reads misses
+#                          through from the file)
+#   METRICS_DIR            a fresh temporary directory where workers share
+#                          their metrics, so /metrics covers every worker
+# Explicit environment settings always win.
+
+
+def shared_defaults(workers):
+    if workers <= 1:
+        return
+    os.environ.setdefault("QUANTIZED_INDEX", "1")
+    os.environ.setdefault("SESSION_STORE_URL", "sqlite:///sessions.db")
+    os.environ.setdefault("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+    if not os.getenv("METRICS_DIR"):
+        os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="chatbot-metrics-")
+    # Counters from a previous run must not be added to this one
+    for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "worker-*.json")):
+        os.remove(path)
+
+
+def _apply_collection_settings():
+    from main import apply_collection_settings
+
+    apply_collection_settings()
+
+
+def apply_collection_settings():
+    process = multiprocessing.get_context("spawn").Process(target=_apply_collection_settings)
+    process.start()
+    process.join()
+    if process.exitcode == 0:
+        os.environ["HNSW_SEARCH_EF_APPLIED"] = "1"
+    else:
+        logger.warning("Could not apply collection settings up front; each worker will apply them")
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            self.cfg.set("preload_app", True)
+            self.cfg.set("timeout", args.timeout)
+            self.cfg.set("graceful_timeout", args.timeout)
+
+        def load(self):
+            from main import app
+
+            return app
+
+    Application().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the chatbot API with several worker processes.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+    parser.add_argument("--timeout", type=int, default=120, help="worker timeout in seconds (gunicorn)")
+    args = parser.parse_args()
+
+    shared_defaults(args.workers)
+    if args.workers > 1:
+        apply_collection_settings()
+    try:
+        if os.name == "nt":
+            raise ImportError("gunicorn does not run on Windows")
+        import gunicorn  # noqa: F401
+    except ImportError:
+        import uvicorn
+
+        logger.info(f"gunicorn unavailable; starting {args.workers} uvicorn workers")
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+        return
+    logger.info(f"Starting {args.workers} gunicorn/uvicorn workers on {args.host}:{args.port}")
+    run_gunicorn(args)
+
+
+if __name__ == "__main__":
+    main()
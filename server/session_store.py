@@ -0,0 +1,149 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Server-side conversation state for one session_id
+class SessionState:
+    __slots__ = ("history", "query", "candidates", "shown", "last", "updated")
+
+    def __init__(self, history=None, query=None, candidates=None, shown=None, last=None, updated=None):
+        self.history = history or []        # trimmed chat history, oldest first
+        self.query = query                  # prompt the candidates were retrieved for
+        self.candidates = candidates or []  # ranked product IDs from the last retrieval
+        self.shown = shown or []            # product IDs already offered from those candidates
+        self.last = last or []              # product IDs offered in the latest turn
+        self.updated = updated or time.time()
+
+    def to_json(self):
+        return json.dumps({
+            "history": self.history,
+            "query": self.query,
+            "candidates": self.candidates,
+            "shown": self.shown,
+            "last": self.last,
+            "updated": self.updated,
+        })
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(**json.loads(text))
+
+
+# Default backend: bounded LRU in process memory. Sessions are kept serialised
+# like in the other backends, so get() hands out a copy and only put() commits.
+class InMemorySessionStore:
+    def __init__(self, max_sessions=10000, ttl=24 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            text = self._sessions.get(session_id)
+            if text is None:
+                return None
+            state = SessionState.from_json(text)
+            if time.time() - state.updated > self.ttl:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return state
+
+    def put(self, session_id, state):
+        state.updated = time.time()
+        with self._lock:
+            self._sessions[session_id] = state.to_json()
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def close(self):
+        pass
+
+
+# Survives restarts and can be shared by workers on one host
+class SQLiteSessionStore:
+    def __init__(self, path, ttl=24 * 3600):
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - ttl,))
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM sessions WHERE id = ? AND updated >= ?", (session_id, time.time() - self.ttl)
+            ).fetchone()
+        return SessionState.from_json(row[0]) if row else None
+
+    def put(self, session_id, state):
+        state.updated = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, state, updated) VALUES (?, ?, ?)",
+                (session_id, state.to_json(), state.updated),
+            )
+            self._db.commit()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Any Redis-protocol server (Redis, Valkey, a local stand-in); needs `pip install redis`
+class RedisSessionStore:
+    def __init__(self, url, ttl=24 * 3600, prefix="chat-session:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis session store requires `pip install redis`")
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, session_id):
+        value = self._client.get(self.prefix + session_id)
+        return SessionState.from_json(value) if value else None
+
+    def put(self, session_id, state):
+        state.updated = time.time()
+        self._client.set(self.prefix + session_id, state.to_json(), ex=int(self.ttl))
+
+    def delete(self, session_id):
+        self._client.delete(self.prefix + session_id)
+
+    def close(self):
+        self._client.close()
+
+
+# memory:// (default), sqlite:///path/to/sessions.db or redis://host:port/db
+def make_session_store(url=None, ttl=24 * 3600, max_sessions=10000):
+    url = url or "memory://"
+    if url.startswith("memory://"):
+        return InMemorySessionStore(max_sessions=max_sessions, ttl=ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):], ttl=ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionStore(url, ttl=ttl)
+    raise ValueError(f"Unsupported session store URL: {url}")
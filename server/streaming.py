@@ -0,0 +1,274 @@
+import re
+
+PRODUCT_ID_MARKER = "Product ID:"
+PRODUCT_ID_PATTERN = re.compile(r"\s*(\d{1,6})")
+COMPLETE_PRODUCT_ID_PATTERN = re.compile(r"\s*(\d{1,6})(?=\D)")
+
+
+def _marker_prefix_length(text):
+    # Length of the longest suffix of `text` that could be the start of the marker
+    for length in range(min(len(PRODUCT_ID_MARKER) - 1, len(text)), 0, -1):
+        if PRODUCT_ID_MARKER.startswith(text[-length:]):
+            return length
+    return 0
+
+
+# Incremental equivalent of stripping r'\n?\s*Product ID:.*' from a finished
+# response. Text chunks go in as the model streams them; cleaned text and each
+# product ID come out as soon as they are known to be complete.
+class ProductIdStreamFilter:
+    def __init__(self):
+        self._buffer = ""
+        self._in_marker = False
+        self._marker_text = ""
+        self._id_emitted = False
+
+    def _scan_id(self, ids, final=False):
+        if self._id_emitted:
+            return
+        pattern = PRODUCT_ID_PATTERN if final else COMPLETE_PRODUCT_ID_PATTERN
+        match = pattern.match(self._marker_text)
+        if match:
+            ids.append(match.group(1))
+            self._id_emitted = True
+
+    def _end_marker(self, ids):
+        self._scan_id(ids, final=True)
+        self._in_marker = False
+        self._marker_text = ""
+        self._id_emitted = False
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        text, ids = [], []
+
+        while self._buffer:
+            if self._in_marker:
+                # Everything up to the end of the line belongs to the marker
+                newline = self._buffer.find("\n")
+                if newline == -1:
+                    self._marker_text += self._buffer
+                    self._buffer = ""
+                    self._scan_id(ids)
+                    break
+                self._marker_text += self._buffer[:newline]
+                self._buffer = self._buffer[newline:]
+                self._end_marker(ids)
+                continue
+
+            index = self._buffer.find(PRODUCT_ID_MARKER)
+            if index != -1:
+                text.append(self._buffer[:index].rstrip())
+                self._buffer = self._buffer[index + len(PRODUCT_ID_MARKER):]
+                self._in_marker = True
+                continue
+
+            # Hold back a possible partial marker and the whitespace before it,
+            # since both are dropped if the marker completes.
+            hold = _marker_prefix_length(self._buffer)
+            safe = self._buffer[:len(self._buffer) - hold]
+            emitted = safe.rstrip()
+            text.append(emitted)
+            self._buffer = self._buffer[len(emitted):]
+            break
+
+        return "".join(text), ids
+
+    def close(self):
+        ids = []
+        if self._in_marker:
+            self._end_marker(ids)
+            text = ""
+        else:
+            text = self._buffer
+        self._buffer = ""
+        return text, ids
+
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+# Incremental parser for the structured reply {"message": ..., "product_ids": [...]},
+# fed the JSON as the model streams it (tool-call arguments or JSON content).
+# The message text comes out as it is decoded and each product ID as soon as it
+# is complete; other keys are skipped. A truncated reply (max_tokens) still
+# yields everything before the cut.
+class StructuredResponseParser:
+    def __init__(self):
+        self._state = "start"
+        self._key = ""
+        self._escape = None   # pending escape sequence inside a string, e.g. "\\u00"
+        self._high = None     # high surrogate waiting for its pair
+        self._item = ""       # product ID being read
+        self._depth = 0       # nesting of a skipped value
+        self._skip_string = False
+        self.failed = False
+
+    @property
+    def complete(self):
+        return self._state == "done"
+
+    # Decode one character of a string body; returns the text it produces
+    def _string_char(self, char):
+        if self._escape is not None:
+            self._escape += char
+            if self._escape[1] != "u":
+                decoded = _ESCAPES.get(self._escape[1], self._escape[1])
+            elif len(self._escape) < 6:
+                return ""
+            else:
+                code = int(self._escape[2:], 16) if all(c in "0123456789abcdefABCDEF" for c in self._escape[2:]) else 0xFFFD
+                self._escape = None
+                if 0xD800 <= code < 0xDC00:
+                    self._high = code
+                    return ""
+                if 0xDC00 <= code < 0xE000 and self._high is not None:
+                    code = 0x10000 + ((self._high - 0xD800) << 10) + (code - 0xDC00)
+                self._high = None
+                return chr(code)
+            self._escape = None
+            return decoded
+        if char == "\\":
+            self._escape = char
+            return ""
+        return char
+
+    def feed(self, chunk):
+        text, ids = [], []
+        for char in chunk:
+            self._step(char, text, ids)
+        return "".join(text), ids
+
+    def _step(self, char, text, ids):
+        state = self._state
+        if state in ("start", "key_or_end", "colon", "value", "ids", "done") and char.isspace():
+            return
+        if state == "start":
+            if char == "{":
+                self._state = "key_or_end"
+            else:
+                self._state, self.failed = "done", True
+        elif state == "key_or_end":
+            if char == '"':
+                self._state, self._key = "key", ""
+            elif char == "}":
+                self._state = "done"
+        elif state == "key":
+            if char == '"' and self._escape is None:
+                self._state = "colon"
+            else:
+                self._key += self._string_char(char)
+        elif state == "colon":
+            if char == ":":
+                self._state = "value"
+        elif state == "value":
+            if self._key == "message" and char == '"':
+                self._state = "message"
+            elif self._key == "product_ids" and char == "[":
+                self._state = "ids"
+            else:
+                self._state, self._depth, self._skip_string = "skip", 0, False
+                self._step(char, text, ids)
+        elif state == "message":
+            if char == '"' and self._escape is None:
+                self._state = "key_or_end"
+            else:
+                text.append(self._string_char(char))
+        elif state == "ids":
+            if char == "]":
+                self._state = "key_or_end"
+            elif char == '"':
+                self._state, self._item = "id_string", ""
+            elif char.isdigit():
+                self._state, self._item = "id_number", char
+        elif state == "id_string":
+            if char == '"' and self._escape is None:
+                self._state = "ids"
+                if self._item.strip():
+                    ids.append(self._item.strip())
+            else:
+                self._item += self._string_char(char)
+        elif state == "id_number":
+            if char.isdigit():
+                self._item += char
+            else:
+                self._state = "ids"
+                ids.append(self._item)
+                self._step(char, text, ids)
+        elif state == "skip":
+            if self._skip_string:
+                if char == '"' and self._escape is None:
+                    self._skip_string = False
+                else:
+                    self._string_char(char)
+            elif char == '"':
+                self._skip_string = True
+            elif char in "[{":
+                self._depth += 1
+            elif char in "]}" and self._depth > 0:
+                self._depth -= 1
+            elif char in ",}" and self._depth == 0:
+                self._state = "key_or_end"
+                self._step(char, text, ids)
+
+    # An ID cut off mid-number may be a prefix of another candidate's, so it is dropped
+    def close(self):
+        self._state = "done"
+        return "", []
+
+
+# Picks the parser from the first non-blank character: structured JSON or
+# plain text with "Product ID:" lines (older prompts, or a model that ignored
+# the requested format)
+class ResponseStreamParser:
+    def __init__(self):
+        self._parser = None
+        self._pending = ""
+
+    @property
+    def structured(self):
+        return isinstance(self._parser, StructuredResponseParser)
+
+    def feed(self, chunk):
+        if self._parser is None:
+            self._pending += chunk
+            if not self._pending.strip():
+                return "", []
+            chunk, self._pending = self._pending, ""
+            self._parser = StructuredResponseParser() if chunk.lstrip().startswith("{") else ProductIdStreamFilter()
+        return self._parser.feed(chunk)
+
+    def close(self):
+        if self._parser is None:
+            return "", []
+        return self._parser.close()
+
+
+# Message and product IDs from a complete structured reply
+def parse_structured(raw):
+    parser = StructuredResponseParser()
+    text, ids = parser.feed(raw)
+    if not parser.complete:
+        parser.close()
+    return text.strip(), ids
+
+
+def clean_response(response_text):
+    # Remove product IDs from GPT response before sending to frontend
+    return re.sub(r'\n?\s*Product ID:.*', '', response_text).strip()
+
+
+# Raw reply text: the forced function call's arguments, or the message content
+def completion_text(message):
+    if message.tool_calls:
+        return message.tool_calls[0].function.arguments or ""
+    return message.content or ""
+
+
+# Message and product IDs from a complete reply: structured JSON, or
+# "Product ID: 123" lines when the model answered in plain text
+def parse_reply(raw):
+    if raw.lstrip().startswith("{"):
+        message, product_ids = parse_structured(raw)
+        return message, product_ids, True
+    return clean_response(raw), re.findall(r'Product ID:\s*(\d{1,6})', raw), False
@@ -0,0 +1,103 @@
+import asyncio
+import gc
+
+from batching import MicroBatcher
+
+
+def test_concurrent_items_share_a_batch():
+    calls = []
+
+    async def handler(key, items):
+        calls.append((key, list(items)))
+        return [item * 2 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(handler, max_batch_size=8, max_wait=0.01)
+        results = await asyncio.gather(*(batcher.submit(i, key="k") for i in range(5)))
+        await batcher.close()
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(main())
+    assert results == [0, 2, 4, 6, 8]
+    assert calls == [("k", [0, 1, 2, 3, 4])]
+    assert stats == {"batches": 1, "items": 5, "mean_batch_size": 5.0}
+
+
+def test_full_batch_flushes_before_the_window_closes():
+    sizes = []
+
+    async def handler(key, items):
+        sizes.append(len(items))
+        return items
+
+    async def main():
+        batcher = MicroBatcher(handler, max_batch_size=2, max_wait=60)
+        await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(4))), timeout=1)
+
+    asyncio.run(main())
+    assert sizes == [2, 2]
+
+
+def test_handler_errors_reach_every_waiter():
+    async def handler(key, items):
+        return items[:1]
+
+    async def main():
+        batcher = MicroBatcher(handler, max_wait=0.001, name="embed")
+        return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(e, RuntimeError) and "embed handler returned 1 results" in str(e) for e in errors)
+
+
+def test_batches_in_flight_are_kept_and_awaited_on_close():
+    release = None
+    finished = []
+
+    async def handler(key, items):
+        await release.wait()
+        finished.append(items)
+        return items
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        batcher = MicroBatcher(handler, max_wait=60)
+        waiter = asyncio.ensure_future(batcher.submit("a"))
+        await asyncio.sleep(0)
+        closing = asyncio.ensure_future(batcher.close())
+        await asyncio.sleep(0)
+        assert len(batcher._tasks) == 1
+        gc.collect()
+        release.set()
+        await closing
+        assert batcher._tasks == set()
+        return await waiter
+
+    assert asyncio.run(main()) == "a"
+    assert finished == [["a"]]
+
+
+def test_close_without_pending_work():
+    async def handler(key, items):
+        return items
+
+    asyncio.run(MicroBatcher(handler).close())
+
+
+def test_cancelled_waiter_does_not_break_the_batch():
+    async def handler(key, items):
+        await asyncio.sleep(0.01)
+        return items
+
+    async def main():
+        batcher = MicroBatcher(handler, max_wait=0.001)
+        cancelled = asyncio.ensure_future(batcher.submit(1))
+        kept = asyncio.ensure_future(batcher.submit(2))
+        await asyncio.sleep(0.005)
+        cancelled.cancel()
+        result = await kept
+        await batcher.close()
+        return result
+
+    assert asyncio.run(main()) == 2
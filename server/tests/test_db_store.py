@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+pytest.importorskip("dotenv")
+pytest.importorskip("openai")
+
+from db_store import DatasetError, IngestState, ingest, iter_products, product_key, prune
+from embeddings import HashingEmbeddingFunction
+
+PRODUCTS = [
+    {"id": 1, "name": "Red Silk Saree", "brand": "Biba", "color": "Red", "price": "1999"},
+    {"id": 2, "name": "Blue Anarkali Kurti", "brand": "Libas", "color": "Blue", "price": "899"},
+    {"id": 3, "name": "Black Wrap Dress", "brand": "Only", "color": "Black", "price": "1499"},
+]
+
+
+def write(tmp_path, data):
+    path = tmp_path / "Fashion_Dataset.json"
+    path.write_text(data if isinstance(data, str) else json.dumps(data, indent=2), encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("data", [PRODUCTS, {"meta": {"rows": 3}, "Sheet1": PRODUCTS}])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_iter_products_streams_both_layouts(tmp_path, data, chunk_size):
+    assert list(iter_products(write(tmp_path, data), chunk_size=chunk_size)) == PRODUCTS
+
+
+@pytest.mark.parametrize("text", ["", '[{"id": 1},', '[{"id": 1} {"id":', '{"Sheet1": 3}'])
+def test_iter_products_rejects_broken_files(tmp_path, text):
+    with pytest.raises(DatasetError):
+        list(iter_products(write(tmp_path, text), chunk_size=4))
+
+
+@pytest.fixture
+def store(tmp_path):
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    collection = client.create_collection("Clothes_products", embedding_function=None)
+    state = IngestState(str(tmp_path / "ingest_state.db"), "Clothes_products")
+    yield collection, state
+    state.close()
+
+
+def run(collection, state, products, full=False):
+    known = set()
+    if full:
+        known = state.keys()
+        state.reset_hashes()
+    seen, added, skipped = ingest(products, collection, HashingEmbeddingFunction(dim=64), state, batch_size=2, workers=2)
+    return added, skipped, prune(collection, state, seen, known)
+
+
+def test_incremental_runs_only_embed_changes(store):
+    collection, state = store
+    assert run(collection, state, PRODUCTS) == (3, 0, 0)
+    assert collection.count() == 3
+
+    changed = [dict(PRODUCTS[0], price="1799")] + PRODUCTS[1:]
+    assert run(collection, state, changed) == (1, 2, 0)
+    seq_id = str(state.seq_id(product_key(PRODUCTS[0])))
+    assert collection.get(ids=[seq_id])["metadatas"][0]["price"] == "1799"
+
+
+def test_removed_products_are_pruned(store):
+    collection, state = store
+    run(collection, state, PRODUCTS)
+    assert run(collection, state, PRODUCTS[:2]) == (0, 2, 1)
+    assert collection.count() == 2
+    assert product_key(PRODUCTS[2]) not in state.keys()
+
+
+def test_full_run_reembeds_everything_and_still_prunes(store):
+    collection, state = store
+    run(collection, state, PRODUCTS)
+    assert run(collection, state, PRODUCTS[1:], full=True) == (2, 0, 1)
+    assert collection.count() == 2
+    assert state.keys() == {product_key(product) for product in PRODUCTS[1:]}
+
+
+def test_product_ids_stay_stable_across_removal(store):
+    collection, state = store
+    run(collection, state, PRODUCTS)
+    ids = {product_key(product): state.seq_id(product_key(product)) for product in PRODUCTS}
+    run(collection, state, PRODUCTS[1:])
+    run(collection, state, PRODUCTS)
+    assert {key: state.seq_id(key) for key in ids} == ids
+    assert sorted(collection.get()["ids"]) == sorted(str(seq_id) for seq_id in ids.values())
@@ -0,0 +1,76 @@
+import pytest
+
+import embedding_cache
+from embedding_cache import CachedEmbeddingFunction, EmbeddingCache, normalize_prompt
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(embedding_cache.time, "time", clock)
+    return clock
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  Red   Sarees?! ") == "red sarees"
+
+
+def test_embedding_cache_evicts_least_recently_used():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    assert cache.get("a") == [1.0]
+    cache.put("c", [3.0])
+    assert cache.get("b") is None
+    assert cache.get("a") == [1.0] and cache.get("c") == [3.0]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_embedding_cache_expires_entries(clock):
+    cache = EmbeddingCache(ttl=60)
+    cache.put("a", [1.0])
+    clock.now += 61
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_embedding_cache_persists_and_shares_the_file(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    first = EmbeddingCache(persist_path=path)
+    second = EmbeddingCache(persist_path=path)
+    first.put("a", [0.5, 0.25])
+    # A second process sees entries written after it loaded the file
+    assert second.get("a") == [0.5, 0.25]
+    first.close()
+    second.close()
+    reopened = EmbeddingCache(persist_path=path)
+    assert reopened.stats()["size"] == 1
+    reopened.close()
+
+
+def test_cached_embedding_function_embeds_each_miss_once():
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    function = CachedEmbeddingFunction(embed, EmbeddingCache(), namespace="test:model")
+    assert function(["Red saree", "red saree!", "blue kurta"]) == [[9.0], [9.0], [10.0]]
+    assert function(["RED SAREE"]) == [[9.0]]
+    assert calls == [["Red saree", "blue kurta"]]
+
+
+def test_cached_embedding_function_namespaces_keys():
+    cache = EmbeddingCache()
+    CachedEmbeddingFunction(lambda texts: [[1.0] for _ in texts], cache, namespace="a")(["x"])
+    other = CachedEmbeddingFunction(lambda texts: [[2.0] for _ in texts], cache, namespace="b")
+    assert other(["x"]) == [[2.0]]
@@ -0,0 +1,61 @@
+import pytest
+
+from embeddings import HashingEmbeddingFunction
+from intents import CHEAPER, MORE, OTHER_COLOR, IntentClassifier
+from product_table import ProductTable
+from retrieval import ConstraintParser
+
+PRODUCTS = [
+    {"name": "Red Banarasi Silk Saree", "color": "Red", "brand": "Biba", "category": "Saree"},
+    {"name": "Blue Anarkali Kurti", "color": "Blue", "brand": "Libas", "category": "Kurti"},
+    {"name": "Black Wrap Dress", "color": "Black", "brand": "Only", "category": "Dress"},
+]
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    table = ProductTable([str(i) for i in range(len(PRODUCTS))], None, PRODUCTS)
+    return IntentClassifier(parser=ConstraintParser(table))
+
+
+@pytest.mark.parametrize("prompt, kind, colors, max_price", [
+    ("show me more", MORE, set(), None),
+    ("Can you show me some more options please?", MORE, set(), None),
+    ("next", MORE, set(), None),
+    ("something cheaper", CHEAPER, set(), None),
+    ("these are too expensive for me", CHEAPER, set(), None),
+    ("on a tight budget", CHEAPER, set(), None),
+    ("under 1000", CHEAPER, set(), 1000),
+    ("in blue", OTHER_COLOR, {"Blue"}, None),
+    ("same one in red please", OTHER_COLOR, {"Red"}, None),
+    ("red", OTHER_COLOR, {"Red"}, None),
+    ("other colours please", OTHER_COLOR, set(), None),
+    ("do you have this in a different colour", OTHER_COLOR, set(), None),
+])
+def test_follow_ups(classifier, prompt, kind, colors, max_price):
+    intent = classifier.classify(prompt)
+    assert intent is not None, prompt
+    assert (intent.kind, intent.colors, intent.max_price) == (kind, colors, max_price)
+
+
+@pytest.mark.parametrize("prompt", [
+    "I want something in red for my sisters wedding",
+    "budget sarees for a wedding",
+    "budget options for a wedding party",
+    "something for a party under 2000 please",
+    "blue kurtis",
+    "red saree",
+    "show me biba dresses",
+    "show me more sarees like these",
+    "what is your return policy",
+    "",
+])
+def test_new_requests_go_to_the_llm(classifier, prompt):
+    assert classifier.classify(prompt) is None
+
+
+def test_prototype_model_catches_rephrased_follow_ups():
+    classifier = IntentClassifier(embedding_function=HashingEmbeddingFunction())
+    assert classifier.classify("got anything else?").kind == MORE
+    assert classifier.classify("anything more affordable").kind == CHEAPER
+    assert classifier.classify("what else goes well with a beach holiday outfit") is None
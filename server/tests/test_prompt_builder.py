@@ -0,0 +1,118 @@
+import importlib
+
+import prompt_builder
+from prompt_builder import CANDIDATES_HEADER, MESSAGE_OVERHEAD_TOKENS, PromptBuilder
+
+
+def turns(count, words=5):
+    history = []
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append({"role": role, "content": f"message {i} " + " ".join(f"w{i}x{j}" for j in range(words))})
+    return history
+
+
+def build(builder, history, prompt="blue kurtis", ids=("1", "2"), names=("Blue Kurti", "Navy Kurti")):
+    return builder.build(history, prompt, list(ids), list(names))
+
+
+def test_everything_fits_within_a_large_budget():
+    builder = PromptBuilder(max_prompt_tokens=100000, system_prompt="Be helpful.\n")
+    history = turns(4)
+    messages, stats = build(builder, history)
+    assert messages[0]["role"] == "system"
+    assert messages[0]["content"] == "Be helpful.\n" + CANDIDATES_HEADER + "1. Blue Kurti\n2. Navy Kurti\n"
+    assert messages[1:-1] == history
+    assert messages[-1] == {"role": "user", "content": "blue kurtis"}
+    assert stats["history_messages"] == 4
+    assert stats["dropped_messages"] == stats["truncated_messages"] == 0
+    assert stats["total_tokens"] == (
+        stats["system_tokens"] + stats["candidate_tokens"] + MESSAGE_OVERHEAD_TOKENS
+        + stats["history_tokens"] + stats["prompt_tokens"]
+    )
+
+
+def test_history_is_capped_at_max_history_messages():
+    builder = PromptBuilder(max_prompt_tokens=100000, max_history_messages=3, system_prompt="S")
+    history = turns(6)
+    messages, stats = build(builder, history)
+    assert messages[1:-1] == history[-3:]
+    assert stats["dropped_messages"] == 3
+
+
+def test_older_messages_are_shortened():
+    builder = PromptBuilder(
+        max_prompt_tokens=100000, keep_full_messages=2, old_message_tokens=4, system_prompt="S"
+    )
+    history = turns(4, words=20)
+    messages, stats = build(builder, history)
+    kept = messages[1:-1]
+    assert kept[2:] == history[2:]
+    for original, shortened in zip(history[:2], kept[:2]):
+        assert shortened["content"].endswith(" …")
+        assert original["content"].startswith(shortened["content"][:-2])
+        assert builder.count(shortened["content"][:-2]) == 4
+    assert stats["truncated_messages"] == 2
+
+
+def test_budget_keeps_the_newest_turns():
+    builder = PromptBuilder(max_prompt_tokens=100000, keep_full_messages=10, system_prompt="S")
+    history = turns(10, words=30)
+    _, unlimited = build(builder, history)
+    per_message = unlimited["history_tokens"] // 10
+    fixed = unlimited["total_tokens"] - unlimited["history_tokens"]
+
+    builder.max_prompt_tokens = fixed + 3 * per_message
+    messages, stats = build(builder, history)
+    kept = messages[1:-1]
+    assert kept == history[-3:]
+    assert stats["dropped_messages"] == 7
+    assert stats["total_tokens"] <= builder.max_prompt_tokens
+
+
+def test_message_crossing_the_budget_keeps_its_start():
+    builder = PromptBuilder(max_prompt_tokens=100000, keep_full_messages=10, old_message_tokens=10, system_prompt="S")
+    history = turns(4, words=30)
+    _, unlimited = build(builder, history)
+    per_message = unlimited["history_tokens"] // 4
+    fixed = unlimited["total_tokens"] - unlimited["history_tokens"]
+
+    builder.max_prompt_tokens = fixed + 2 * per_message + per_message // 2
+    messages, stats = build(builder, history)
+    kept = messages[1:-1]
+    assert kept[1:] == history[-2:]
+    assert kept[0]["content"].endswith(" …")
+    assert history[-3]["content"].startswith(kept[0]["content"][:-2])
+    assert stats["truncated_messages"] == 1
+    assert stats["total_tokens"] <= builder.max_prompt_tokens
+
+
+def test_prompt_is_kept_when_nothing_else_fits():
+    builder = PromptBuilder(max_prompt_tokens=10)
+    messages, stats = build(builder, turns(4), prompt="show me something for a wedding")
+    assert messages[1:] == [{"role": "user", "content": "show me something for a wedding"}]
+    assert stats["history_messages"] == 0
+    assert stats["dropped_messages"] == 4
+
+
+def test_candidate_names_are_collapsed_and_clipped():
+    builder = PromptBuilder(max_name_chars=10, system_prompt="S")
+    text = builder.encode_candidates(["7", "8"], ["Red   Silk\nSaree with zari border", None])
+    assert text == CANDIDATES_HEADER + "7. Red Silk S…\n8. \n"
+
+
+def test_record_accumulates_totals():
+    builder = PromptBuilder(max_prompt_tokens=100000, max_history_messages=1, system_prompt="S")
+    for _ in range(2):
+        builder.record(build(builder, turns(3))[1])
+    assert builder.totals["requests"] == 2
+    assert builder.totals["dropped_messages"] == 4
+
+
+def test_existing_tiktoken_cache_dir_is_kept(monkeypatch, tmp_path):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    importlib.reload(prompt_builder)
+    assert prompt_builder.os.environ["TIKTOKEN_CACHE_DIR"] == str(tmp_path)
+    monkeypatch.delenv("TIKTOKEN_CACHE_DIR")
+    importlib.reload(prompt_builder)
+    assert prompt_builder.os.environ["TIKTOKEN_CACHE_DIR"] == prompt_builder._VENDORED_ENCODINGS
@@ -0,0 +1,56 @@
+import response_cache
+from response_cache import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+HISTORY = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "Hello!"}]
+
+
+def test_response_cache_exact_hit_after_normalisation():
+    cache = ResponseCache()
+    cache.put(["2", "1"], HISTORY, "Red sarees?", "answer", [{"id": "1"}])
+    entry = cache.get(["1", "2"], HISTORY, "  red sarees ")
+    assert entry.response == "answer" and entry.products == [{"id": "1"}]
+    assert cache.stats()["hits"] == 1
+
+
+def test_response_cache_is_scoped_by_products_and_history():
+    cache = ResponseCache()
+    cache.put(["1"], HISTORY, "red sarees", "answer", [])
+    assert cache.get(["2"], HISTORY, "red sarees") is None
+    assert cache.get(["1"], HISTORY + [{"role": "user", "content": "more"}], "red sarees") is None
+
+
+def test_response_cache_similar_prompts():
+    cache = ResponseCache(similarity_threshold=0.95)
+    cache.put(["1"], [], "red sarees", "answer", [], embedding=[1.0, 0.0])
+    assert cache.get(["1"], [], "crimson sarees", embedding=[0.99, 0.05]).response == "answer"
+    assert cache.get(["1"], [], "blue kurtas", embedding=[0.0, 1.0]) is None
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_response_cache_expiry_eviction_and_top_entries(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.put(["1"], [], "a", "A", [])
+    cache.put(["1"], [], "b", "B", [])
+    cache.get(["1"], [], "b")
+    cache.get(["1"], [], "b")
+    cache.get(["1"], [], "a")
+    top = cache.top_entries(limit=1)
+    assert [(entry["prompt"], entry["hits"]) for entry in top] == [("b", 2)]
+    cache.put(["1"], [], "c", "C", [])
+    assert cache.stats()["evictions"] == 1
+    assert cache.get(["1"], [], "b") is None
+    clock.now += 61
+    assert cache.get(["1"], [], "a") is None
+    cache.clear()
+    assert cache.stats()["size"] == 0
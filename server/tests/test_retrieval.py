@@ -0,0 +1,117 @@
+import pytest
+
+from product_table import ProductTable
+from retrieval import ConstraintParser, HybridRetriever, parse_price
+
+# No category field, so garment words are matched against product names
+PRODUCTS = [
+    {"name": "Red Cotton Petticoat", "color": "Red", "brand": "Biba", "price": "₹499"},
+    {"name": "Black Wool Coat", "color": "Black", "brand": "W", "price": "₹2,999"},
+    {"name": "Green Laptop Sleeve Topwear", "color": "Green", "brand": "W", "price": "₹799"},
+    {"name": "Blue Crop Top", "color": "Blue", "brand": "Only", "price": "₹599"},
+    {"name": "Grey Sweatshirt", "color": "Grey", "brand": "Only", "price": "₹1,299"},
+    {"name": "White Cotton Shirt", "color": "White", "brand": "Biba", "price": "₹899"},
+    {"name": "Navy Blue T-Shirt", "color": "Navy Blue", "brand": "Only", "price": "₹399"},
+    {"name": "Red Banarasi Silk Saree", "color": "Red", "brand": "Biba", "price": "₹4,500"},
+]
+
+
+def make_table(products):
+    return ProductTable(
+        [str(i) for i in range(1, len(products) + 1)],
+        [f"{product['name']} by {product['brand']} in {product['color']}" for product in products],
+        products,
+    )
+
+
+@pytest.fixture(scope="module")
+def retriever():
+    return HybridRetriever(make_table(PRODUCTS), vector_k=10)
+
+
+def names(retriever, rows):
+    return sorted(retriever.table.value(row, "name") for row in rows)
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("a coat", ["Black Wool Coat"]),
+    ("any top", ["Blue Crop Top"]),
+    ("shirt", ["Navy Blue T-Shirt", "White Cotton Shirt"]),
+    ("sweatshirts", ["Grey Sweatshirt"]),
+])
+def test_garment_terms_match_whole_words(retriever, prompt, expected):
+    constraints, allowed, _ = retriever.plan(prompt)
+    assert names(retriever, allowed) == expected
+
+
+def test_constraints_combine(retriever):
+    constraints, allowed, where = retriever.plan("red saree under 5000")
+    assert constraints.colors == {"Red"}
+    assert constraints.max_price == 5000
+    assert names(retriever, allowed) == ["Red Banarasi Silk Saree"]
+    assert where == {"color": {"$in": ["Red"]}}
+
+
+def test_follow_up_overrides(retriever):
+    _, allowed, _ = retriever.plan("shirt", exclude_colors={"White"})
+    assert names(retriever, allowed) == ["Navy Blue T-Shirt"]
+    _, allowed, _ = retriever.plan("shirt", max_price=500)
+    assert names(retriever, allowed) == ["Navy Blue T-Shirt"]
+
+
+def test_unsatisfiable_constraints_are_relaxed(retriever):
+    assert retriever.plan("saree under 100 rupees") == (None, None, None)
+
+
+@pytest.mark.parametrize("prompt, min_price, max_price", [
+    ("kurta between 500 and 1500", 500, 1500),
+    ("kurta 800-1,200", 800, 1200),
+    ("dress under ₹2000", None, 2000),
+    ("dress under rs 50", None, 50),
+    ("saree above 3000", 3000, None),
+    ("saree over 1000 and below 4000", 1000, 4000),
+    ("kids dress for 8 to 10 years", None, None),
+    ("frock for age 8 to 10", None, None),
+    ("jeans size 28-32 under 1500", None, 1500),
+    ("dress for girls above 5 years", None, None),
+    ("kurta under 40 inches", None, None),
+])
+def test_price_parsing(retriever, prompt, min_price, max_price):
+    constraints = retriever.parser.parse(prompt)
+    assert (constraints.min_price, constraints.max_price) == (min_price, max_price)
+
+
+def test_parse_price():
+    assert parse_price("₹2,999.50") == 2999.5
+    assert parse_price(1299) == 1299.0
+    assert parse_price("n/a") is None
+
+
+def test_stopwords_are_never_brands():
+    parser = ConstraintParser(make_table(PRODUCTS))
+    assert parser.parse("only show me shirts").brands == set()
+
+
+def test_fusion_sums_reciprocal_ranks(retriever):
+    bm25 = retriever.bm25.search("cotton", retriever.vector_k)
+    assert sorted(bm25) == ["1", "6"]
+    vector = ["3", "6", "1"]
+    ranked, metadatas = retriever.fuse("cotton", vector, None, None, 3)
+
+    def score(pid):
+        return sum(1.0 / (retriever.rrf_k + ranking.index(pid) + 1) for ranking in (vector, bm25) if pid in ranking)
+
+    # Found by both searches beats first place in only one
+    assert ranked == sorted(["1", "3", "6"], key=score, reverse=True)
+    assert ranked[-1] == "3"
+    assert [metadata["name"] for metadata in metadatas] == [
+        retriever.table.get(pid)["name"] for pid in ranked
+    ]
+
+
+def test_fusion_respects_allowed_rows_and_limit(retriever):
+    constraints, allowed, _ = retriever.plan("shirt")
+    ranked, _ = retriever.fuse("shirt", ["1", "7", "2", "6"], constraints, allowed, 10)
+    assert sorted(ranked) == ["6", "7"]
+    ranked, _ = retriever.fuse("shirt", ["1", "7", "2", "6"], constraints, allowed, 1)
+    assert len(ranked) == 1 and ranked[0] in {"6", "7"}
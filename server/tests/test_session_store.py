@@ -0,0 +1,92 @@
+import pytest
+
+import session_store
+from session_store import InMemorySessionStore, SessionState, SQLiteSessionStore, make_session_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = InMemorySessionStore(max_sessions=3, ttl=60)
+    else:
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=60)
+    yield store
+    store.close()
+
+
+def sample_state():
+    return SessionState(
+        history=[{"role": "user", "content": "red kurtis"}],
+        query="red kurtis",
+        candidates=["1", "2", "3"],
+        shown=["1"],
+        last=["1"],
+    )
+
+
+def test_round_trip(store):
+    store.put("s1", sample_state())
+    state = store.get("s1")
+    assert state.history == [{"role": "user", "content": "red kurtis"}]
+    assert (state.query, state.candidates, state.shown, state.last) == ("red kurtis", ["1", "2", "3"], ["1"], ["1"])
+    assert store.get("missing") is None
+
+
+def test_changes_are_only_committed_by_put(store):
+    state = sample_state()
+    store.put("s1", state)
+    state.shown.append("2")
+    loaded = store.get("s1")
+    loaded.shown.append("3")
+    loaded.history.append({"role": "assistant", "content": "..."})
+    assert store.get("s1").shown == ["1"]
+    assert len(store.get("s1").history) == 1
+
+    store.put("s1", loaded)
+    assert store.get("s1").shown == ["1", "3"]
+
+
+def test_expired_sessions_are_dropped(store, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store.time, "time", lambda: now[0])
+    store.put("s1", sample_state())
+    now[0] += 59
+    assert store.get("s1") is not None
+    now[0] += 2
+    assert store.get("s1") is None
+
+
+def test_delete(store):
+    store.put("s1", sample_state())
+    store.delete("s1")
+    store.delete("s1")
+    assert store.get("s1") is None
+
+
+def test_in_memory_store_evicts_least_recently_used():
+    store = InMemorySessionStore(max_sessions=2)
+    store.put("a", sample_state())
+    store.put("b", sample_state())
+    store.get("a")
+    store.put("c", sample_state())
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+
+
+def test_sqlite_store_survives_reopen(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path)
+    store.put("s1", sample_state())
+    store.close()
+    store = SQLiteSessionStore(path)
+    assert store.get("s1").candidates == ["1", "2", "3"]
+    store.close()
+
+
+def test_make_session_store(tmp_path):
+    assert isinstance(make_session_store(), InMemorySessionStore)
+    store = make_session_store(f"sqlite:///{tmp_path / 'sessions.db'}")
+    assert isinstance(store, SQLiteSessionStore)
+    store.close()
+    with pytest.raises(ValueError):
+        make_session_store("postgres://localhost/sessions")
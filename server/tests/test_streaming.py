@@ -0,0 +1,42 @@
+import re
+
+import pytest
+
+from streaming import ProductIdStreamFilter, clean_response
+
+TEXT_REPLY = (
+    "Here are a few sarees you might like:\n"
+    "1. Red Banarasi silk saree\nProduct ID: 101\n"
+    "2. Maroon georgette saree\n  Product ID: 2045\n"
+    "Let me know if you'd like other colours!"
+)
+
+
+def feed_in_chunks(parser, raw, size):
+    text, ids = [], []
+    for start in range(0, len(raw), size):
+        chunk_text, chunk_ids = parser.feed(raw[start:start + size])
+        text.append(chunk_text)
+        ids.extend(chunk_ids)
+    tail_text, tail_ids = parser.close()
+    return "".join(text) + tail_text, ids + tail_ids
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 13, len(TEXT_REPLY)])
+def test_stream_filter_matches_the_batch_cleanup(size):
+    text, ids = feed_in_chunks(ProductIdStreamFilter(), TEXT_REPLY, size)
+    assert text.strip() == clean_response(TEXT_REPLY)
+    assert ids == re.findall(r"Product ID:\s*(\d{1,6})", TEXT_REPLY)
+
+
+def test_stream_filter_emits_an_id_only_once_complete():
+    parser = ProductIdStreamFilter()
+    assert parser.feed("Pick one\nProduct ID: 12") == ("Pick one", [])
+    assert parser.feed("3\n") == ("", ["123"])
+
+
+def test_stream_filter_holds_back_a_partial_marker():
+    parser = ProductIdStreamFilter()
+    text, _ = parser.feed("Nice saree\nProduct I")
+    assert text == "Nice saree"
+    assert parser.close() == ("\nProduct I", [])
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from streaming import ResponseStreamParser, StructuredResponseParser, clean_response, parse_reply
+
+TEXT_REPLY = (
+    "Here are a few sarees you might like:\n"
+    "1. Red Banarasi silk saree\nProduct ID: 101\n"
+    "2. Maroon georgette saree\n  Product ID: 2045\n"
+    "Let me know if you'd like other colours!"
+)
+
+STRUCTURED_REPLY = json.dumps({
+    "message": 'Try these "festive" picks:\n1. Red saree — \U0001F451 \\ done',
+    "notes": {"skip": ["this", {"nested": "}"}]},
+    "product_ids": ["101", 2045, " 77 "],
+})
+
+
+def feed_in_chunks(parser, raw, size):
+    text, ids = [], []
+    for start in range(0, len(raw), size):
+        chunk_text, chunk_ids = parser.feed(raw[start:start + size])
+        text.append(chunk_text)
+        ids.extend(chunk_ids)
+    tail_text, tail_ids = parser.close()
+    return "".join(text) + tail_text, ids + tail_ids
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 11, len(STRUCTURED_REPLY)])
+def test_structured_parser_matches_json_loads(size):
+    expected = json.loads(STRUCTURED_REPLY)
+    parser = StructuredResponseParser()
+    text, ids = feed_in_chunks(parser, STRUCTURED_REPLY, size)
+    assert text == expected["message"]
+    assert ids == ["101", "2045", "77"]
+    assert parser.complete and not parser.failed
+
+
+def test_structured_parser_keeps_everything_before_a_cut():
+    raw = '{"message": "Here you go", "product_ids": ["12", 34, 5'
+    text, ids = feed_in_chunks(StructuredResponseParser(), raw, 4)
+    # 5 may be the start of 56, so a number cut off at the end is dropped
+    assert text == "Here you go"
+    assert ids == ["12", "34"]
+
+
+def test_structured_parser_flags_non_json():
+    parser = StructuredResponseParser()
+    assert parser.feed("Sure! Product ID: 1") == ("", [])
+    assert parser.failed
+
+
+@pytest.mark.parametrize("raw", [TEXT_REPLY, STRUCTURED_REPLY, "  \n" + STRUCTURED_REPLY])
+def test_response_stream_parser_picks_the_format(raw):
+    streamed_text, streamed_ids = feed_in_chunks(ResponseStreamParser(), raw, 3)
+    message, ids, structured = parse_reply(raw)
+    assert streamed_text.strip() == message
+    assert streamed_ids == ids
+    assert structured == raw.lstrip().startswith("{")
+
+
+def test_parse_reply_reads_both_formats():
+    assert parse_reply(TEXT_REPLY) == (clean_response(TEXT_REPLY), ["101", "2045"], False)
+    message, ids, structured = parse_reply('{"message": " Hi ", "product_ids": [9]}')
+    assert (message, ids, structured) == ("Hi", ["9"], True)
@@ -0,0 +1,264 @@
+import asyncio
+import time
+
+import pytest
+
+import upstream
+from upstream import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, TokenBucket, UpstreamGateway, UpstreamTimeout, UpstreamUnavailable,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(upstream.time, "monotonic", clock)
+    return clock
+
+
+def make_gateway(events=None, **settings):
+    if events is not None:
+        settings["on_event"] = lambda name, event: events.append(event)
+    return UpstreamGateway("test", **settings)
+
+
+def test_token_bucket_allows_a_burst_then_queues(clock):
+    bucket = TokenBucket(rate=2.0, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    # Out of tokens: the next caller waits for one to refill, the one after for two
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(1.0)
+    # Both reservations are paid back after a second, the next token half a second later
+    clock.now += 1.0
+    assert bucket.wait_time() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.wait_time() == pytest.approx(0.0)
+
+
+def test_token_bucket_try_acquire_never_waits(clock):
+    bucket = TokenBucket(rate=1.0, burst=1)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    clock.now += 1.0
+    assert bucket.try_acquire()
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=10)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_success()
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == pytest.approx(10)
+
+
+def test_breaker_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, cooldown=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_breaker_failed_trial_reopens(clock):
+    breaker = CircuitBreaker("test", failure_threshold=5, cooldown=10)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_released_trial_can_be_retried(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, cooldown=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.release_trial()
+    assert breaker.allow()
+
+
+def test_gateway_sheds_beyond_concurrency_and_queue():
+    events = []
+
+    async def scenario():
+        gateway = make_gateway(events, max_concurrency=1, max_queue=1, deadline=5)
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "ok"
+
+        first = asyncio.ensure_future(gateway.call(slow, hedge=False))
+        second = asyncio.ensure_future(gateway.call(slow, hedge=False))
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamUnavailable) as shed:
+            await gateway.call(slow, hedge=False)
+        assert shed.value.retry_after >= 1
+        release.set()
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == ["ok", "ok"]
+    assert events.count("shed") == 1
+    assert events.count("ok") == 2
+
+
+def test_gateway_deadline_starts_when_the_call_takes_a_slot():
+    events = []
+
+    async def scenario():
+        gateway = make_gateway(events, max_concurrency=2, max_queue=2, deadline=0.5, failure_threshold=2)
+
+        async def call():
+            return await gateway.call(lambda: asyncio.sleep(0.3, "ok"), hedge=False)
+
+        results = await asyncio.gather(*(call() for _ in range(4)))
+        return gateway, results
+
+    gateway, results = asyncio.run(scenario())
+    # The queued pair waited 0.3s for a slot but still had their full deadline
+    assert results == ["ok"] * 4
+    assert gateway.breaker.state == CLOSED
+    assert "timeout" not in events
+
+
+def test_gateway_queue_timeout_is_not_a_breaker_failure():
+    async def scenario():
+        gateway = make_gateway(max_concurrency=1, max_queue=4, deadline=0.05, failure_threshold=1)
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(gateway.call(release.wait, deadline=5, hedge=False))
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamTimeout):
+            await gateway.call(lambda: asyncio.sleep(0, "ok"), hedge=False)
+        release.set()
+        await holder
+        return gateway
+
+    assert asyncio.run(scenario()).breaker.state == CLOSED
+
+
+def test_gateway_call_timeout_counts_as_failure():
+    async def scenario():
+        gateway = make_gateway(deadline=0.05, failure_threshold=1)
+        with pytest.raises(UpstreamTimeout):
+            await gateway.call(lambda: asyncio.sleep(1), hedge=False)
+        return gateway
+
+    assert asyncio.run(scenario()).breaker.state == OPEN
+
+
+def test_gateway_opens_circuit_and_fails_fast():
+    events = []
+
+    async def scenario():
+        gateway = make_gateway(events, failure_threshold=2, cooldown=60)
+
+        async def failing():
+            raise ConnectionError("upstream down")
+
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await gateway.call(failing)
+        calls = []
+
+        async def counted():
+            calls.append(1)
+            return "ok"
+
+        with pytest.raises(UpstreamUnavailable) as rejected:
+            await gateway.call(counted)
+        assert not calls
+        assert rejected.value.retry_after >= 59
+        return gateway
+
+    assert asyncio.run(scenario()).breaker.state == OPEN
+    assert events == ["error", "error", "circuit_open"]
+
+
+def test_gateway_ignores_errors_that_are_not_failures():
+    async def scenario():
+        gateway = make_gateway(failure_threshold=1, is_failure=lambda error: not isinstance(error, ValueError))
+
+        async def bad_request():
+            raise ValueError("400")
+
+        with pytest.raises(ValueError):
+            await gateway.call(bad_request)
+        return gateway
+
+    assert asyncio.run(scenario()).breaker.state == CLOSED
+
+
+def test_gateway_hedges_a_slow_call():
+    events = []
+
+    async def scenario():
+        gateway = make_gateway(events, hedge_after=0.05, deadline=5)
+        attempts = []
+
+        async def attempt():
+            attempts.append(1)
+            # The first attempt stalls; the hedge answers at once
+            await asyncio.sleep(2 if len(attempts) == 1 else 0)
+            return len(attempts)
+
+        start = time.perf_counter()
+        result = await gateway.call(attempt)
+        return result, time.perf_counter() - start
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == 2
+    assert elapsed < 1
+    assert events == ["hedge", "ok"]
+
+
+def test_gateway_does_not_hedge_when_disabled():
+    events = []
+
+    async def scenario():
+        gateway = make_gateway(events, hedge_after=0.01, deadline=5)
+        return await gateway.call(lambda: asyncio.sleep(0.05, "ok"), hedge=False)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert events == ["ok"]
+
+
+def test_shed_call_releases_the_half_open_trial():
+    async def scenario():
+        gateway = make_gateway(max_concurrency=1, max_queue=0, failure_threshold=1, cooldown=0.01)
+
+        async def failing():
+            raise ConnectionError("down")
+
+        with pytest.raises(ConnectionError):
+            await gateway.call(failing)
+        await asyncio.sleep(0.02)
+        # The trial call is shed before reaching upstream (no free slot)...
+        gateway.in_flight = 1
+        with pytest.raises(UpstreamUnavailable):
+            await gateway.call(lambda: asyncio.sleep(0, "ok"))
+        gateway.in_flight = 0
+        # ...so the next caller still gets to be the trial
+        return await gateway.call(lambda: asyncio.sleep(0, "ok")), gateway
+
+    result, gateway = asyncio.run(scenario())
+    assert result == "ok"
+    assert gateway.breaker.state == CLOSED
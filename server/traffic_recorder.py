@@ -0,0 +1,55 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Appends the body of every chat request to a JSON-lines file so live traffic
+# can be replayed later with bench/replay.py. Pure ASGI: the body is copied as
+# the app reads it, so nothing is parsed twice and responses are untouched.
+class TrafficRecorderMiddleware:
+    def __init__(self, app, path, paths=("/generate-response", "/generate-response/stream")):
+        self.app = app
+        self.path = path
+        self.paths = set(paths)
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        logger.info(f"Recording chat requests to {path}")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        received = time.time()
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    self._record(scope["path"], b"".join(chunks), received)
+            return message
+
+        await self.app(scope, receive_wrapper, send)
+
+    def _record(self, path, body, received):
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return
+        if not isinstance(request, dict) or "prompt" not in request:
+            return
+        line = json.dumps({
+            "ts": received,
+            "path": path,
+            "session_id": request.get("session_id"),
+            "prompt": request["prompt"],
+            "chat_history": request.get("chat_history") or [],
+        })
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
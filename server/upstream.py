@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+# Raised instead of calling upstream: the queue is full, the circuit is open or
+# the rate limit would hold the call past its deadline. `retry_after` is in seconds.
+class UpstreamUnavailable(RuntimeError):
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# The call (including any hedge) did not finish within its deadline
+class UpstreamTimeout(UpstreamUnavailable):
+    pass
+
+
+# Requests-per-second limiter. acquire() reserves a token and returns how long
+# the caller has to wait for it; the balance may go negative so waiters queue
+# up in arrival order. All state lives on the event loop, so no lock is needed.
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost=1.0):
+        self._refill()
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+    def acquire(self, cost=1.0):
+        wait = self.wait_time(cost)
+        self.tokens -= cost
+        return wait
+
+    # Take a token only if one is free right now (used for hedges)
+    def try_acquire(self, cost=1.0):
+        if self.wait_time(cost) > 0:
+            return False
+        self.tokens -= cost
+        return True
+
+
+# Opens after `failure_threshold` consecutive failures and rejects calls for
+# `cooldown` seconds, then lets a single trial call through (half-open): a
+# success closes it again, a failure re-opens it.
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, cooldown=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self):
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state, self._trial = HALF_OPEN, False
+        if self.state == HALF_OPEN:
+            if self._trial:
+                return False
+            self._trial = True
+        return True
+
+    def release_trial(self):
+        if self.state == HALF_OPEN:
+            self._trial = False
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.state, self.failures, self._trial = CLOSED, 0, False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(f"{self.name} circuit opened after {self.failures} consecutive failures")
+            self.state, self.opened_at, self._trial = OPEN, time.monotonic(), False
+
+
+# Admission control and resilience for one upstream API (chat or embeddings):
+#   - token-bucket rate limit (rate_per_minute; 0 = unlimited)
+#   - at most `max_concurrency` calls in flight; when `max_queue` callers are
+#     already waiting, new ones are shed at once with UpstreamUnavailable
+#   - a deadline on the queue wait and, from the moment the call takes a
+#     slot, a fresh one on the call itself; only the latter feeds the breaker
+#   - optional hedging: if the call has not finished after `hedge_after`
+#     seconds, a second identical call is started (rate limit permitting) and
+#     whichever finishes first wins
+#   - a circuit breaker over calls whose error `is_failure` accepts
+# `on_event(name, event)` is told each call's outcome ("ok", "error",
+# "timeout", "shed", "rate_limited", "circuit_open") and every "hedge".
+class UpstreamGateway:
+    def __init__(self, name, rate_per_minute=0, burst=None, max_concurrency=32, max_queue=64,
+                 deadline=30.0, hedge_after=0.0, failure_threshold=5, cooldown=30.0, is_failure=None,
+                 on_event=None):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst) if rate_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.breaker = CircuitBreaker(name, failure_threshold, cooldown)
+        self.is_failure = is_failure or (lambda error: True)
+        self.on_event = on_event
+        self.in_flight = 0
+        self.queued = 0
+        self.mean_latency = 1.0  # seconds, moving average of successful calls
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "circuit": self.breaker.state,
+            "mean_latency": self.mean_latency,
+        }
+
+    def _event(self, event):
+        if self.on_event is not None:
+            self.on_event(self.name, event)
+
+    def _reject(self, event, message, retry_after):
+        self._event(event)
+        raise UpstreamUnavailable(f"{self.name}: {message}", retry_after=max(1.0, math.ceil(retry_after)))
+
+    # Fail fast, without taking a slot, when a call would be rejected right now;
+    # lets a streaming endpoint answer 503 before it starts its response
+    def check(self):
+        if self.breaker.state == OPEN and self.breaker.retry_after() > 0:
+            self._reject("circuit_open", "circuit open", self.breaker.retry_after())
+        if self.queued + self.in_flight >= self.max_concurrency + self.max_queue:
+            backlog = (self.queued + self.in_flight) / self.max_concurrency
+            self._reject("shed", f"{self.queued} calls queued", backlog * self.mean_latency)
+
+    # Hold a concurrency slot for a block of upstream work, e.g. a whole
+    # streamed completion. Raises UpstreamUnavailable instead of waiting when
+    # the call would be shed; failures inside the block feed the breaker.
+    @asynccontextmanager
+    async def slot(self, deadline=None):
+        deadline = self.deadline if deadline is None else deadline
+        if not self.breaker.allow():
+            self._reject("circuit_open", "circuit open", self.breaker.retry_after())
+        recorded = False
+        try:
+            self.check()
+            if self.bucket is not None and self.bucket.wait_time() > deadline:
+                self._reject("rate_limited", "rate limit", self.bucket.wait_time())
+
+            # Waiting for a slot says nothing about upstream health: a timeout
+            # here is shed load, not a breaker failure
+            queue_expires = time.monotonic() + deadline
+            self.queued += 1
+            try:
+                if self.bucket is not None:
+                    await asyncio.sleep(self.bucket.acquire())
+                await asyncio.wait_for(self._semaphore.acquire(), max(0.0, queue_expires - time.monotonic()))
+            except asyncio.TimeoutError:
+                self._event("timeout")
+                raise UpstreamTimeout(f"{self.name}: timed out waiting for a slot", retry_after=1.0)
+            finally:
+                self.queued -= 1
+
+            self.in_flight += 1
+            start = time.monotonic()
+            expires = start + deadline
+            try:
+                yield expires
+            except Exception as e:
+                if isinstance(e, UpstreamTimeout) or self.is_failure(e):
+                    self.breaker.record_failure()
+                    recorded = True
+                self._event("timeout" if isinstance(e, UpstreamTimeout) else "error")
+                raise
+            else:
+                self.breaker.record_success()
+                recorded = True
+                self.mean_latency = 0.9 * self.mean_latency + 0.1 * (time.monotonic() - start)
+                self._event("ok")
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+        finally:
+            # A half-open trial that never reached upstream (shed, cancelled) frees the trial
+            if not recorded:
+                self.breaker.release_trial()
+
+    # Run `factory()` (a function returning a new awaitable per attempt) under
+    # the gateway. Hedging re-invokes the factory, so only use it for idempotent calls.
+    async def call(self, factory, deadline=None, hedge=True):
+        async with self.slot(deadline) as expires:
+            hedge_after = self.hedge_after if hedge else 0.0
+            return await self._attempt(factory, expires, hedge_after)
+
+    async def _attempt(self, factory, expires, hedge_after):
+        primary = asyncio.ensure_future(factory())
+        tasks = {primary}
+        try:
+            remaining = expires - time.monotonic()
+            if hedge_after and hedge_after < remaining:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done and (self.bucket is None or self.bucket.try_acquire()):
+                    logger.debug(f"Hedging slow {self.name} call after {hedge_after:.2f}s")
+                    self._event("hedge")
+                    tasks.add(asyncio.ensure_future(factory()))
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, timeout=max(0.0, expires - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise UpstreamTimeout(f"{self.name}: deadline exceeded", retry_after=1.0)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                # Every attempt so far failed; wait on any still running
+                if not tasks:
+                    raise next(iter(done)).exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+# Blocking embedding function (called from executor threads) whose upstream
+# calls go through a gateway running on `loop`
+class GatedEmbeddingFunction:
+    def __init__(self, embedding_function, gateway, loop):
+        self.embedding_function = embedding_function
+        self.gateway = gateway
+        self.loop = loop
+        self.model_name = getattr(embedding_function, "model_name", None)
+
+    def __call__(self, input):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            raise RuntimeError("GatedEmbeddingFunction must be called off the event loop")
+        future = asyncio.run_coroutine_threadsafe(
+            self.gateway.call(lambda: asyncio.to_thread(self.embedding_function, input)), self.loop
+        )
+        return future.result()
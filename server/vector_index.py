@@ -0,0 +1,261 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process serving only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Chroma's HNSW settings are passed as collection metadata at creation. M and
+# construction_ef are fixed then; search_ef can be changed afterwards.
+HNSW_M = "hnsw:M"
+HNSW_CONSTRUCTION_EF = "hnsw:construction_ef"
+HNSW_SEARCH_EF = "hnsw:search_ef"
+
+
+def _env_int(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+# HNSW metadata for a new collection; unset values keep Chroma's defaults
+# (M=16, construction_ef=100, search_ef=10)
+def hnsw_metadata(m=None, construction_ef=None, search_ef=None):
+    values = {
+        HNSW_M: m if m is not None else _env_int("HNSW_M"),
+        HNSW_CONSTRUCTION_EF: construction_ef if construction_ef is not None else _env_int("HNSW_CONSTRUCTION_EF"),
+        HNSW_SEARCH_EF: search_ef if search_ef is not None else _env_int("HNSW_SEARCH_EF"),
+    }
+    return {key: value for key, value in values.items() if value is not None}
+
+
+# The search_ef a collection is served with. chromadb >= 1.0 keeps it in the
+# collection configuration; older releases read the metadata key.
+def search_ef_of(collection):
+    configuration = getattr(collection, "configuration", None) or {}
+    hnsw = configuration.get("hnsw") or {}
+    if hnsw.get("ef_search") is not None:
+        return hnsw["ef_search"]
+    return (getattr(collection, "metadata", None) or {}).get(HNSW_SEARCH_EF)
+
+
+# Chroma has no per-call ef, so the served collection's search_ef is set when
+# it is opened. Collections without HNSW keys were built with the defaults.
+# chromadb >= 1.0 ignores metadata changes to HNSW keys, so the value is read
+# back rather than assumed.
+def apply_search_ef(collection, search_ef):
+    if not search_ef or search_ef_of(collection) == search_ef:
+        return
+    try:
+        if getattr(collection, "configuration", None) is not None:
+            collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+        else:
+            collection.modify(metadata={**(collection.metadata or {}), HNSW_SEARCH_EF: search_ef})
+    except Exception as e:
+        logger.warning(f"Could not set search_ef on {collection.name}: {e}")
+        return
+    current = search_ef_of(collection)
+    if current != search_ef:
+        logger.warning(f"Setting search_ef={search_ef} on {collection.name} had no effect (still {current})")
+    else:
+        logger.info(f"Set search_ef={search_ef} on {collection.name}")
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("The quantised vector index requires `pip install numpy`")
+    return numpy
+
+
+def _matches(table, row, where):
+    if "$and" in where:
+        return all(_matches(table, row, clause) for clause in where["$and"])
+    if "$or" in where:
+        return any(_matches(table, row, clause) for clause in where["$or"])
+    for field, condition in where.items():
+        value = table.value(row, field)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$nin" in condition and value in condition["$nin"]:
+                return False
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+# In-process int8 index over the collection's embeddings. Each dimension is
+# scaled symmetrically into [-127, 127]; a query is scored against the int8
+# codes in blocks, and the best `rerank` candidates are re-scored exactly
+# against the float32 vectors, which are memory-mapped from disk so only the
+# rows that get re-ranked are paged in. Resident memory is about a quarter of
+# a float32 copy. Embeddings are L2-normalised, so the inner product ranks
+# like Chroma's L2 distance; distances are reported as 1 - similarity.
+# The codes are memory-mapped read-only too, so worker processes on one host
+# share a single copy through the page cache.
+class QuantizedIndex:
+    CODES = "codes.npy"
+    SCALE = "scale.npy"
+    VECTORS = "vectors.npy"
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory, ids, codes, scale, vectors, manifest, rerank=64, block_rows=2048):
+        self.directory = directory
+        self.ids = ids
+        self.codes = codes
+        self.scale = scale
+        self.vectors = vectors
+        self.manifest = manifest
+        self.collection_name = manifest["collection"]
+        self.rerank = rerank
+        self.block_rows = block_rows
+        self._masks = OrderedDict()
+        self._masks_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, collection, directory, source_version=None, page_size=1000, **kwargs):
+        np = _numpy()
+        start = time.perf_counter()
+        ids, pages = [], []
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["embeddings"])
+            if not len(page["ids"]):
+                break
+            ids.extend(str(pid) for pid in page["ids"])
+            pages.append(np.asarray(page["embeddings"], dtype=np.float32))
+            offset += len(page["ids"])
+        if not ids:
+            raise ValueError(f"Collection {collection.name} is empty")
+        vectors = np.concatenate(pages)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1.0, norms)
+        scale = np.abs(vectors).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+        manifest = {
+            "collection": collection.name,
+            "source_version": source_version,
+            "count": len(ids),
+            "dim": int(vectors.shape[1]),
+            "ids": ids,
+        }
+
+        # Write next to the target and swap in, so readers never see a partial index
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=parent, prefix=".index-")
+        np.save(os.path.join(staging, cls.CODES), codes)
+        np.save(os.path.join(staging, cls.SCALE), scale)
+        np.save(os.path.join(staging, cls.VECTORS), vectors)
+        with open(os.path.join(staging, cls.MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(staging, directory)
+        logger.info(
+            f"Built int8 index for {collection.name}: {len(ids)} x {vectors.shape[1]} "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+        return cls.load(directory, **kwargs)
+
+    @classmethod
+    def load(cls, directory, **kwargs):
+        np = _numpy()
+        with open(os.path.join(directory, cls.MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        codes = np.load(os.path.join(directory, cls.CODES), mmap_mode="r")
+        scale = np.load(os.path.join(directory, cls.SCALE))
+        vectors = np.load(os.path.join(directory, cls.VECTORS), mmap_mode="r")
+        return cls(directory, manifest["ids"], codes, scale, vectors, manifest, **kwargs)
+
+    # Reuse the index on disk if it was built from the same alias write. An
+    # exclusive lock makes one process build it while the others wait and load.
+    @classmethod
+    def open(cls, collection, directory, source_version=None, **kwargs):
+        os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+        with open(os.path.abspath(directory) + ".lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = cls.load(directory, **kwargs)
+                if index.collection_name == collection.name and index.manifest.get("source_version") == source_version:
+                    logger.info(f"Loaded int8 index for {collection.name} from {directory}")
+                    return index
+            except (FileNotFoundError, ValueError, KeyError):
+                pass
+            return cls.build(collection, directory, source_version=source_version, **kwargs)
+
+    def memory_bytes(self):
+        return int(self.codes.nbytes + self.scale.nbytes)
+
+    # Boolean row mask for a Chroma-style `where` filter, evaluated against the
+    # product table; masks are cached because the same filters recur
+    def _mask(self, where, table):
+        key = (id(table), json.dumps(where, sort_keys=True))
+        with self._masks_lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        np = _numpy()
+        mask = np.zeros(len(self.ids), dtype=bool)
+        for row, pid in enumerate(self.ids):
+            table_row = table.row(pid)
+            mask[row] = table_row is not None and _matches(table, table_row, where)
+        with self._masks_lock:
+            self._masks[key] = mask
+            if len(self._masks) > 256:
+                self._masks.popitem(last=False)
+        return mask
+
+    # Same call and result shape as collection.query for the fields used here
+    def query(self, query_embeddings, n_results, where=None, table=None):
+        np = _numpy()
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1.0, norms)
+        mask = self._mask(where, table) if where and table is not None else None
+
+        # Approximate scores against the int8 codes, a block of rows at a time
+        scaled = queries * self.scale
+        scores = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        for start in range(0, len(self.ids), self.block_rows):
+            block = self.codes[start:start + self.block_rows].astype(np.float32)
+            scores[:, start:start + len(block)] = scaled @ block.T
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+
+        results = {"ids": [], "distances": []}
+        shortlist_size = min(len(self.ids), max(self.rerank, n_results))
+        for query, row_scores in zip(queries, scores):
+            if shortlist_size < len(row_scores):
+                shortlist = np.argpartition(-row_scores, shortlist_size - 1)[:shortlist_size]
+            else:
+                shortlist = np.arange(len(row_scores))
+            # Sorted rows make the memory-mapped reads sequential
+            shortlist = np.sort(shortlist[np.isfinite(row_scores[shortlist])])
+            if self.rerank:
+                # Exact re-rank on the full-precision vectors
+                similarities = self.vectors[shortlist] @ query
+            else:
+                similarities = row_scores[shortlist]
+            order = np.argsort(-similarities)[:n_results]
+            results["ids"].append([self.ids[row] for row in shortlist[order]])
+            results["distances"].append([float(1.0 - similarities[i]) for i in order])
+        return results
@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+from collections import Counter
+
+from embedding_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+
+# Prompt frequencies in a queries file: recorded traffic (RECORD_REQUESTS_PATH
+# format), conversations like client/src/test.jsonl, or plain text, one per
+# line. Counts are keyed by normalised prompt, with the first original seen.
+def count_queries(path, counts=None, originals=None):
+    counts = Counter() if counts is None else counts
+    originals = {} if originals is None else originals
+    if not path or not os.path.exists(path):
+        return counts, originals
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            prompts = [line]
+            if line.startswith("{"):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "prompt" in record:
+                    prompts = [record["prompt"]]
+                else:
+                    prompts = [
+                        message.get("content", "") for message in record.get("messages", [])
+                        if message.get("role") == "user"
+                    ]
+            for prompt in prompts:
+                key = normalize_prompt(prompt)
+                if key:
+                    counts[key] += 1
+                    originals.setdefault(key, prompt)
+    return counts, originals
+
+
+# Most frequent prompts from a queries file (see count_queries for formats)
+def load_warmup_queries(path, limit):
+    counts, originals = count_queries(path)
+    return [originals[key] for key, _ in counts.most_common(limit)]
+
+
+# Blocking: push the queries through the embedder (filling the embedding cache)
+# and run one vector search so index pages and code paths are hot
+def warm_up(embedder, search, queries, batch_size=64):
+    embedded = 0
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        embeddings = embedder(batch)
+        embedded += len(batch)
+        if start == 0 and search is not None:
+            search(embeddings[:1])
+    logger.info(f"Warm-up embedded {embedded} common queries")
+    return embedded